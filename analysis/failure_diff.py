@@ -0,0 +1,184 @@
+from loggable.loggable import Loggable
+from summary.iteration_result import IterationResult
+from summary.statistics import RunningStats
+from stream.capture import EMPTY_DIGEST
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import threading
+import logging
+import math
+
+SESSION = 'all'  # Iteration of the report in its file name, as it covers the whole session
+REPORTED_FEATURES = 20
+MAX_DISTINCT_VALUES = 1000  # Per output, values past it are counted as one
+
+# Resource usage fields of the iteration results compared, and their descriptions
+MEASUREMENTS = {'wall_time': 'wall time (s)',
+                'cpu_time': 'CPU time (s)',
+                'max_rss': 'peak RSS (bytes)',
+                'read_bytes': 'read (bytes)',
+                'write_bytes': 'written (bytes)',
+                'memory_peak': 'cgroup memory peak (bytes)',
+                'pids_peak': 'cgroup processes peak'}
+OUTPUTS = ('stdout', 'stderr')
+OTHER_VALUE = 'other'
+
+
+class Fingerprint(NamedTuple):
+    """
+    Compact description of an iteration, compared across failed and successful iterations.
+    """
+    result: IterationResult
+    syscalls: Optional[Dict[str, int]] = None  # System call name to number of calls, None if not traced
+    stdout_hash: Optional[str] = None  # Hash of the output, None if not captured
+    stderr_hash: Optional[str] = None
+
+
+class FailureDiff(Loggable):
+    """
+    Analysis of what differs between the failed and the successful
+    iterations of a session.
+    The fingerprint of every iteration is folded into aggregates per
+    outcome as it is added: running mean and standard deviation of every
+    measurement and system call count, and frequencies of the output
+    hashes, so memory does not grow with the number of iterations.
+    At the end of the session, the features are ranked by effect size,
+    Cohen's d of the difference of means for measurements, Cohen's h of
+    the difference of proportions for output hashes, both read as small
+    from 0.2, medium from 0.5 and large from 0.8, and a report of the top
+    ones is written, if there were both failed and successful iterations.
+    """
+
+    def __init__(self, command: str, debug_logger: logging.Logger):
+        """
+        :param command: command ran.
+        :param debug_logger: for print debugging.
+        """
+        super().__init__(command, SESSION, str(self), debug_logger)
+        self.iterations = {True: 0, False: 0}  # Failed to count
+        self.__traced = {True: 0, False: 0}  # Failed to count of the iterations with system calls
+        self.__stats: Dict[bool, Dict[str, RunningStats]] = {True: {}, False: {}}
+        self.__values: Dict[bool, Dict[Tuple[str, str], int]] = {True: {}, False: {}}
+        self.__distinct: Dict[str, set] = {output: set() for output in OUTPUTS}
+        self.__lock = threading.Lock()  # Iterations run in parallel add from their threads
+
+    def add(self, fingerprint: Fingerprint):
+        """
+        Account for an iteration.
+        :param fingerprint: fingerprint of the iteration.
+        """
+        failed = fingerprint.result.failed
+        with self.__lock:
+            self.iterations[failed] += 1
+            stats = self.__stats[failed]
+            for field in MEASUREMENTS:
+                self.__accumulate(stats, field, getattr(fingerprint.result, field))
+
+            if fingerprint.syscalls is not None:
+                self.__traced[failed] += 1
+                for name, calls in fingerprint.syscalls.items():
+                    self.__accumulate(stats, f'syscall {name}', calls)
+
+            values = self.__values[failed]
+            for output, value in zip(OUTPUTS, (fingerprint.stdout_hash, fingerprint.stderr_hash)):
+                if value is None:
+                    continue
+                distinct = self.__distinct[output]
+                if value not in distinct and len(distinct) >= MAX_DISTINCT_VALUES:
+                    value = OTHER_VALUE
+                distinct.add(value)
+                values[(output, value)] = values.get((output, value), 0) + 1
+
+    def ranking(self) -> List[Tuple[float, str]]:
+        """
+        :return: list of tuples of effect size and description of the features, most separating first.
+        """
+        failed, passed = self.iterations[True], self.iterations[False]
+        if not failed or not passed:
+            return []
+
+        features = []
+        with self.__lock:
+            for feature in set(self.__stats[True]) | set(self.__stats[False]):
+                stats = [self.__mean_stddev(outcome, feature) for outcome in (True, False)]
+                if None in stats:
+                    continue
+                (failed_mean, failed_stddev), (passed_mean, passed_stddev) = stats
+                size = self.__cohens_d(failed_mean, failed_stddev, passed_mean, passed_stddev)
+                if size > 0:
+                    name = MEASUREMENTS.get(feature, feature)
+                    features.append((size, f'{name}: failures mean {failed_mean:.6g} (stddev {failed_stddev:.6g}),'
+                                           f' successes mean {passed_mean:.6g} (stddev {passed_stddev:.6g});'
+                                           f' d={size:.2f}'))
+
+            for output, value in set(self.__values[True]) | set(self.__values[False]):
+                failed_ratio = self.__values[True].get((output, value), 0) / failed
+                passed_ratio = self.__values[False].get((output, value), 0) / passed
+                size = abs(2 * math.asin(math.sqrt(failed_ratio)) - 2 * math.asin(math.sqrt(passed_ratio)))
+                if size > 0:
+                    label = ' (empty)' if value == EMPTY_DIGEST else ''
+                    features.append((size, f'{output} hash {value}{label}: in {failed_ratio:.1%} of failures,'
+                                           f' {passed_ratio:.1%} of successes; h={size:.2f}'))
+
+        return sorted(features, key=lambda feature: feature[0], reverse=True)
+
+    def dump_to_file(self):
+        """
+        Write the report of the features most separating failures from successes to a file.
+        """
+        failed, passed = self.iterations[True], self.iterations[False]
+        if not failed or not passed:
+            self.debug_logger.debug(f'No failure diff, as {failed} iterations failed and {passed} succeeded')
+            return
+
+        self.debug_logger.debug(f'Dumping to file failure diff of command {self.command}')
+        ranking = self.ranking()
+        try:
+            with self._open_log() as fd:
+                fd.write(f'Failure diff of "{self.command}": {failed} failed and {passed} successful iterations\n')
+                if not ranking:
+                    fd.write('No feature differs between failures and successes\n')
+                    return
+                fd.write(f'Top {min(len(ranking), REPORTED_FEATURES)} features separating failures from'
+                         f' successes, by effect size (small from 0.2, medium from 0.5, large from 0.8):\n')
+                fd.writelines(f'{rank}. {description}\n'
+                              for rank, (_, description) in enumerate(ranking[:REPORTED_FEATURES], start=1))
+        except EnvironmentError as e:
+            print(e)
+
+    def __mean_stddev(self, failed: bool, feature: str):
+        """
+        :return: tuple of mean and standard deviation of a feature for an outcome, or None if never measured.
+        System calls not made in a traced iteration count as 0 calls.
+        """
+        stats = self.__stats[failed].get(feature)
+        count, mean, stddev = (stats.count, stats.mean, stats.stddev) if stats is not None else (0, 0.0, 0.0)
+        traced = self.__traced[failed]
+        if feature.startswith('syscall ') and count < traced:
+            # Merge the iterations without the call, as many zeros, into the statistics of those with it
+            zeros = traced - count
+            variance = (stddev * stddev * count + mean * mean * count * zeros / traced) / traced
+            mean, stddev, count = mean * count / traced, math.sqrt(variance), traced
+        if not count:
+            return None
+        return mean, stddev
+
+    @staticmethod
+    def __cohens_d(failed_mean: float, failed_stddev: float, passed_mean: float, passed_stddev: float):
+        difference = abs(failed_mean - passed_mean)
+        pooled = math.sqrt((failed_stddev ** 2 + passed_stddev ** 2) / 2)
+        if difference == 0:
+            return 0.0
+        # Constant within each outcome but different, the feature separates them perfectly
+        return difference / pooled if pooled > 0 else math.inf
+
+    @staticmethod
+    def __accumulate(stats: Dict[str, RunningStats], feature: str, value: Optional[float]):
+        if value is None:
+            return
+        entry = stats.get(feature)
+        if entry is None:
+            entry = stats[feature] = RunningStats(quantiles=())
+        entry.add(value)
+
+    def __str__(self):
+        return 'failure_diff'
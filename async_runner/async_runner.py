@@ -0,0 +1,233 @@
+from summary.iteration_result import IterationResult, EXIT_NOT_EXECUTABLE, EXIT_NOT_FOUND
+from summary.summary import Summary
+from stream.spill_buffer import SpillBuffer
+from stream.stream import Stream
+from timeout.timeout import KILL_GRACE, kill_tree
+from typing import List, NamedTuple, Optional
+import asyncio
+import logging
+import signal
+import time
+import os
+
+CHUNK_SIZE = 1 << 16  # Bytes
+
+
+class IterationOutcome(NamedTuple):
+    """
+    Result of an iteration run by the asyncio runner, along with its captured outputs.
+    """
+    iteration: int
+    result: IterationResult
+    stdout: Optional[bytes] = None  # None if outputs are not captured
+    stderr: Optional[bytes] = None
+
+
+class AsyncRunner:
+    """
+    Asyncio counterpart of Runner, for harnesses running many commands at once
+    from a single process, without a thread or a runner interpreter per command.
+    The command is spawned with asyncio.create_subprocess_exec, and its output
+    pipes are read without blocking as the event loop is notified of data.
+    Tracers and system measurements take blocking threads and processes of
+    their own per iteration, so only timeouts and output capturing are
+    supported. Processes are reaped by the child watcher of the event loop
+    rather than with wait4, so their CPU time and peak RSS are not available.
+    """
+
+    def __init__(self,
+                 command: str,
+                 debug_logger: logging.Logger = None,
+                 capture_output=False,
+                 log_trace=False,
+                 timeout=None):
+        """
+        :param command: command to run.
+        :param debug_logger: for print debugging, a logger of this module if not given.
+        :param capture_output: if True, stdout and stderr of the command are returned with the results,
+                               otherwise the command writes straight to those of the process.
+        :param log_trace: if True, stdout and stderr of the command will be dumped to files if command fails.
+        :param timeout: if given, time in seconds after which the process group of the command is killed.
+        """
+        self.command = command
+        self.argv = command.split()
+        self.debug_logger = debug_logger if debug_logger is not None else logging.getLogger(__name__)
+        self.capture_output = capture_output
+        self.log_trace = log_trace
+        self.timeout = timeout
+
+    async def run(self, iteration: int) -> IterationOutcome:
+        """
+        Run the command once.
+        A command that cannot be run (e.g. not found) makes a failed iteration, of
+        return code 127 if not found and 126 otherwise, as a shell would return,
+        the error being its captured stderr.
+        :param iteration: iteration number, for debugging and logging.
+        :return: IterationOutcome object, with the result and the captured outputs of the command.
+        """
+        captured = self.capture_output or self.log_trace
+        buffers = [SpillBuffer(), SpillBuffer()] if captured else []
+
+        try:
+            self.debug_logger.debug(f'Spawning a child process to run the command \"{self.command}\"')
+            started = time.monotonic()
+            # With a timeout, the command leads its own process group, to be killed along with its descendants
+            try:
+                process = await asyncio.create_subprocess_exec(*self.argv,
+                                                               stdout=asyncio.subprocess.PIPE if captured else None,
+                                                               stderr=asyncio.subprocess.PIPE if captured else None,
+                                                               start_new_session=self.timeout is not None)
+            except OSError as e:
+                self.debug_logger.debug(f'Could not run command \"{self.command}\": {e}')
+                result = IterationResult(return_code=EXIT_NOT_FOUND if isinstance(e, FileNotFoundError)
+                                         else EXIT_NOT_EXECUTABLE,
+                                         wall_time=time.monotonic() - started,
+                                         cpu_time=None,
+                                         max_rss=None)
+                return IterationOutcome(iteration, result, *((b'', f'{e}\n'.encode()) if self.capture_output
+                                                             else (None, None)))
+            try:
+                reads = [self.__read(pipe, buffer) for pipe, buffer in zip((process.stdout, process.stderr), buffers)]
+                (return_code, wall_time, timed_out), *_ = await asyncio.gather(self.__wait(process, started), *reads)
+            except BaseException:
+                # Cancelled, e.g. as another iteration raised, so the command is not left running, nor its descendants
+                if process.returncode is None:
+                    if self.timeout is not None:
+                        self.__signal(process, signal.SIGKILL)
+                    else:
+                        kill_tree(process.pid)
+                    # Reaped while the event loop runs, which it may not after the cancellation
+                    await process.wait()
+                raise
+
+            self.debug_logger.debug(f'Command \"{self.command}\" of iteration {iteration}'
+                                    f'{" timed out and" if timed_out else ""} returned with code: {return_code}')
+            result = IterationResult(return_code=return_code, wall_time=wall_time, cpu_time=None, max_rss=None,
+                                     timed_out=timed_out)
+
+            outputs = [buffer.getvalue() for buffer in buffers] if self.capture_output else [None, None]
+            if result.failed and self.log_trace:
+                # Written off the event loop, so other iterations keep running meanwhile
+                streams = [Stream(buffer, stream_name, self.command, iteration, self.debug_logger)
+                           for buffer, stream_name in zip(buffers, ('stdout', 'stderr'))]
+                await asyncio.get_running_loop().run_in_executor(None, self.__dump, streams)
+
+        finally:
+            for buffer in buffers:
+                buffer.close()
+
+        return IterationOutcome(iteration, result, *outputs)
+
+    async def __wait(self, process: asyncio.subprocess.Process, started: float):
+        """
+        Wait for the command to exit, killing its process group past the timeout:
+        SIGTERM first, then SIGKILL if it is still running after a grace period.
+        :return: tuple of the return code, the wall time and whether the command timed out.
+        """
+        if self.timeout is None:
+            return_code = await process.wait()
+            return return_code, time.monotonic() - started, False
+
+        try:
+            return_code = await asyncio.wait_for(process.wait(), self.timeout)
+            return return_code, time.monotonic() - started, False
+        except asyncio.TimeoutError:
+            pass
+
+        self.debug_logger.debug(f'Process group {process.pid} timed out after {self.timeout}s, terminating it')
+        self.__signal(process, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), KILL_GRACE)
+        except asyncio.TimeoutError:
+            self.debug_logger.debug(f'Process group {process.pid} still running after {KILL_GRACE}s, killing it')
+            self.__signal(process, signal.SIGKILL)
+        return_code = await process.wait()
+        return return_code, time.monotonic() - started, True
+
+    @staticmethod
+    async def __read(pipe: asyncio.StreamReader, buffer: SpillBuffer):
+        """
+        Drain an output pipe of the command into a buffer, until it is closed.
+        """
+        while True:
+            data = await pipe.read(CHUNK_SIZE)
+            if not data:
+                return
+            buffer.write(data)
+
+    def __signal(self, process: asyncio.subprocess.Process, signum: int):
+        try:
+            if self.timeout is not None:
+                os.killpg(process.pid, signum)
+            else:
+                process.send_signal(signum)
+        except ProcessLookupError:
+            pass  # Already gone
+        except PermissionError as e:
+            self.debug_logger.debug(f'Could not signal process {process.pid}: {e}')
+
+    @staticmethod
+    def __dump(streams: List[Stream]):
+        for stream in streams:
+            stream.dump_to_file()
+
+
+async def run_many(command: str,
+                   count: int,
+                   concurrency: int = 1,
+                   failed_count: int = None,
+                   summary: Summary = None,
+                   debug_logger: logging.Logger = None,
+                   **options) -> List[IterationOutcome]:
+    """
+    Run a command a number of times, up to a given number of iterations at once.
+    Iterations are pulled by concurrency workers, so a huge count does not create as many tasks at once.
+    Once the allowed failed count is reached, no further iterations are started, and those
+    still running are cancelled, their commands killed, and left out of the outcomes.
+    :param command: command to run.
+    :param count: number of iterations to run.
+    :param concurrency: maximal number of iterations running at once.
+    :param failed_count: number of allowed failed iterations before giving up, or None for no limit.
+    :param summary: if given, summary to add the results to as they complete.
+    :param debug_logger: for print debugging, a logger of this module if not given.
+    :param options: keyword arguments of AsyncRunner, e.g. capture_output=True or timeout=10.
+    :return: list of IterationOutcome objects of the iterations run, ordered by iteration.
+    """
+    runner = AsyncRunner(command, debug_logger, **options)
+    outcomes = []
+    next_iteration = 0
+    failed = 0
+    given_up = False
+
+    async def worker():
+        nonlocal next_iteration, failed, given_up
+        while next_iteration < count and not given_up:
+            iteration = next_iteration
+            next_iteration += 1
+            try:
+                outcome = await runner.run(iteration)
+            except asyncio.CancelledError:
+                if given_up:
+                    return  # Cancelled by the worker that reached the failed count
+                raise
+            outcomes.append(outcome)
+            if summary is not None:
+                summary.add_result(outcome.result, iteration)
+            if outcome.result.failed:
+                failed += 1
+                if failed_count is not None and failed >= failed_count and not given_up:
+                    given_up = True
+                    for task in workers:
+                        if task is not asyncio.current_task():
+                            task.cancel()
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(max(1, min(concurrency, count)))]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        # Stop the other iterations, so none is left running past the call
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+    return sorted(outcomes, key=lambda outcome: outcome.iteration)
@@ -0,0 +1,53 @@
+"""
+Benchmark of the per-iteration overhead of the runner on a short command.
+Runs the command in-process through Runner.run, and as a baseline spawns
+and reaps it bare, then reports runs per second and the overhead per run.
+Usage: python benchmarks/spawn.py [-c COUNT] [COMMAND]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from runner import Runner  # noqa: E402
+
+
+def bare(argv, count):
+    """
+    Spawn and reap the command count times, with nothing around it.
+    :return: elapsed time, in seconds.
+    """
+    environment = dict(os.environ)
+    started = time.perf_counter()
+    for _ in range(count):
+        os.waitpid(os.posix_spawnp(argv[0], argv, environment), 0)
+    return time.perf_counter() - started
+
+
+def wrapped(command, count, **options):
+    """
+    Run the command count times through the runner, with no tracing unless given.
+    :param options: keyword arguments of the runner, e.g. sys_trace=True.
+    :return: elapsed time, in seconds.
+    """
+    runner = Runner(command, logging.getLogger(__name__), **options)
+    started = time.perf_counter()
+    for iteration in range(count):
+        runner.run(iteration)
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the per-iteration overhead of the runner.')
+    parser.add_argument('command', nargs='?', default='true', help='short command to run (default: true)')
+    parser.add_argument('-c', '--count', type=int, default=1000, help='number of runs (default: 1000)')
+    args = parser.parse_args()
+
+    bare_time = bare(args.command.split(), args.count)
+    wrapped_time = wrapped(args.command, args.count)
+    print(f'Bare:   {args.count / bare_time:.0f} runs/s')
+    print(f'Runner: {args.count / wrapped_time:.0f} runs/s')
+    print(f'Overhead: {(wrapped_time - bare_time) / args.count * 1e6:.0f}us per run')
@@ -0,0 +1,233 @@
+"""
+Benchmark suite of the runner's own overhead, with results saved as JSON
+so that regressions of the hot paths of Runner.run and metrics/ can be
+tracked across commits:
+- overhead per iteration of a short command, with no flags, -st, -ct, -lt and all of them,
+  relative to spawning and reaping it bare,
+- CPU consumption of the sampler, per sample and relative to the sampling time,
+- peak memory of the collectors (metrics, process tree and sampler) over a long run,
+- throughput of dumping the collected samples to text and columnar logs.
+Usage: python benchmarks/suite.py [-o OUTPUT] [--compare BASELINE] [--quick]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import psutil
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import tracemalloc
+import subprocess
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from spawn import bare, wrapped  # noqa: E402
+from loggable import loggable  # noqa: E402
+from metrics.disk_io import DiskIO  # noqa: E402
+from metrics.memory import Memory  # noqa: E402
+from metrics.proc_th_cpu import ProcThCpu  # noqa: E402
+from metrics.network import Network  # noqa: E402
+from metrics.metric import LOG_FORMATS  # noqa: E402
+from metrics.sampler import Sampler  # noqa: E402
+from metrics.process_tree import ProcessTree  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+OVERHEAD_COMMAND = 'true'
+
+# Runner options of each overhead configuration, and the tools they need
+CONFIGURATIONS = {'none': ({}, []),
+                  'st': ({'sys_trace': True}, []),
+                  'ct': ({'call_trace': True}, ['strace']),
+                  'lt': ({'log_trace': True}, []),
+                  'all': ({'sys_trace': True, 'call_trace': True, 'log_trace': True}, ['strace'])}
+
+debug_logger = logging.getLogger(__name__)
+
+
+def overhead(count):
+    """
+    Measure the overhead per iteration of the runner with each configuration.
+    :param count: number of runs per configuration.
+    :return: dict of configuration name to its results.
+    """
+    argv = OVERHEAD_COMMAND.split()
+    results = {}
+    for name, (options, tools) in CONFIGURATIONS.items():
+        missing = [tool for tool in tools if shutil.which(tool) is None]
+        if missing:
+            results[name] = {'skipped': f'{", ".join(missing)} not found'}
+            continue
+
+        bare_time = bare(argv, count)
+        wrapped_time = wrapped(OVERHEAD_COMMAND, count, **options)
+        results[name] = {'runs_per_second': count / wrapped_time,
+                         'bare_runs_per_second': count / bare_time,
+                         'overhead_us': (wrapped_time - bare_time) / count * 1e6}
+    return results
+
+
+def collect(duration, interval):
+    """
+    Sample a command sleeping for the given duration, as the runner does with -st.
+    :return: tuple of the metrics and the sampler, stopped.
+    """
+    argv = ['sleep', str(duration)]
+    pid = os.posix_spawnp(argv[0], argv, os.environ)
+    process = psutil.Process(pid)
+    tree = ProcessTree(process, debug_logger)
+    metrics = [metric_class(process, ' '.join(argv), 0, debug_logger, tree=tree)
+               for metric_class in (DiskIO, Memory, ProcThCpu, Network)]
+    sampler = Sampler(process, metrics, debug_logger, interval, tree=tree)
+    sampler.start()
+    os.waitpid(pid, 0)
+    sampler.stop()
+    tree.close()
+    return metrics, sampler
+
+
+def sampler_cpu(duration, interval):
+    """
+    Measure the CPU time the sampler consumes, the main thread being blocked meanwhile.
+    :return: dict of the results.
+    """
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    _, sampler = collect(duration, interval)
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu_time = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    stats = sampler.stats
+    sampling_time = (stats.stopped or 0) - (stats.started or 0)
+    return {'interval': interval,
+            'samples': stats.ticks,
+            'cpu_seconds': cpu_time,
+            'cpu_percent': cpu_time / sampling_time * 100 if sampling_time > 0 else 0.0,
+            'cpu_us_per_sample': cpu_time / stats.ticks * 1e6 if stats.ticks else 0.0,
+            'rate': stats.rate}
+
+
+def collector_memory(duration, interval):
+    """
+    Measure the peak memory allocated by the collectors over a long run.
+    :return: tuple of dict of the results, and the metrics, holding their samples.
+    """
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        metrics, sampler = collect(duration, interval)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'interval': interval,
+            'samples': sampler.stats.ticks,
+            'peak_bytes': peak - baseline,
+            'retained_bytes': current - baseline}, metrics
+
+
+def dump_throughput(metrics, repeat):
+    """
+    Measure the throughput of dumping the samples of the metrics, in every log format.
+    The logs are written to a temporary directory, removed afterwards.
+    :param metrics: metrics holding samples.
+    :param repeat: number of dumps per format.
+    :return: dict of log format to its results.
+    """
+    results = {}
+    logs_dir = loggable.LOGS_DIR
+    loggable.LOGS_DIR = tempfile.mkdtemp(prefix='runner-bench-')
+    try:
+        for log_format in LOG_FORMATS:
+            written = 0
+            started = time.perf_counter()
+            for iteration in range(repeat):
+                for metric in metrics:
+                    metric.log_format = log_format
+                    metric.iteration = f'{log_format}{iteration}'
+                    metric.dump_to_file()
+            elapsed = time.perf_counter() - started
+            for name in os.listdir(loggable.LOGS_DIR):
+                path = os.path.join(loggable.LOGS_DIR, name)
+                written += os.path.getsize(path)
+                os.remove(path)
+            results[log_format] = {'dumps': repeat * len(metrics),
+                                   'seconds': elapsed,
+                                   'dumps_per_second': repeat * len(metrics) / elapsed,
+                                   'megabytes_per_second': written / elapsed / 2 ** 20}
+    finally:
+        shutil.rmtree(loggable.LOGS_DIR, ignore_errors=True)
+        loggable.LOGS_DIR = logs_dir
+    return results
+
+
+def revision():
+    """
+    :return: the commit the tree is at, suffixed with '-dirty' if modified, or None if not in a git repository.
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (EnvironmentError, subprocess.CalledProcessError):
+        return None
+    return f'{commit}-dirty' if dirty else commit
+
+
+def flatten(results, prefix=''):
+    """
+    :return: dict of the numeric results, keyed by their dotted path.
+    """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(results, baseline_path):
+    """
+    Print the relative change of every result from those of a baseline run.
+    """
+    with open(baseline_path) as fd:
+        baseline = flatten(json.load(fd)['results'])
+    for key, value in flatten(results).items():
+        if key in baseline and baseline[key]:
+            print(f'{key}: {baseline[key]:.6g} -> {value:.6g} ({(value - baseline[key]) / baseline[key]:+.1%})')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the runner's own overhead.")
+    parser.add_argument('-o', '--output', help='path of the JSON results (default: results/<commit>.json)')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON results to compare with')
+    parser.add_argument('--quick', action='store_true', help='fewer runs and shorter sampling, for a smoke test')
+    args = parser.parse_args()
+
+    count, duration, repeat = (50, 0.5, 2) if args.quick else (500, 5.0, 10)
+    results = {'overhead': overhead(count),
+               'sampler_cpu': sampler_cpu(duration, 0.01)}
+    results['collector_memory'], samples = collector_memory(duration * 2, 0.001)
+    results['dump'] = dump_throughput(samples, repeat)
+
+    commit = revision()
+    report = {'commit': commit,
+              'timestamp': datetime.now().isoformat(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'cpus': os.cpu_count(),
+              'results': results}
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit or "unknown"}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as fd:
+        json.dump(report, fd, indent=2)
+
+    print(json.dumps(results, indent=2))
+    print(f'Results saved to {output}')
+    if args.compare is not None:
+        compare(results, args.compare)
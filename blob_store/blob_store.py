@@ -0,0 +1,243 @@
+from loggable.loggable import LOGS_DIR, CODECS, WRITE_BUFFER_SIZE, create_scratch_file, promote_file, remove_file, \
+    log_file_name
+from typing import Dict, Iterator, List, Tuple
+import threading
+import argparse
+import hashlib
+import logging
+import shutil
+import json
+import zlib
+import sys
+import os
+
+BLOBS_DIR = 'blobs'
+MANIFEST_SUBJECT = 'manifest'
+DIGEST_SIZE = 16  # Bytes
+READ_SIZE = 1 << 20  # Bytes
+
+# Artifacts larger than the threshold are split into chunks stored as blobs of their own. Chunks end at line ends,
+# after a line whose checksum has its low bits clear, so that boundaries follow the contents rather than offsets,
+# and the chunks after a line inserted or removed are still the same
+CHUNKING_THRESHOLD = 4 << 20  # Bytes
+CHUNK_BOUNDARY_MASK = (1 << 11) - 1  # A boundary every 2048 lines on average
+MIN_CHUNK_SIZE = 64 << 10  # Bytes
+MAX_CHUNK_SIZE = 4 << 20  # Bytes
+
+
+class BlobStore:
+    """
+    Content-addressed store of log files.
+    Each log file (artifact) is hashed, and its contents stored once as a
+    blob named by their hash, under logs/<TIMESTAMP>/blobs/, so the near
+    identical logs of a command failing over and over again take the
+    space and the writing time of one. Large artifacts are split into
+    content-defined chunks, stored as blobs of their own, so traces that
+    only partly differ share their common chunks.
+    Blobs are compressed if compression is set. A manifest per iteration,
+    <command>_<iteration>_manifest.json, maps the names of its log files
+    to the size and blobs of their contents, and restore() rebuilds them.
+    """
+
+    def __init__(self, debug_logger: logging.Logger, compression: str = None, root: str = None):
+        """
+        :param debug_logger: for print debugging.
+        :param compression: name of the codec to compress the blobs with, or None.
+        :param root: directory of the manifests and the blobs, the logs directory of the session if not given.
+        """
+        self.debug_logger = debug_logger
+        self.compression = compression
+        self.root = root if root is not None else LOGS_DIR
+        self.stored_bytes = 0  # Of contents written as new blobs
+        self.deduplicated_bytes = 0  # Of contents found already stored
+        self.__pending: Dict[Tuple[str, int], Dict[str, dict]] = {}  # Command and iteration to their artifacts
+        self.__lock = threading.Lock()
+
+    def put_file(self, path: str, command: str, iteration: int, name: str):
+        """
+        Store the contents of a scratch file as an artifact of an iteration.
+        The scratch file is consumed: renamed into a blob if new, removed otherwise.
+        :param path: path of the scratch file.
+        :param command: command ran.
+        :param iteration: iteration of the artifact.
+        :param name: name of the log file of the artifact.
+        """
+        size = os.path.getsize(path)
+        try:
+            if size > CHUNKING_THRESHOLD:
+                digests = [self.__put_bytes(chunk) for chunk in self.__chunks(path)]
+            else:
+                digests = [self.__put_scratch(path, size)]
+        finally:
+            remove_file(path)
+
+        self.debug_logger.debug(f'Stored {name} ({size} bytes) as {len(digests)} blobs')
+        with self.__lock:
+            self.__pending.setdefault((command, iteration), {})[name] = {'size': size, 'blobs': digests}
+
+    def write_manifest(self, command: str, iteration: int):
+        """
+        Write the manifest of the artifacts stored for an iteration, if any.
+        :param command: command ran.
+        :param iteration: iteration of the artifacts.
+        """
+        with self.__lock:
+            artifacts = self.__pending.pop((command, iteration), None)
+        if not artifacts:
+            return
+
+        manifest = {'command': command,
+                    'iteration': iteration,
+                    'compression': self.compression,
+                    'artifacts': artifacts}
+        path = os.path.join(self.root, log_file_name(command, iteration, MANIFEST_SUBJECT, 'json'))
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open(path, 'w') as fd:
+                json.dump(manifest, fd, indent=1)
+        except EnvironmentError as e:
+            print(e)
+
+    def blob_path(self, digest: str):
+        """
+        :param digest: digest of the contents of a blob.
+        :return: path of the blob.
+        """
+        suffix = f'.{CODECS[self.compression][1]}' if self.compression is not None else ''
+        return os.path.join(self.root, BLOBS_DIR, digest[:2], digest + suffix)
+
+    def __put_scratch(self, path: str, size: int):
+        """
+        Store a whole scratch file as a blob, by renaming it if it is new and not compressed.
+        :return: digest of its contents.
+        """
+        digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        with open(path, 'rb') as fd:
+            for data in iter(lambda: fd.read(READ_SIZE), b''):
+                digest.update(data)
+        digest = digest.hexdigest()
+
+        blob_path = self.blob_path(digest)
+        if self.__exists(blob_path, size):
+            return digest
+
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        if self.compression is None:
+            with open(path, 'rb') as fd:
+                os.fsync(fd.fileno())
+            promote_file(path, blob_path)
+        else:
+            with open(path, 'rb') as source:
+                self.__write_blob(blob_path, lambda fd: shutil.copyfileobj(source, fd, WRITE_BUFFER_SIZE))
+        return digest
+
+    def __put_bytes(self, data: bytes):
+        """
+        Store bytes as a blob, if not already stored.
+        :return: digest of the bytes.
+        """
+        digest = hashlib.blake2b(data, digest_size=DIGEST_SIZE).hexdigest()
+        blob_path = self.blob_path(digest)
+        if not self.__exists(blob_path, len(data)):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            self.__write_blob(blob_path, lambda fd: fd.write(data))
+        return digest
+
+    def __write_blob(self, blob_path: str, write):
+        """
+        Write a blob through a scratch file renamed once complete, so no partial blob is ever seen,
+        even if two iterations store the same contents at once.
+        """
+        scratch_fd, scratch_path = create_scratch_file('.blob')
+        try:
+            with open(scratch_fd, 'wb', buffering=WRITE_BUFFER_SIZE) as raw:
+                if self.compression is None:
+                    write(raw)
+                else:
+                    with CODECS[self.compression][0](raw, 'wb') as fd:
+                        write(fd)
+                raw.flush()
+                os.fsync(raw.fileno())
+            promote_file(scratch_path, blob_path)
+        except BaseException:
+            remove_file(scratch_path)
+            raise
+
+    def __exists(self, blob_path: str, size: int):
+        """
+        :return: True if the blob is already stored, accounting for the bytes stored or deduplicated.
+        """
+        exists = os.path.exists(blob_path)
+        with self.__lock:
+            if exists:
+                self.deduplicated_bytes += size
+            else:
+                self.stored_bytes += size
+        return exists
+
+    def __str__(self):
+        total = self.stored_bytes + self.deduplicated_bytes
+        return (f'{self.stored_bytes} bytes stored, {self.deduplicated_bytes} bytes deduplicated'
+                f' ({self.deduplicated_bytes / total if total else 0:.1%})')
+
+    @staticmethod
+    def __chunks(path: str) -> Iterator[bytes]:
+        """
+        Split a file into content-defined chunks, ending at line ends.
+        """
+        chunk: List[bytes] = []
+        size = 0
+        with open(path, 'rb', buffering=WRITE_BUFFER_SIZE) as fd:
+            for line in fd:
+                chunk.append(line)
+                size += len(line)
+                if size >= MAX_CHUNK_SIZE or (size >= MIN_CHUNK_SIZE and not zlib.crc32(line) & CHUNK_BOUNDARY_MASK):
+                    yield b''.join(chunk)
+                    chunk, size = [], 0
+        if chunk:
+            yield b''.join(chunk)
+
+
+def restore(manifest_path: str, destination: str, names: List[str] = None):
+    """
+    Rebuild the log files of an iteration from its manifest and the blobs next to it.
+    :param manifest_path: path of the manifest.
+    :param destination: directory to write the log files to.
+    :param names: names of the log files to rebuild, all of them if not given.
+    :return: list of the paths of the log files written.
+    """
+    with open(manifest_path) as fd:
+        manifest = json.load(fd)
+    store = BlobStore(logging.getLogger(__name__), manifest['compression'], os.path.dirname(manifest_path))
+
+    opener = CODECS[store.compression][0] if store.compression is not None else open
+    os.makedirs(destination, exist_ok=True)
+    paths = []
+    for name, artifact in manifest['artifacts'].items():
+        if names and name not in names:
+            continue
+        path = os.path.join(destination, name)
+        with open(path, 'wb') as out:
+            for digest in artifact['blobs']:
+                with opener(store.blob_path(digest), 'rb') as blob:
+                    shutil.copyfileobj(blob, out, WRITE_BUFFER_SIZE)
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the log files of iterations from their manifests.')
+    parser.add_argument('manifests', nargs='+', metavar='MANIFEST', help='manifest of an iteration')
+    parser.add_argument('-o', '--output', default='.', metavar='DIR',
+                        help='directory to write the log files to (default: current directory)')
+    parser.add_argument('-n', '--name', action='append', dest='names', metavar='NAME',
+                        help='name of a log file to rebuild, all of them if not given (may be repeated)')
+    args = parser.parse_args()
+
+    try:
+        for manifest_path in args.manifests:
+            for restored in restore(manifest_path, args.output, args.names):
+                print(restored)
+    except (EnvironmentError, ValueError, KeyError) as e:
+        print(e)
+        sys.exit(1)
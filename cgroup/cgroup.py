@@ -0,0 +1,265 @@
+from typing import List, NamedTuple, Optional
+import logging
+import os
+
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+CGROUP_PATH = '/proc/self/cgroup'
+CONTROLLERS = ('cpu', 'memory', 'io', 'pids')
+CPU_PERIOD = 100000  # Microseconds, of the cpu.max quota
+SUPERVISOR = 'supervisor'  # Leaf the runner moves itself to, as processes may only be in leaves
+
+# Moves itself to the cgroup given as $0 before turning into the command, so none of the command is left out
+ENTER_SCRIPT = 'echo 0 > "$0/cgroup.procs" && exec "$@"'
+
+
+class CgroupUsage(NamedTuple):
+    """
+    Resource usage of a cgroup, each None if its controller is not available.
+    """
+    cpu_time: Optional[float] = None  # Seconds, user and system
+    memory_peak: Optional[int] = None  # Bytes, peak memory of the cgroup, page cache included
+    pids_peak: Optional[int] = None  # Peak number of processes
+    read_bytes: Optional[int] = None  # Bytes read from block devices
+    write_bytes: Optional[int] = None  # Bytes written to block devices
+
+
+class Cgroup:
+    """
+    Leaf cgroup an iteration is run in.
+    Its accounting covers every process of the iteration, including
+    short-lived descendants that exit between samples and those not
+    waited for, and is read once, at exit, at no sampling cost.
+    """
+
+    def __init__(self, path: str, debug_logger: logging.Logger):
+        """
+        :param path: path of the cgroup directory, created.
+        :param debug_logger: for print debugging.
+        """
+        self.path = path
+        self.debug_logger = debug_logger
+
+    def wrap(self, split_command: List[str]) -> List[str]:
+        """
+        Wrap the command to enter the cgroup before it is executed.
+        Moving the command once spawned would race with it, its first descendants being forked outside the cgroup.
+        :param split_command: command as a list of arguments.
+        :return: wrapped command as a list of arguments.
+        """
+        return ['sh', '-c', ENTER_SCRIPT, self.path] + split_command
+
+    def add(self, pid: int):
+        """
+        Move a process into the cgroup. Its descendants forked from then on are created in it.
+        :param pid: pid of the process.
+        :return: True if moved, False if it already exited.
+        """
+        try:
+            with open(os.path.join(self.path, 'cgroup.procs'), 'w') as fd:
+                fd.write(str(pid))
+            return True
+        except ProcessLookupError:
+            return False
+
+    def usage(self) -> CgroupUsage:
+        """
+        Read the resource usage of the cgroup.
+        :return: CgroupUsage object.
+        """
+        cpu = {key: int(value) for key, value in (line.split() for line in self.__read_lines('cpu.stat') or [])}
+
+        io_lines = self.__read_lines('io.stat')
+        io = {}
+        for line in io_lines or []:
+            # One line per device: <major>:<minor> rbytes=... wbytes=... rios=... wios=...
+            for key, value in (field.split('=', 1) for field in line.split()[1:] if '=' in field):
+                io[key] = io.get(key, 0) + int(value)
+
+        return CgroupUsage(cpu_time=cpu['usage_usec'] / 1e6 if 'usage_usec' in cpu else None,
+                           memory_peak=self.__read_int('memory.peak'),
+                           pids_peak=self.__read_int('pids.peak'),
+                           read_bytes=io.get('rbytes', 0) if io_lines is not None else None,
+                           write_bytes=io.get('wbytes', 0) if io_lines is not None else None)
+
+    def remove(self):
+        """
+        Remove the cgroup, once its processes exited.
+        :return: True if removed, False if processes are still in it.
+        """
+        try:
+            os.rmdir(self.path)
+            return True
+        except FileNotFoundError:
+            return True
+        except OSError as e:
+            self.debug_logger.debug(f'Could not remove cgroup {self.path} yet: {e}')
+            return False
+
+    def __read_lines(self, name: str) -> Optional[List[str]]:
+        """
+        :return: lines of an interface file of the cgroup, None if its controller is not enabled or not supported.
+        """
+        try:
+            with open(os.path.join(self.path, name)) as fd:
+                return fd.read().splitlines()
+        except EnvironmentError:
+            return None
+
+    def __read_int(self, name: str) -> Optional[int]:
+        lines = self.__read_lines(name)
+        return int(lines[0]) if lines and lines[0].isdigit() else None
+
+
+class CgroupTree:
+    """
+    Subtree of cgroup v2 leaves, one per iteration, created under the
+    cgroup of the runner, which must be delegated to it (writable).
+    As processes may only be in leaves of a cgroup with controllers
+    enabled, the runner moves itself into a leaf of the subtree, the
+    supervisor, along with the tracers it starts later on. The
+    controllers delegated are then enabled for the leaves, and limits
+    set on every leaf, so that parallel iterations cannot starve each
+    other. Setting up fails with an EnvironmentError if cgroup v2 is not
+    mounted or not writable, or if a limit is asked for and its
+    controller cannot be enabled, for the runner to fall back to psutil
+    or to give up.
+    """
+
+    def __init__(self, debug_logger: logging.Logger, max_memory: int = None, cpus: float = None):
+        """
+        :param debug_logger: for print debugging.
+        :param max_memory: if given, memory limit of every iteration, in bytes.
+        :param cpus: if given, CPU limit of every iteration, in CPUs.
+        """
+        self.debug_logger = debug_logger
+        self.max_memory = max_memory
+        self.cpus = cpus
+        self.parent = own_cgroup()
+        self.path = os.path.join(self.parent, f'runner-{os.getpid()}')
+        self.supervisor = Cgroup(os.path.join(self.path, SUPERVISOR), debug_logger)
+        self.controllers: List[str] = []
+        self.__parent_controllers: List[str] = []  # Enabled in the cgroup of the runner, to disable when closing
+        self.__leftovers: List[Cgroup] = []
+
+        os.mkdir(self.path)
+        try:
+            os.mkdir(self.supervisor.path)
+            self.supervisor.add(os.getpid())
+            self.__enable_controllers()
+        except EnvironmentError:
+            self.close()
+            raise
+
+        self.debug_logger.debug(f'Running iterations in cgroups under {self.path},'
+                                f' controllers: {", ".join(self.controllers) or "none"}')
+
+    def create(self, iteration: int) -> Cgroup:
+        """
+        Create the leaf cgroup of an iteration, with the limits set.
+        :param iteration: iteration number.
+        :return: Cgroup object.
+        """
+        path = os.path.join(self.path, f'iteration-{iteration}')
+        os.mkdir(path)
+        try:
+            if self.max_memory is not None:
+                self.__write(os.path.join(path, 'memory.max'), str(self.max_memory))
+            if self.cpus is not None:
+                self.__write(os.path.join(path, 'cpu.max'), f'{int(self.cpus * CPU_PERIOD)} {CPU_PERIOD}')
+        except EnvironmentError:
+            os.rmdir(path)
+            raise
+        return Cgroup(path, self.debug_logger)
+
+    def release(self, cgroup: Cgroup):
+        """
+        Remove the leaf of an iteration, or keep it for later if descendants of the command are still in it.
+        :param cgroup: leaf of the iteration.
+        """
+        if not cgroup.remove():
+            self.__leftovers.append(cgroup)
+
+    def close(self):
+        """
+        Tear down the subtree, innermost first: remove the leaves left over, if their processes exited, disable
+        the controllers in the subtree then in the cgroup of the runner, as a cgroup cannot disable those still
+        enabled by its children, move the runner back to its cgroup, which only accepts processes once no
+        controller is enabled in it, and remove the supervisor and the subtree.
+        """
+        self.__leftovers = [cgroup for cgroup in self.__leftovers if not cgroup.remove()]
+        for path, controllers in ((self.path, self.controllers), (self.parent, self.__parent_controllers)):
+            for controller in reversed(controllers):
+                try:
+                    self.__write(os.path.join(path, 'cgroup.subtree_control'), f'-{controller}')
+                except EnvironmentError as e:
+                    self.debug_logger.debug(f'Could not disable the {controller} controller in {path}: {e}')
+        self.controllers = []
+        self.__parent_controllers = []
+
+        try:
+            Cgroup(self.parent, self.debug_logger).add(os.getpid())
+        except EnvironmentError as e:
+            self.debug_logger.debug(f'Could not move back to cgroup {self.parent}: {e}')
+
+        if not self.supervisor.remove():
+            return
+        try:
+            os.rmdir(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.debug_logger.debug(f'Could not remove cgroup {self.path}: {e}')
+
+    def __enable_controllers(self):
+        """
+        Enable the controllers available for the leaves, in the cgroup of the runner first if it does not yet,
+        which is only allowed once no process is left in it but in its children (or in the root cgroup).
+        """
+        with open(os.path.join(self.parent, 'cgroup.controllers')) as fd:
+            delegated = fd.read().split()
+        with open(os.path.join(self.parent, 'cgroup.subtree_control')) as fd:
+            enabled = fd.read().split()
+        for controller in CONTROLLERS:
+            if controller not in delegated:
+                continue
+            try:
+                if controller not in enabled:
+                    self.__write(os.path.join(self.parent, 'cgroup.subtree_control'), f'+{controller}')
+                    self.__parent_controllers.append(controller)
+                self.__write(os.path.join(self.path, 'cgroup.subtree_control'), f'+{controller}')
+                self.controllers.append(controller)
+            except EnvironmentError as e:
+                self.debug_logger.debug(f'Could not enable the {controller} controller: {e}')
+
+        for option, value, controller in (('--max-memory', self.max_memory, 'memory'), ('--cpus', self.cpus, 'cpu')):
+            if value is not None and controller not in self.controllers:
+                raise EnvironmentError(f'The {controller} controller cannot be enabled under {self.parent}'
+                                       f' (controllers: {", ".join(self.controllers) or "none"}), {option} cannot'
+                                       f' be enforced')
+
+    @staticmethod
+    def __write(path: str, value: str):
+        with open(path, 'w') as fd:
+            fd.write(value)
+
+
+def own_cgroup():
+    """
+    :return: path of the cgroup v2 directory of the current process.
+    """
+    mount = None
+    with open(MOUNTINFO_PATH) as fd:
+        for line in fd:
+            # <id> <parent> <major:minor> <root> <mount point> <options> [<optional>...] - <type> <source> ...
+            fields = line.split()
+            if fields[fields.index('-') + 1] == 'cgroup2':
+                mount = fields[4]
+                break
+    if mount is None:
+        raise EnvironmentError('cgroup v2 is not mounted')
+
+    with open(CGROUP_PATH) as fd:
+        for line in fd:
+            if line.startswith('0::'):
+                return os.path.join(mount, line[3:].strip().lstrip('/'))
+    raise EnvironmentError('Not in a cgroup v2')
@@ -0,0 +1,153 @@
+"""
+Columnar binary log format, and reader API for it.
+
+Layout of a file:
+    magic           8 bytes, MAGIC
+    header length   4 bytes, little-endian unsigned
+    header          JSON, listing the tables, their row count and columns with their offsets,
+                    and free-form metadata
+    padding         up to an 8 bytes boundary
+    columns         little-endian float64 values, one contiguous column after the other
+
+Columns can thus be memory-mapped and viewed as arrays without parsing.
+"""
+from array import array
+from typing import Dict, IO, List, Union
+import struct
+import json
+import mmap
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'RUNRCOL1'
+EXTENSION = 'col'
+DTYPE = '<f8'
+ITEM_SIZE = 8
+HEADER_LENGTH = struct.Struct('<I')
+
+
+def write(fd: IO[bytes], tables: Dict[str, Dict[str, array]], metadata: dict = None):
+    """
+    Write tables of columns to a binary file.
+    :param fd: file opened for binary writing.
+    :param tables: dict of table name to dict of column name to array of doubles, all of a table's of equal length.
+    :param metadata: JSON serializable metadata, non-serializable values are written as strings.
+    """
+    header_tables = {}
+    offset = 0
+    for table_name, columns in tables.items():
+        rows = len(next(iter(columns.values()))) if columns else 0
+        header_columns = []
+        for column_name, column in columns.items():
+            header_columns.append({'name': column_name, 'offset': offset})
+            offset += len(column) * ITEM_SIZE
+        header_tables[table_name] = {'rows': rows, 'columns': header_columns}
+
+    header = json.dumps({'dtype': DTYPE, 'tables': header_tables, 'metadata': metadata or {}},
+                        default=str).encode()
+    data_start = _align(len(MAGIC) + HEADER_LENGTH.size + len(header))
+
+    fd.write(MAGIC)
+    fd.write(HEADER_LENGTH.pack(len(header)))
+    fd.write(header)
+    fd.write(b'\0' * (data_start - len(MAGIC) - HEADER_LENGTH.size - len(header)))
+    for columns in tables.values():
+        for column in columns.values():
+            if sys.byteorder != 'little':
+                column = array('d', column)
+                column.byteswap()
+            fd.write(column.tobytes())
+
+
+class ColumnarLog:
+    """
+    Reader of a columnar log file.
+    The file is memory-mapped, and columns are returned as NumPy arrays
+    viewing the map if NumPy is installed, as memoryviews of doubles otherwise.
+    The map stays open as long as arrays viewing it are referenced.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: path of the log file.
+        :raise ValueError: if the file is not a columnar log.
+        """
+        self.path = path
+        with open(path, 'rb') as fd:
+            self.__map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.__map[:len(MAGIC)] != MAGIC:
+            self.__map.close()
+            raise ValueError(f'{path} is not a columnar log')
+
+        header_start = len(MAGIC) + HEADER_LENGTH.size
+        header_length, = HEADER_LENGTH.unpack_from(self.__map, len(MAGIC))
+        header = json.loads(self.__map[header_start:header_start + header_length])
+        self.__data_start = _align(header_start + header_length)
+        self.__tables = header['tables']
+        self.metadata = header['metadata']
+
+    @property
+    def tables(self) -> List[str]:
+        return list(self.__tables)
+
+    def columns(self, table: str) -> List[str]:
+        """
+        :param table: name of a table.
+        :return: names of the columns of the table.
+        """
+        return [column['name'] for column in self.__tables[table]['columns']]
+
+    def rows(self, table: str) -> int:
+        """
+        :param table: name of a table.
+        :return: number of rows of the table.
+        """
+        return self.__tables[table]['rows']
+
+    def column(self, table: str, name: str) -> Union['numpy.ndarray', memoryview]:
+        """
+        Get a column without copying it.
+        :param table: name of a table.
+        :param name: name of a column of the table.
+        :return: NumPy array, or memoryview of doubles if NumPy is not installed.
+        """
+        rows = self.rows(table)
+        for column in self.__tables[table]['columns']:
+            if column['name'] == name:
+                start = self.__data_start + column['offset']
+                if numpy is not None:
+                    return numpy.frombuffer(self.__map, dtype=DTYPE, count=rows, offset=start)
+                if sys.byteorder != 'little':
+                    swapped = array('d', self.__map[start:start + rows * ITEM_SIZE])
+                    swapped.byteswap()
+                    return memoryview(swapped)
+                return memoryview(self.__map)[start:start + rows * ITEM_SIZE].cast('d')
+        raise KeyError(name)
+
+    def table(self, table: str) -> Dict[str, Union['numpy.ndarray', memoryview]]:
+        """
+        :param table: name of a table.
+        :return: dict of column name to column.
+        """
+        return {name: self.column(table, name) for name in self.columns(table)}
+
+    def close(self):
+        try:
+            self.__map.close()
+        except BufferError:
+            pass  # Columns still viewing the map, it is closed once they are released
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _align(offset: int):
+    return (offset + ITEM_SIZE - 1) // ITEM_SIZE * ITEM_SIZE
@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from summary.summary import Summary
+from progress.progress import Progress
+from exporter.exporter import Exporter
+import logging
+
+
+class Executor:
+    """
+    Run the iterations of a session, up to a given number of them at once.
+    Iterations are handed to a thread pool, each one keeping its own
+    iteration number for logging, and their results are added to the
+    summary under that number as they complete.
+    Once the allowed failed count is reached, no further iterations are
+    started, and those running are cancelled: their commands are killed
+    and they are left out of the summary. So they are as well if the
+    session fails with an error, or is cancelled, e.g. on a signal.
+    """
+
+    def __init__(self,
+                 runner,
+                 summary: Summary,
+                 count: int,
+                 debug_logger: logging.Logger,
+                 failed_count: int = None,
+                 jobs: int = 1,
+                 progress: Progress = None,
+                 exporter: Exporter = None):
+        """
+        :param runner: runner of a single iteration, returning None if cancelled.
+        :param summary: summary to add the results to.
+        :param count: number of iterations to run.
+        :param debug_logger: for print debugging.
+        :param failed_count: number of allowed failed iterations before giving up, or None for no limit.
+        :param jobs: maximal number of iterations running at once.
+        :param progress: if given, live status to add the results to as well.
+        :param exporter: if given, metrics exporter to add the results to as well.
+        """
+        self.runner = runner
+        self.summary = summary
+        self.count = count
+        self.debug_logger = debug_logger
+        self.failed_count = failed_count
+        self.jobs = jobs
+        self.progress = progress
+        self.exporter = exporter
+        self.current_failed_count = 0
+        self.__running = {}  # Future to iteration
+        self.__cancelled = False
+
+    def run(self):
+        """
+        Run the iterations and wait for them to complete.
+        """
+        next_iteration = 0
+        running = self.__running
+
+        with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='iteration') as pool:
+            try:
+                while running or (next_iteration < self.count and not self.__failed_count_reached()
+                                  and not self.__cancelled):
+
+                    # Keep at most jobs iterations in flight, so a huge count does not queue up
+                    while (len(running) < self.jobs and next_iteration < self.count
+                           and not self.__failed_count_reached() and not self.__cancelled):
+                        self.debug_logger.debug(f'Attempt {next_iteration + 1} out of {self.count}'
+                                                f' to run given command')
+                        running[pool.submit(self.runner.run, next_iteration)] = next_iteration
+                        next_iteration += 1
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.__add_result(running.pop(future), future.result())
+
+                    if self.__failed_count_reached() and not self.__cancelled:
+                        self.debug_logger.debug(f'Failed count of {self.failed_count} reached, cancelling'
+                                                f' iterations {sorted(running.values())} and not starting the'
+                                                f' {self.count - next_iteration} remaining ones')
+                        self.runner.cancel()
+                        self.__cancelled = True
+
+            except Exception:
+                # Do not wait for the iterations running to complete before letting the error through
+                self.runner.cancel()
+                raise
+
+    def cancel(self):
+        """
+        Give up the session from the thread running it, e.g. in a signal handler: start no further
+        iterations, cancel those running and wait for them to complete, adding those that completed
+        meanwhile to the summary, so that nothing of the session is in use anymore on return.
+        """
+        self.debug_logger.debug(f'Session cancelled, cancelling iterations {sorted(self.__running.values())}')
+        self.__cancelled = True
+        self.runner.cancel()
+        wait(list(self.__running))
+        for future, iteration in list(self.__running.items()):
+            del self.__running[future]
+            if future.exception() is None:
+                self.__add_result(iteration, future.result())
+
+    def __add_result(self, iteration: int, result):
+        if result is None:
+            return  # Cancelled
+        self.summary.add_result(result, iteration)
+        if self.progress is not None:
+            self.progress.add_result(result)
+        if self.exporter is not None:
+            self.exporter.add_result(result)
+
+        if result.failed:
+            self.current_failed_count += 1
+
+    def __failed_count_reached(self):
+        return self.failed_count is not None and self.current_failed_count >= self.failed_count
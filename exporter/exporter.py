@@ -0,0 +1,181 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from summary.iteration_result import IterationResult
+from summary.summary import Summary
+from metrics.metric import Metric
+from loggable.loggable import promote_file
+from typing import Dict, List, Optional, Tuple
+import threading
+import tempfile
+import logging
+import math
+import time
+import os
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_PATH = '/metrics'
+DEFAULT_HOST = '127.0.0.1'
+TEXTFILE_INTERVAL = 1.0  # Seconds, minimal interval between textfile writes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)  # Seconds
+
+# Sample stores of the metrics exported as gauges: metric subject to store attribute, gauge name and help
+GAUGES = {'memory': ('info', 'runner_memory_bytes', 'Memory of the process tree of the latest iteration'),
+          'proc_th_cpu': ('cpu_percent_over_time', 'runner_cpu', 'CPU percent, processes and threads of the'
+                                                                 ' process tree of the latest iteration'),
+          'disk_io': ('io_counters', 'runner_disk_io', 'Disk IO counters of the process tree of the latest'
+                                                       ' iteration')}
+
+
+class Exporter:
+    """
+    Expose a session in the Prometheus text format, on a local HTTP
+    endpoint and/or as a file for the node exporter textfile collector.
+    Exported are the return code counters of the summary, histograms of
+    the iterations wall time, and gauges of the latest sample of the
+    memory, CPU and disk IO metrics of the latest iteration.
+    Nothing is computed on the sampling path: the metrics of an iteration
+    are only referenced when it starts, and their latest samples are
+    read when scraped. Results update plain counters from the executor
+    thread, and scrapes read snapshots of them, so no lock is taken.
+    """
+
+    def __init__(self,
+                 summary: Summary,
+                 debug_logger: logging.Logger,
+                 address: Tuple[str, int] = None,
+                 textfile: str = None):
+        """
+        :param summary: summary of the session.
+        :param debug_logger: for print debugging.
+        :param address: if given, tuple of host and port to serve the metrics on, over HTTP.
+        :param textfile: if given, path of a file to write the metrics to, for the textfile collector.
+        """
+        self.summary = summary
+        self.debug_logger = debug_logger
+        self.address = address
+        self.textfile = textfile
+        self.__bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)  # Last one is +Inf
+        self.__latency_sum = 0.0
+        self.__metrics: Dict[str, Metric] = {}  # Metric subject to the metric of the latest iteration
+        self.__last_write = 0.0
+        self.__server: Optional[ThreadingHTTPServer] = None
+
+    def start(self):
+        """
+        Start serving the metrics, if an address was given.
+        """
+        if self.address is None:
+            return
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != METRICS_PATH:
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                exporter.debug_logger.debug(f'Metrics request: {format % args}')
+
+        self.__server = ThreadingHTTPServer(self.address, Handler)
+        self.__server.daemon_threads = True
+        threading.Thread(target=self.__server.serve_forever, name='exporter', daemon=True).start()
+        self.debug_logger.debug(f'Serving metrics on http://{self.address[0]}:{self.__server.server_port}'
+                                f'{METRICS_PATH}')
+
+    def stop(self):
+        """
+        Stop serving the metrics, and write them a last time to the textfile.
+        """
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+        self.__write_textfile()
+
+    def track(self, metrics: List[Metric]):
+        """
+        Export the metrics of an iteration, in place of those of the previous one.
+        :param metrics: metrics of the iteration.
+        """
+        for metric in metrics:
+            if metric.subject in GAUGES:
+                self.__metrics[metric.subject] = metric
+
+    def add_result(self, result: IterationResult):
+        """
+        Account for a completed iteration.
+        :param result: result of the iteration.
+        """
+        bucket = next((index for index, bound in enumerate(LATENCY_BUCKETS) if result.wall_time <= bound),
+                      len(LATENCY_BUCKETS))
+        self.__latency_sum += result.wall_time
+        self.__bucket_counts[bucket] += 1
+
+        if self.textfile is not None and time.monotonic() - self.__last_write >= TEXTFILE_INTERVAL:
+            self.__write_textfile()
+
+    def render(self) -> str:
+        """
+        :return: the metrics in the Prometheus text exposition format.
+        """
+        lines = ['# HELP runner_iterations_total Completed iterations by return code',
+                 '# TYPE runner_iterations_total counter']
+        for return_code, frequency in sorted(self.summary.return_codes_frequencies.copy().items(),
+                                             key=lambda item: str(item[0])):
+            lines.append(f'runner_iterations_total{{return_code="{return_code}"}} {frequency}')
+
+        lines += ['# HELP runner_iteration_duration_seconds Wall time of the iterations',
+                  '# TYPE runner_iteration_duration_seconds histogram']
+        counts, total = list(self.__bucket_counts), self.__latency_sum
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+            cumulative += count
+            lines.append(f'runner_iteration_duration_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'runner_iteration_duration_seconds_sum {total}')
+        lines.append(f'runner_iteration_duration_seconds_count {cumulative}')
+
+        metrics = self.__metrics.copy()
+        for subject, (attribute, name, description) in GAUGES.items():
+            metric = metrics.get(subject)
+            store = getattr(metric, attribute, None)
+            row = store.last() if store is not None else None
+            if row is None:
+                continue
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} gauge']
+            for field in store.fields:
+                labels = f'field="{field}",iteration="{metric.iteration}"'
+                lines.append(f'{name}{{{labels}}} {self.__format(row[field])}')
+
+        return '\n'.join(lines) + '\n'
+
+    def __write_textfile(self):
+        """
+        Write the metrics to the textfile, atomically so the collector never reads a partial file.
+        """
+        if self.textfile is None:
+            return
+        self.__last_write = time.monotonic()
+        try:
+            # Next to the textfile, so it is replaced by renaming, and without the .prom extension the collector reads
+            fd, scratch_path = tempfile.mkstemp(prefix='.', suffix='.tmp',
+                                                dir=os.path.dirname(os.path.abspath(self.textfile)))
+            with os.fdopen(fd, 'w') as scratch:
+                scratch.write(self.render())
+            promote_file(scratch_path, self.textfile)
+        except EnvironmentError as e:
+            print(e)
+
+    @staticmethod
+    def __format(value: float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
@@ -1,5 +1,11 @@
 import argparse
 import sys
+from metrics.sampler import DEFAULT_SAMPLE_INTERVAL
+from metrics.sample_store import DEFAULT_CAPACITY
+from metrics import metric
+from tracer import strace
+from exporter import exporter
+from loggable.loggable import CODECS
 
 
 class HelpAction(argparse.Action):
@@ -30,6 +36,57 @@ def check_positive(value):
     return l_value
 
 
+def check_positive_float(value):
+    """
+    Check the value to be a positive number.
+    This function will be passed as type
+    to assert positive floats.
+    :param value
+    :return: value
+    """
+    l_value = float(value)
+    if l_value <= 0:
+        raise argparse.ArgumentTypeError(f'{l_value} is not a valid argument (not a positive number)')
+    return l_value
+
+
+def check_address(value):
+    """
+    Check the value to be a port, optionally preceded by a host.
+    This function will be passed as type
+    to parse listening addresses.
+    :param value
+    :return: tuple of host and port
+    """
+    host, _, port = value.rpartition(':')
+    try:
+        l_port = int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} is not a valid argument (not [HOST:]PORT)')
+    if not 0 <= l_port <= 65535:
+        raise argparse.ArgumentTypeError(f'{l_port} is not a valid argument (not a port)')
+    return host.strip('[]') or exporter.DEFAULT_HOST, l_port
+
+
+def check_size(value):
+    """
+    Check the value to be a positive number of bytes, optionally suffixed with K, M or G (powers of 1024).
+    This function will be passed as type
+    to parse memory sizes.
+    :param value
+    :return: number of bytes
+    """
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    unit = units.get(value[-1:].upper(), 1)
+    try:
+        l_value = int(float(value[:-1] if unit > 1 else value) * unit)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} is not a valid argument (not a size such as 512M)')
+    if l_value <= 0:
+        raise argparse.ArgumentTypeError(f'{value} is not a valid argument (not a positive size)')
+    return l_value
+
+
 def parse():
     """
     Parse the command line arguments.
@@ -58,13 +115,57 @@ def parse():
                         type=check_positive,
                         help='number of allowed failed command invocation attempts before giving up')
 
+    parser.add_argument('-t',
+                        '--timeout',
+                        dest='timeout',
+                        type=check_positive_float,
+                        metavar='SECONDS',
+                        help='time an iteration is allowed to run, after which the process group of the command is'
+                             ' sent SIGTERM, then SIGKILL if still running 5 seconds later; timed out iterations are'
+                             ' summarized apart and their logs are created as for failed ones')
+
+    parser.add_argument('-j',
+                        '--jobs',
+                        dest='jobs',
+                        type=check_positive,
+                        default=1,
+                        help='number of iterations of the given command to run at once')
+
+    parser.add_argument('-sj',
+                        '--summary-json',
+                        dest='summary_json',
+                        metavar='PATH',
+                        help='also write the summary, with the resource usage statistics, to a JSON file')
+
+    parser.add_argument('-p',
+                        '--progress',
+                        dest='progress',
+                        action='store_true',
+                        help='show a live status line on stderr: iterations completed and failed, throughput, ETA,'
+                             ' and latency and peak RSS of the latest iterations')
+
+    parser.add_argument('-ml',
+                        '--metrics-listen',
+                        dest='metrics_listen',
+                        type=check_address,
+                        metavar='[HOST:]PORT',
+                        help=f'serve Prometheus metrics of the session on http://HOST:PORT/metrics'
+                             f' (HOST defaults to {exporter.DEFAULT_HOST})')
+
+    parser.add_argument('-mt',
+                        '--metrics-textfile',
+                        dest='metrics_textfile',
+                        metavar='PATH',
+                        help='write Prometheus metrics of the session to a file, for the node exporter textfile'
+                             ' collector')
+
     parser.add_argument('-st',
                         '--sys-trace',
                         dest='sys_trace',
                         action='store_true',
                         help='for each failed execution, create a log for each of the following values,'
                              ' measured during command execution: Disk IO; Memory; Processes/threads'
-                             ' and cpu usage of the command; Network card package counters')
+                             ' and cpu usage of the command; Network traffic and sockets of the command')
 
     parser.add_argument('-ct',
                         '--call-trace',
@@ -72,6 +173,14 @@ def parse():
                         action='store_true',
                         help='for each failed execution, create a log with all the system calls ran by the command')
 
+    parser.add_argument('-ctm',
+                        '--call-trace-mode',
+                        dest='call_trace_mode',
+                        choices=strace.MODES,
+                        default=strace.FULL,
+                        help='what the call-trace logs: "full", every system call, or "summary", the count, errors'
+                             ' and time of each system call (default: full)')
+
     parser.add_argument('-lt',
                         '--log-trace',
                         dest='log_trace',
@@ -85,6 +194,100 @@ def parse():
                         help='for each failed execution, create a pcap file with the network traffic'
                              ' during the execution')
 
+    parser.add_argument('-cg',
+                        '--cgroup',
+                        dest='cgroup',
+                        action='store_true',
+                        help='run every iteration in a cgroup v2 leaf of its own, for exact CPU time, memory and'
+                             ' process peaks and disk IO of all its processes, falling back to psutil if cgroup v2'
+                             ' is not available or not delegated')
+
+    parser.add_argument('-mm',
+                        '--max-memory',
+                        dest='max_memory',
+                        type=check_size,
+                        metavar='SIZE',
+                        help='memory limit of every iteration, e.g. 512M (implies --cgroup)')
+
+    parser.add_argument('--cpus',
+                        dest='cpus',
+                        type=check_positive_float,
+                        metavar='N',
+                        help='CPU limit of every iteration, in CPUs, e.g. 1.5 (implies --cgroup)')
+
+    parser.add_argument('-z',
+                        '--compress',
+                        dest='compress',
+                        choices=sorted(CODECS),
+                        metavar='CODEC',
+                        help=f'compress the log files with CODEC, one of {", ".join(sorted(CODECS))}')
+
+    parser.add_argument('-dd',
+                        '--dedup',
+                        dest='dedup',
+                        action='store_true',
+                        help='store log files once per distinct contents, as blobs under logs/<TIMESTAMP>/blobs/,'
+                             ' with a manifest per failed iteration (<command>_<iteration>_manifest.json) listing'
+                             ' them; rebuild them with python -m blob_store.blob_store MANIFEST')
+
+    parser.add_argument('-fd',
+                        '--failure-diff',
+                        dest='failure_diff',
+                        action='store_true',
+                        help='if some iterations failed and others succeeded, write a report of the features'
+                             ' (resource usage, system calls with -ct, output hashes with -lt) that best separate'
+                             ' failures from successes (<command>_all_failure_diff.log)')
+
+    parser.add_argument('-si',
+                        '--sample-interval',
+                        dest='sample_interval',
+                        type=check_positive_float,
+                        default=DEFAULT_SAMPLE_INTERVAL,
+                        metavar='SECONDS',
+                        help=f'interval between sys-trace samples, in seconds (default: {DEFAULT_SAMPLE_INTERVAL})')
+
+    parser.add_argument('-as',
+                        '--adaptive-sampling',
+                        dest='adaptive_sampling',
+                        type=check_positive_float,
+                        metavar='SECONDS',
+                        help='sample sys-trace every SECONDS while stable, and every --sample-interval from an'
+                             ' anomaly (a jump of RSS, disk IO rate or CPU percent, or a new process) until'
+                             ' values are stable again')
+
+    parser.add_argument('-sc',
+                        '--sample-capacity',
+                        dest='sample_capacity',
+                        type=check_positive,
+                        default=DEFAULT_CAPACITY,
+                        metavar='N',
+                        help=f'number of sys-trace samples kept per metric, older samples are evicted'
+                             f' (default: {DEFAULT_CAPACITY})')
+
+    parser.add_argument('-rs',
+                        '--retain-seconds',
+                        dest='retain_seconds',
+                        type=check_positive_float,
+                        metavar='SECONDS',
+                        help='keep only the sys-trace samples of the last SECONDS of an iteration, bounding'
+                             ' --sample-capacity accordingly')
+
+    parser.add_argument('-ds',
+                        '--downsample',
+                        dest='downsample',
+                        type=check_positive,
+                        default=0,
+                        metavar='WINDOW',
+                        help='keep the min, max and mean of every WINDOW sys-trace samples instead of each sample')
+
+    parser.add_argument('-lf',
+                        '--log-format',
+                        dest='log_format',
+                        choices=metric.LOG_FORMATS,
+                        default=metric.TEXT,
+                        help='format of the sys-trace logs: "text", or "columnar" for compact binary columns'
+                             ' that can be memory-mapped with columnar.ColumnarLog (default: text)')
+
     parser.add_argument('-d',
                         '--debug',
                         dest='debug',
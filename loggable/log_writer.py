@@ -0,0 +1,101 @@
+from loggable.loggable import Loggable
+from blob_store.blob_store import BlobStore
+from typing import Callable, List, Optional
+import threading
+import logging
+import queue
+
+DEFAULT_MAX_PENDING = 16  # Iterations whose logs may wait to be written
+
+
+class LogWriter:
+    """
+    Background stage writing the logs of failed iterations.
+    The loggables of an iteration are queued along with a function
+    releasing what they hold (scratch files, buffers), and a worker
+    thread dumps them and then releases them, so iterations do not wait
+    for the disk. The queue is bounded, so that a session failing faster
+    than its logs can be written holds a bounded number of iterations
+    in memory, iterations waiting for room otherwise.
+    Log files can be compressed with any of the codecs of loggable.CODECS,
+    or written to a content-addressed store, along with a manifest per iteration.
+    """
+
+    def __init__(self,
+                 debug_logger: logging.Logger,
+                 compression: str = None,
+                 max_pending: int = DEFAULT_MAX_PENDING,
+                 store: BlobStore = None):
+        """
+        :param debug_logger: for print debugging.
+        :param compression: name of the codec to compress the log files with, or None.
+        :param max_pending: maximal number of iterations whose logs wait to be written.
+        :param store: if given, content-addressed store to write the log files to instead.
+        """
+        self.debug_logger = debug_logger
+        self.compression = compression
+        self.store = store
+        self.__queue = queue.Queue(max_pending)
+        self.__thread = threading.Thread(target=self.__run, name='log-writer', daemon=True)
+        self.__closed = False
+
+    def start(self):
+        """
+        Start writing in the background.
+        """
+        self.__thread.start()
+
+    def submit(self, loggables: List[Loggable], release: Optional[Callable[[], None]] = None):
+        """
+        Queue the logs of an iteration to be written.
+        :param loggables: objects to dump to files.
+        :param release: function releasing what the loggables hold, called once they are dumped.
+        """
+        for loggable in loggables:
+            loggable.compression = self.compression
+            loggable.store = self.store
+        if self.__closed:
+            # Iterations still running when the session is interrupted write their logs themselves
+            self.__write(loggables, release)
+            return
+        self.__queue.put((loggables, release))
+
+    def close(self):
+        """
+        Wait for the queued logs to be written, and stop the worker.
+        Safe to call more than once, e.g. from a signal handler.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        if self.__thread.is_alive():
+            self.debug_logger.debug(f'Waiting for {self.__queue.qsize()} iterations logs to be written')
+            self.__queue.put(None)
+            self.__thread.join()
+        if self.store is not None:
+            self.debug_logger.debug(f'Log store: {self.store}')
+
+        # Logs queued while closing
+        while not self.__queue.empty():
+            job = self.__queue.get()
+            if job is not None:
+                self.__write(*job)
+
+    def __run(self):
+        while True:
+            job = self.__queue.get()
+            if job is None:
+                return
+            self.__write(*job)
+
+    def __write(self, loggables: List[Loggable], release: Optional[Callable[[], None]]):
+        try:
+            for loggable in loggables:
+                loggable.dump_to_file()
+            if self.store is not None and loggables:
+                self.store.write_manifest(loggables[0].command, loggables[0].iteration)
+        except Exception as e:
+            print(e)
+        finally:
+            if release is not None:
+                release()
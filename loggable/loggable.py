@@ -1,10 +1,127 @@
 from abc import ABC
+from contextlib import contextmanager
+from typing import Dict, List
 import os
+import atexit
+import bz2
+import gzip
+import lzma
+import shutil
 import logging
+import tempfile
+import threading
 from datetime import datetime
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 TIMESTAMP = str(datetime.now().timestamp())
-LOGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../logs', TIMESTAMP)
+LOGS_ROOT = os.path.abspath('logs')  # Under the working directory of the session
+LOGS_DIR = os.path.join(LOGS_ROOT, TIMESTAMP)
+
+WRITE_BUFFER_SIZE = 1 << 20  # Bytes, so that the many small writes of a dump reach the disk in bulk
+
+# Codecs log files can be compressed with: name to open function and file name suffix
+CODECS = {'gzip': (gzip.open, 'gz'),
+          'bz2': (bz2.open, 'bz2'),
+          'xz': (lzma.open, 'xz')}
+if zstandard is not None:
+    CODECS['zstd'] = (zstandard.open, 'zst')
+
+# Scratch files are created owner-only, promoted files get the permissions of a regular log file
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# Free scratch files by suffix, reused by the next iterations rather than created and removed by each one
+_free_scratch_files: Dict[str, List[str]] = {}
+_scratch_lock = threading.Lock()
+
+
+def create_scratch_file(suffix: str):
+    """
+    Create a hidden scratch file next to the logs directories.
+    Being on the same file system as the logs, it can be promoted
+    to a log file by renaming it.
+    :param suffix: suffix of the file name.
+    :return: tuple of an open file descriptor and the path of the file.
+    """
+    os.makedirs(LOGS_ROOT, exist_ok=True)
+    return tempfile.mkstemp(prefix='.', suffix=suffix, dir=LOGS_ROOT)
+
+
+def log_file_name(command: str, iteration, subject: str, extension='log'):
+    """
+    :return: name of the log file of a subject of an iteration of a command.
+    """
+    return f'{os.path.basename(command.split()[0])}_{iteration}_{subject}.{extension}'
+
+
+def acquire_scratch_file(suffix: str):
+    """
+    Take a free, empty scratch file, creating one if there is none.
+    Scratch files are released once their iteration is done with them
+    and reused, so there are about as many of them as iterations run at
+    once, and only those of failed iterations leave the pool, as they
+    are promoted to log files.
+    :param suffix: suffix of the file name.
+    :return: path of the file.
+    """
+    with _scratch_lock:
+        free = _free_scratch_files.get(suffix)
+        if free:
+            return free.pop()
+    fd, path = create_scratch_file(suffix)
+    os.close(fd)
+    return path
+
+
+def release_scratch_file(path: str):
+    """
+    Give a scratch file back to be reused, truncated, unless it was promoted meanwhile.
+    :param path: path of the scratch file.
+    """
+    try:
+        os.truncate(path, 0)
+    except FileNotFoundError:
+        return  # Promoted to a log file
+    with _scratch_lock:
+        _free_scratch_files.setdefault(os.path.splitext(path)[1], []).append(path)
+
+
+@atexit.register
+def _remove_free_scratch_files():
+    with _scratch_lock:
+        for paths in _free_scratch_files.values():
+            for path in paths:
+                remove_file(path)
+            paths.clear()
+
+
+def promote_file(source: str, destination: str):
+    """
+    Move a scratch file to its destination, by renaming it if possible.
+    :param source: path of the scratch file.
+    :param destination: path of the log file.
+    """
+    os.chmod(source, 0o666 & ~_UMASK)
+    try:
+        os.replace(source, destination)
+    except OSError:
+        # Not on the same file system, fall back to copying
+        shutil.move(source, destination)
+
+
+def remove_file(path: str):
+    """
+    Remove a file if it exists.
+    :param path: path of the file.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
 
 
 class Loggable(ABC):
@@ -24,6 +141,8 @@ class Loggable(ABC):
         self.iteration = iteration
         self.subject = subject
         self.debug_logger = debug_logger
+        self.compression = None  # Name of the codec log files are compressed with, if any
+        self.store = None  # Content-addressed store log files are written to instead, if any (BlobStore)
 
     def dump_to_file(self):
         pass
@@ -31,6 +150,68 @@ class Loggable(ABC):
     def __str__(self):
         pass
 
+    def _promote(self, scratch_path: str, extension='log'):
+        """
+        Promote a scratch file to the log file of this object.
+        The file is renamed, or compressed into the log file if compression is set.
+        If a store is set, the file is handed to it instead.
+        :param scratch_path: path of the scratch file.
+        :param extension: extension of log file.
+        """
+        if self.store is not None:
+            self.store.put_file(scratch_path, self.command, self.iteration, self._get_log_name(extension))
+            return
+
+        if self.compression is not None:
+            with open(scratch_path, 'rb') as scratch, self._open_log(extension, binary=True) as fd:
+                shutil.copyfileobj(scratch, fd, WRITE_BUFFER_SIZE)
+            remove_file(scratch_path)
+            return
+
+        path = self._get_log_path(extension)
+        self.debug_logger.debug(f'Promoting {scratch_path} to {path}')
+        with open(scratch_path, 'rb') as scratch:
+            os.fsync(scratch.fileno())
+        promote_file(scratch_path, path)
+
+    @contextmanager
+    def _open_log(self, extension='log', binary=False):
+        """
+        Open the log file of this object for writing, through a large buffer.
+        If compression is set, the file is compressed and its name suffixed accordingly.
+        The file is flushed to disk once, when closed.
+        If a store is set, a scratch file is written instead, and handed to the store once closed.
+        :param extension: extension of log file.
+        :param binary: if True, the file is opened in binary mode, in text mode otherwise.
+        :return: context manager of the file object.
+        """
+        mode = 'wb' if binary else 'wt'
+        if self.store is not None:
+            scratch_fd, scratch_path = create_scratch_file(f'.{extension}')
+            try:
+                with open(scratch_fd, mode, buffering=WRITE_BUFFER_SIZE) as fd:
+                    yield fd
+            except BaseException:
+                remove_file(scratch_path)
+                raise
+            self._promote(scratch_path, extension)
+            return
+
+        path = self._get_log_path(extension)
+        if self.compression is None:
+            with open(path, mode, buffering=WRITE_BUFFER_SIZE) as fd:
+                yield fd
+                fd.flush()
+                os.fsync(fd.fileno())
+            return
+
+        codec_open, suffix = CODECS[self.compression]
+        with open(f'{path}.{suffix}', 'wb', buffering=WRITE_BUFFER_SIZE) as raw:
+            with codec_open(raw, mode) as fd:
+                yield fd
+            raw.flush()
+            os.fsync(raw.fileno())
+
     def _get_log_path(self, extension='log'):
         """
         Build path to log file out of identifying parameters and a timestamp.
@@ -40,11 +221,17 @@ class Loggable(ABC):
         :return: path as string.
         """
         self.__ensure_dir()
-        command_name = self.command.split()[0]
-        return os.path.join(LOGS_DIR, f'{command_name}_{self.iteration}_{self.subject}.{extension}')
+        return os.path.join(LOGS_DIR, self._get_log_name(extension))
+
+    def _get_log_name(self, extension='log'):
+        """
+        :param extension: extension of log file.
+        :return: name of the log file of this object.
+        """
+        return log_file_name(self.command, self.iteration, self.subject, extension)
 
     def __ensure_dir(self):
         self.debug_logger.debug(f'Creating directory {LOGS_DIR}')
         if not os.path.exists(LOGS_DIR):
-            os.makedirs(LOGS_DIR)
+            os.makedirs(LOGS_DIR, exist_ok=True)
             self.debug_logger.debug(f'Directory {LOGS_DIR} created')
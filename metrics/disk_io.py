@@ -1,49 +1,58 @@
 from metrics import metric
+from metrics.sample_store import DEFAULT_CAPACITY
+from metrics.process_tree import ProcessTree
+from metrics.proc_reader import IO_FIELDS
 import logging
 import psutil
 
 
 class DiskIO(metric.Metric):
     """
-    Monitor disk IO stats of a given process.
+    Monitor disk IO stats of a given process tree.
+    Counters are summed over the processes of the tree. Those of reaped
+    children are accounted by the kernel to their parent.
     """
 
-    def __init__(self, process: psutil.Process, command: str, iteration: int, debug_logger: logging.Logger):
-        super().__init__(process, command, iteration, str(self), debug_logger)
-        self.io_counters_dicts: list = []
-
-    def measure(self):
+    description = 'disk IO stats'
+    adaptive_thresholds = {'read_bytes': 1 << 20, 'write_bytes': 1 << 20}  # Bytes per second
+    adaptive_counters = True
+
+    def __init__(self,
+                 process: psutil.Process,
+                 command: str,
+                 iteration: int,
+                 debug_logger: logging.Logger,
+                 capacity: int = DEFAULT_CAPACITY,
+                 window: int = 0,
+                 tree: ProcessTree = None,
+                 log_format: str = metric.TEXT):
+        super().__init__(process, command, iteration, str(self), debug_logger, capacity, window, tree, log_format)
+        self.io_counters = None  # Store created on first sample, fields vary by platform
+
+    def sample(self, timestamp: float = None):
         """
-        Perform the measurements as long as the process is running and is not a zombie.
+        Take a single disk IO measurement of the process tree.
+        :param timestamp: time of the measurement, now if not given.
         """
-        self.debug_logger.debug(f'Measuring disk IO of command {self.command} at iteration {self.iteration}')
+        # Challenge: access denied here if not using root
+        measurements = self._collect(self.__io_counters)
+        if self.io_counters is None:
+            self.io_counters = self._new_store(getattr(measurements[0][1], '_fields', IO_FIELDS))
+        self.io_counters.append([sum(counters) for counters in zip(*(pio for _, pio in measurements))], timestamp)
 
-        while self.process.is_running():
-            # Challenge: access denied here if not using root
-            # _asdict() is protected but necessary for iterating using keys
-            pio_counters_dict = self.process.io_counters()._asdict()
-            self.io_counters_dicts.append(pio_counters_dict)
+    def __io_counters(self, process: psutil.Process):
+        reader = self.tree.reader(process)
+        return reader.io_counters() if reader is not None and reader.has_io else process.io_counters()
 
-            if self.process.status() == psutil.STATUS_ZOMBIE:
-                break
+    def _write_text(self, fd):
+        if self.io_counters is not None:
+            self._print_store(self.io_counters, fd)
+            print(f'\nTotal Disk IO counters: {self.io_counters.last()}', file=fd)
 
-    def dump_to_file(self):
-        """
-        Dump current measurements to a file.
-        """
-        self.debug_logger.debug(f'Dumping to file disk IO stats of command {self.command}'
-                                f' at iteration {self.iteration}')
-
-        try:
-            with open(self._get_log_path('log'), 'w') as fd:
-                for index in range(len(self.io_counters_dicts)):
-                    print(f'{index+1}: {self.io_counters_dicts[index]}', file=fd)
-                if len(self.io_counters_dicts) > 0:
-                    print(f'\nTotal Disk IO counters: {self.io_counters_dicts[len(self.io_counters_dicts) - 1]}',
-                          file=fd)
-
-        except EnvironmentError as e:
-            print(e)
+        self._print_sampling_stats(fd)
+
+    def _stores(self):
+        return {'io_counters': self.io_counters}
 
     def __str__(self):
         return 'disk_io'
@@ -1,53 +1,89 @@
 from metrics import metric
+from metrics.sample_store import DEFAULT_CAPACITY
+from metrics.process_tree import ProcessTree
+from metrics.proc_reader import MEMORY_FIELDS
 import logging
 import psutil
 
+TOTAL_MEMORY = psutil.virtual_memory().total
+
 
 class Memory(metric.Metric):
     """
-    Monitor memory stats of a given process.
+    Monitor memory stats of a given process tree.
+    Memory info is summed over the processes of the tree, along with their
+    proportional set size (PSS), which unlike RSS does not count shared
+    pages once per process.
     """
 
-    def __init__(self, process: psutil.Process, command: str, iteration: int, debug_logger: logging.Logger):
-        super().__init__(process, command, iteration, str(self), debug_logger)
-        self.info_dicts: list = []
+    description = 'memory stats'
+    adaptive_thresholds = {'rss': 1 << 20}  # Bytes
+
+    def __init__(self,
+                 process: psutil.Process,
+                 command: str,
+                 iteration: int,
+                 debug_logger: logging.Logger,
+                 capacity: int = DEFAULT_CAPACITY,
+                 window: int = 0,
+                 tree: ProcessTree = None,
+                 log_format: str = metric.TEXT):
+        super().__init__(process, command, iteration, str(self), debug_logger, capacity, window, tree, log_format)
+        self.info = None  # Store created on first sample, fields vary by platform
         self.percent: float = 0
 
-    def measure(self):
+    def sample(self, timestamp: float = None):
         """
-        Perform the measurements as long as the process is running and is not a zombie.
+        Take a single memory measurement of the process tree.
+        :param timestamp: time of the measurement, now if not given.
         """
-        self.debug_logger.debug(f'Measuring memory stats of command {self.command} at iteration {self.iteration}')
+        # Challenge: access denied here if not using root
+        measurements = self._collect(self.__measure)
+        if self.info is None:
+            self.info = self._new_store(getattr(measurements[0][1][0], '_fields', MEMORY_FIELDS) + ('pss',))
+        totals = [sum(values) for values in zip(*(mem_info for _, (mem_info, _, _) in measurements))]
+        self.info.append(totals + [sum(pss for _, (_, _, pss) in measurements)], timestamp)
+        self.percent = sum(percent for _, (_, percent, _) in measurements)
 
-        while self.process.is_running():
-            # Challenge: access denied here if not using root
-            # _asdict() is protected but necessary for iterating using keys
-            mem_info_dict = self.process.memory_info()._asdict()
-            self.info_dicts.append(mem_info_dict)
-            self.percent += self.process.memory_percent() - self.percent
+    def __measure(self, process: psutil.Process):
+        reader = self.tree.reader(process)
+        if reader is not None and reader.has_memory:
+            mem_info = reader.memory_info()
+            return mem_info, mem_info[0] / TOTAL_MEMORY * 100, reader.read_pss()
+        return process.memory_info(), process.memory_percent(), self.__read_pss(process.pid)
 
-            if self.process.status() == psutil.STATUS_ZOMBIE:
-                break
+    def _write_text(self, fd):
+        if self.info is not None:
+            self._print_store(self.info, fd)
+            print(f'\nTotal memory IO counters: {self.info.last()}', file=fd)
 
-    def dump_to_file(self):
-        """
-        Dump current measurements to a file.
-        """
-        self.debug_logger.debug(f'Dumping to file memory stats of command {self.command} at iteration {self.iteration}')
+        print(f'\nMemory utilization as percentage of total physical system memory: {self.percent}%', file=fd)
 
-        try:
-            with open(self._get_log_path('log'), 'w') as fd:
-                for index in range(len(self.info_dicts)):
-                    print(f'{index+1}: {self.info_dicts[index]}', file=fd)
+        self._print_sampling_stats(fd)
 
-                if len(self.info_dicts) > 0:
-                    print(f'\nTotal memory IO counters: {self.info_dicts[len(self.info_dicts) - 1]}',
-                          file=fd)
+    def _stores(self):
+        return {'info': self.info}
 
-                print(f'\nMemory utilization as percentage of total physical system memory: {self.percent}%', file=fd)
+    def _metadata(self):
+        return {'percent': self.percent}
 
-        except EnvironmentError as e:
-            print(e)
+    @staticmethod
+    def __read_pss(pid: int):
+        """
+        Read the PSS of a process from its smaps rollup (Linux 4.14 and later), if it has no /proc reader.
+        :return: PSS in bytes, or NaN if not available.
+        """
+        try:
+            with open(f'/proc/{pid}/smaps_rollup') as fd:
+                for line in fd:
+                    if line.startswith('Pss:'):
+                        return int(line.split()[1]) * 1024
+        except FileNotFoundError:
+            if not psutil.pid_exists(pid):
+                raise psutil.NoSuchProcess(pid)
+        except EnvironmentError:
+            pass
+        return float('nan')
 
     def __str__(self):
         return 'memory'
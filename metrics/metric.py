@@ -1,23 +1,213 @@
 from loggable.loggable import Loggable
+from metrics.sample_store import SampleStore, DEFAULT_CAPACITY, TIMESTAMP_FIELD
+from metrics.process_tree import ProcessTree
+from columnar import columnar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 import psutil
 import logging
 
+TEXT = 'text'
+COLUMNAR = 'columnar'
+LOG_FORMATS = (TEXT, COLUMNAR)
+ADAPTIVE_RELATIVE_THRESHOLD = 0.1  # Change relative to the previous value beyond which it is an anomaly
+
 
 class Metric(Loggable):
     """
     Class of a metric representing measurable parameters.
     Used for inheriting attributes and common methods.
+    Measurements cover the whole process tree of the given process.
+    Logs are written either as text, or in the columnar binary format,
+    one table per sample store of the metric.
     """
 
-    def __init__(self, process: psutil.Process, command: str, iteration: int, subject: str, debug_logger: logging.Logger):
+    description = 'stats'  # What the logs of the metric hold, for debugging
+
+    # Fields watched by adaptive sampling, to the minimal change of their value considered an anomaly,
+    # of their rate per second if they are cumulative counters
+    adaptive_thresholds: Dict[str, float] = {}
+    adaptive_counters = False
+
+    def __init__(self,
+                 process: psutil.Process,
+                 command: str,
+                 iteration: int,
+                 subject: str,
+                 debug_logger: logging.Logger,
+                 capacity: int = DEFAULT_CAPACITY,
+                 window: int = 0,
+                 tree: ProcessTree = None,
+                 log_format: str = TEXT):
+        """
+        :param process: process to measure.
+        :param command: command ran.
+        :param iteration: iteration number if command is ran multiple times.
+        :param subject: subject of the log.
+        :param debug_logger: for print debugging.
+        :param capacity: maximal number of samples kept in memory, older samples are evicted.
+        :param window: number of samples downsampled into min/max/mean rows, or 0 to keep raw samples.
+        :param tree: index of the process and its descendants, possibly shared with other metrics.
+        :param log_format: 'text' or 'columnar'.
+        """
         super().__init__(command, iteration, subject, debug_logger)
         self.process = process
+        self.tree = tree if tree is not None else ProcessTree(process, debug_logger)
+        self.capacity = capacity
+        self.window = window
+        self.log_format = log_format
+        self.sampling_stats = None
+        self.sampling_error: Optional[str] = None  # Unexpected error the sampling of the metric stopped on
+        self.__watched_sample: Optional[Tuple[float, List[float]]] = None  # Timestamp and values of the fields
+        self.__watched_values: Optional[List[float]] = None  # Values or rates compared for anomalies
 
-    def measure(self):
+    def sample(self, timestamp: float = None):
+        """
+        Take a single measurement of the process.
+        :param timestamp: time of the measurement, now if not given.
+        """
         pass
 
-    def dump_to_file(self, path: str):
-        pass
+    def anomaly(self):
+        """
+        Check whether the latest sample of the watched fields changed from the previous one
+        beyond both their threshold and ADAPTIVE_RELATIVE_THRESHOLD of their previous value.
+        Call once per sample.
+        :return: True if any watched field changed that much.
+        """
+        row = self.__watched_row()
+        if row is None:
+            return False
+
+        timestamp, values = row[TIMESTAMP_FIELD], [row[field] for field in self.adaptive_thresholds]
+        previous_sample, self.__watched_sample = self.__watched_sample, (timestamp, values)
+        if self.adaptive_counters:
+            if previous_sample is None or timestamp <= previous_sample[0]:
+                return False
+            elapsed = timestamp - previous_sample[0]
+            values = [(value - previous) / elapsed for value, previous in zip(values, previous_sample[1])]
+
+        previous_values, self.__watched_values = self.__watched_values, values
+        if previous_values is None:
+            return False
+        return any(abs(value - previous) > max(threshold, ADAPTIVE_RELATIVE_THRESHOLD * abs(previous))
+                   for value, previous, threshold in zip(values, previous_values, self.adaptive_thresholds.values()))
+
+    def measure(self):
+        """
+        Perform the measurements as long as the process is running and is not a zombie.
+        """
+        while self.process.is_running():
+            self.tree.refresh()
+            self.sample()
+
+            if self.process.status() == psutil.STATUS_ZOMBIE:
+                break
+
+    def dump_to_file(self):
+        """
+        Dump current measurements to a file.
+        """
+        self.debug_logger.debug(f'Dumping to file {self.description} of command {self.command}'
+                                f' at iteration {self.iteration}')
 
-    def __str__(self):
+        try:
+            if self.log_format == COLUMNAR:
+                with self._open_log(columnar.EXTENSION, binary=True) as fd:
+                    columnar.write(fd, self.__tables(), self.__metadata())
+            else:
+                with self._open_log() as fd:
+                    self._write_text(fd)
+
+        except EnvironmentError as e:
+            print(e)
+
+    def _write_text(self, fd):
+        """
+        Write the measurements as text.
+        :param fd: file to write to.
+        """
         pass
+
+    def _stores(self) -> Dict[str, SampleStore]:
+        """
+        :return: dict of table name to sample store of the metric, for columnar logs.
+        """
+        return {}
+
+    def _metadata(self) -> dict:
+        """
+        :return: JSON serializable measurements that are not samples, for columnar logs.
+        """
+        return {}
+
+    def _collect(self, measure: Callable[[psutil.Process], object]) -> List[Tuple[psutil.Process, object]]:
+        """
+        Measure every process of the tree.
+        Descendants found gone are dropped from the tree, while the root being gone ends the sampling.
+        :param measure: function of a process to its measurement.
+        :return: list of tuples of a process and its measurement, root first.
+        """
+        measurements = []
+        for process in self.tree.processes():
+            try:
+                measurements.append((process, measure(process)))
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                if process is self.process:
+                    raise
+                self.tree.discard(process)
+            except psutil.AccessDenied:
+                if process is self.process:
+                    raise
+        return measurements
+
+    def _new_store(self, fields: Sequence[str]):
+        """
+        Create a sample store configured for this metric.
+        :param fields: names of the numeric fields of a sample.
+        :return: SampleStore object.
+        """
+        return SampleStore(fields, self.capacity, self.window)
+
+    @staticmethod
+    def _print_store(store: SampleStore, fd):
+        """
+        Print the rows of a sample store, one per line.
+        :param store: store to print.
+        :param fd: file to print to.
+        """
+        if store.evicted > 0:
+            print(f'({store.evicted} earlier rows evicted)', file=fd)
+        fd.writelines(f'{store.evicted + index + 1}: {row}\n' for index, row in enumerate(store.rows()))
+
+    def _print_sampling_stats(self, fd):
+        """
+        Print the sampling statistics, if the metric was sampled by a sampler.
+        :param fd: file to print to.
+        """
+        if self.sampling_stats is not None:
+            print(f'\nSampling: {self.sampling_stats}', file=fd)
+        if self.sampling_error is not None:
+            print(f'Sampling stopped early on an error: {self.sampling_error}', file=fd)
+
+    def __watched_row(self):
+        """
+        :return: the latest sample of the store holding the watched fields, or None if none.
+        """
+        if not self.adaptive_thresholds:
+            return None
+        for store in self._stores().values():
+            if store is not None and all(field in store.fields for field in self.adaptive_thresholds):
+                return store.last()
+        return None
+
+    def __tables(self):
+        return {name: store.columns() for name, store in self._stores().items() if store is not None}
+
+    def __metadata(self):
+        return {'command': self.command,
+                'iteration': self.iteration,
+                'subject': self.subject,
+                'evicted': {name: store.evicted for name, store in self._stores().items() if store is not None},
+                'sampling': self.sampling_stats.as_dict() if self.sampling_stats is not None else None,
+                'sampling_error': self.sampling_error,
+                **self._metadata()}
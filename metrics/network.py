@@ -1,58 +1,237 @@
 from metrics import metric
+from metrics.sample_store import DEFAULT_CAPACITY
+from metrics.process_tree import ProcessTree
+from metrics.sock_diag import SockDiag
+from typing import Dict, List, Optional, Set, Tuple
+import ipaddress
 import logging
 import psutil
+import socket
+import time
+import sys
+import os
+
+DEV_FIELDS = ('rx_bytes', 'rx_packets', 'tx_bytes', 'tx_packets')
+SOCKET_TABLES = ('tcp', 'tcp6', 'udp', 'udp6')
+TCP_FAMILIES = {'tcp': socket.AF_INET, 'tcp6': socket.AF_INET6}
+LOOPBACK = b'lo'
+SOCKET_SCAN_INTERVAL = 1  # Seconds, between scans of the sockets of an unchanged process tree
+
+# Sources of the traffic recorded
+NAMESPACE = 'namespace'  # Interface counters of the network namespace of the process, its own
+SOCKETS = 'sockets'  # Counters of the TCP sockets of the process tree, in the namespace of the host
+HOST = 'host'  # Interface counters of the host, if its sockets cannot be queried
 
 
 class Network(metric.Metric):
     """
     Monitor network stats of a given process.
+    Traffic is read from the interface counters of the network namespace
+    of the process (/proc/<pid>/net/dev), and recorded as deltas per sample.
+    The counters are re-read through the /proc reader of the process.
+    If the process shares the network namespace of the host, these count
+    the traffic of every process of the host, so the traffic of the TCP
+    sockets of the process tree is recorded instead, as read with
+    sock_diag: bytes received and acknowledged, and segments in and out.
+    Those of closed sockets are kept as last read. If sock_diag is not
+    available, the interface counters of the host are recorded, and
+    reported as host-wide.
+    Sockets are found through the file descriptors of the process tree,
+    scanned when processes were added to or dropped from the tree, and
+    otherwise every SOCKET_SCAN_INTERVAL, and only sockets not seen before
+    are looked up in the socket tables, so sampling cost does not grow
+    with the rate or the host connection count.
     """
 
-    def __init__(self, process: psutil.Process, command: str, iteration: int, debug_logger: logging.Logger):
-        super().__init__(process, command, iteration, str(self), debug_logger)
-        self.io_counters_dicts: list = []
-        self.connections_dicts: list = []
+    description = 'network stats'
+
+    def __init__(self,
+                 process: psutil.Process,
+                 command: str,
+                 iteration: int,
+                 debug_logger: logging.Logger,
+                 capacity: int = DEFAULT_CAPACITY,
+                 window: int = 0,
+                 tree: ProcessTree = None,
+                 log_format: str = metric.TEXT):
+        super().__init__(process, command, iteration, str(self), debug_logger, capacity, window, tree, log_format)
+        self.sockets: Dict[int, str] = {}  # Inode to description, of every socket seen
+        self.shared_namespace = self.__is_namespace_shared()
+        self.traffic = NAMESPACE if not self.shared_namespace else \
+            SOCKETS if self.tree.sock_diag() is not None else HOST
+        self.io_counters = self._new_store(DEV_FIELDS + ('sockets',))
+        self.__baseline: Optional[List[int]] = None
+        self.__previous: Optional[List[int]] = None
+        self.__open_sockets: Set[int] = set()
+        self.__scanned: Optional[Tuple[int, float]] = None  # Tree generation and time of the last socket scan
+        self.__tcp_sockets: Dict[int, Tuple[int, bytes]] = {}  # Inode to family and sock_diag id, of TCP sockets
+        self.__socket_counters: Dict[int, Tuple[int, ...]] = {}  # Inode to latest counters, of TCP sockets
 
-    def measure(self):
+    def sample(self, timestamp: float = None):
         """
-        Perform the measurements as long as the process is running and is not a zombie.
+        Take a single network measurement of the process.
+        :param timestamp: time of the measurement, now if not given.
         """
-        self.debug_logger.debug(f'Measuring network stats of command {self.command} at iteration {self.iteration}')
+        now = time.monotonic()
+        if self.__scanned is None or self.__scanned[0] != self.tree.generation or \
+                now - self.__scanned[1] >= SOCKET_SCAN_INTERVAL:
+            self.__scanned = (self.tree.generation, now)
+            self.__open_sockets = self.__read_socket_inodes()
+            unknown = self.__open_sockets.difference(self.sockets)
+            if unknown:
+                self.sockets.update(self.__describe_sockets(unknown))
+
+        counters = self.__read_sockets() if self.traffic == SOCKETS else self.__read_dev()
+        if self.__baseline is None:
+            self.__baseline = self.__previous = counters
+        deltas = [current - previous for current, previous in zip(counters, self.__previous)]
+        self.io_counters.append(deltas + [len(self.__open_sockets)], timestamp)
+        self.__previous = counters
+
+    def _write_text(self, fd):
+        if self.traffic == SOCKETS:
+            print('Note: the process shares the network namespace of the host, so its traffic is that of the TCP'
+                  ' sockets of its process tree (bytes received and acknowledged, segments in and out), other'
+                  ' sockets are only listed', file=fd)
+        elif self.traffic == HOST:
+            print('Note: the process shares the network namespace of the host, and its sockets cannot be queried,'
+                  ' so the network IO below is HOST-WIDE, including the traffic of every other process', file=fd)
+
+        print('\nSockets:', file=fd)
+        for inode, description in self.sockets.items():
+            print(f'{inode}: {description}', file=fd)
+
+        headers = {NAMESPACE: 'Network IO deltas:', SOCKETS: 'Network IO deltas of the TCP sockets:',
+                   HOST: 'Host-wide network IO deltas:'}
+        print(f'\n{headers[self.traffic]}', file=fd)
+        self._print_store(self.io_counters, fd)
+
+        totals = self.__totals()
+        if totals is not None:
+            print(f'\n{"Host-wide total" if self.traffic == HOST else "Total"} network IO counters: {totals}', file=fd)
+
+        self._print_sampling_stats(fd)
+
+    def _stores(self):
+        return {'io_counters': self.io_counters}
 
-        while self.process.is_running():
-            # Challenge: access denied here if not using root
-            connections_dict = self.process.connections()
-            # _asdict() is protected but necessary for iterating using keys
-            net_io_counters_dict = psutil.net_io_counters()._asdict()
-            self.connections_dicts.append(connections_dict)
-            self.io_counters_dicts.append(net_io_counters_dict)
+    def _metadata(self):
+        return {'shared_namespace': self.shared_namespace,
+                'traffic': self.traffic,
+                'sockets': self.sockets,
+                'totals': self.__totals()}
 
-            if self.process.status() == psutil.STATUS_ZOMBIE:
-                break
+    def __totals(self):
+        if self.__baseline is None:
+            return None
+        return {field: current - baseline for field, current, baseline
+                in zip(DEV_FIELDS, self.__previous, self.__baseline)}
 
-    def dump_to_file(self):
+    def __is_namespace_shared(self):
+        try:
+            return os.readlink(f'/proc/{self.process.pid}/ns/net') == os.readlink('/proc/self/ns/net')
+        except OSError:
+            return True
+
+    def __read_dev(self) -> List[int]:
+        """
+        Sum the counters of the interfaces of the network namespace of the process, except loopback.
+        """
+        reader = self.tree.reader(self.process)
+        try:
+            if reader is not None:
+                data = reader.read_net_dev()
+            else:
+                with open(f'/proc/{self.process.pid}/net/dev', 'rb') as fd:
+                    data = fd.read()
+        except FileNotFoundError:
+            raise psutil.NoSuchProcess(self.process.pid)
+        except PermissionError:
+            raise psutil.AccessDenied(self.process.pid)
+
+        counters = [0] * len(DEV_FIELDS)
+        for line in data.splitlines()[2:]:  # Skip the two header lines
+            interface, values = line.split(b':', 1)
+            if interface.strip() == LOOPBACK:
+                continue
+            values = values.split()
+            # Receive bytes and packets are the 1st and 2nd columns, transmit ones the 9th and 10th
+            for index, column in enumerate((0, 1, 8, 9)):
+                counters[index] += int(values[column])
+        return counters
+
+    def __read_sockets(self) -> List[int]:
         """
-        Dump current measurements to a file.
+        Sum the counters of the TCP sockets of the process tree, in the order of DEV_FIELDS.
         """
-        self.debug_logger.debug(f'Dumping to file network stats of command {self.command}'
-                                f' at iteration {self.iteration}')
+        open_tcp_sockets = [(inode, *self.__tcp_sockets[inode]) for inode in self.__open_sockets
+                            if inode in self.__tcp_sockets]
+        if open_tcp_sockets:
+            self.__socket_counters.update(self.tree.sock_diag().tcp_counters(open_tcp_sockets))
+        counters = [0] * len(DEV_FIELDS)
+        for socket_counters in self.__socket_counters.values():
+            for index, value in enumerate(socket_counters):
+                counters[index] += value
+        return counters
+
+    def __read_socket_inodes(self):
+        inodes = set()
+        for _, process_inodes in self._collect(self.__read_process_socket_inodes):
+            inodes.update(process_inodes)
+        return inodes
 
+    @staticmethod
+    def __read_process_socket_inodes(process: psutil.Process):
+        inodes = set()
         try:
-            with open(self._get_log_path('log'), 'w') as fd:
-                print('Connections:', file=fd)
-                for index in range(len(self.connections_dicts)):
-                    print(f'{index+1}: {self.connections_dicts[index]}', file=fd)
+            for entry in os.scandir(f'/proc/{process.pid}/fd'):
+                try:
+                    target = os.readlink(entry.path)
+                except OSError:
+                    continue  # Closed in the meantime
+                if target.startswith('socket:['):
+                    inodes.add(int(target[8:-1]))
+        except FileNotFoundError:
+            raise psutil.NoSuchProcess(process.pid)
+        except PermissionError:
+            raise psutil.AccessDenied(process.pid)
+        return inodes
 
-                print('\nNetwork IO:', file=fd)
-                for index in range(len(self.io_counters_dicts)):
-                    print(f'{index+1}: {self.io_counters_dicts[index]}', file=fd)
+    def __describe_sockets(self, inodes):
+        descriptions = {inode: 'unix or other' for inode in inodes}
+        for table in SOCKET_TABLES:
+            try:
+                with open(f'/proc/{self.process.pid}/net/{table}') as fd:
+                    next(fd)
+                    for line in fd:
+                        fields = line.split()
+                        inode = int(fields[9])
+                        if inode in descriptions:
+                            local, remote = self.__parse_address(fields[1]), self.__parse_address(fields[2])
+                            descriptions[inode] = f'{table} {self.__format_address(*local)}' \
+                                                  f' -> {self.__format_address(*remote)}'
+                            if table in TCP_FAMILIES:
+                                self.__tcp_sockets[inode] = (TCP_FAMILIES[table],
+                                                             SockDiag.socket_id(TCP_FAMILIES[table], local, remote))
+            except EnvironmentError:
+                continue
+        return descriptions
 
-                if len(self.io_counters_dicts) > 0:
-                    print(f'\nTotal network IO counters: {self.io_counters_dicts[len(self.io_counters_dicts) - 1]}',
-                          file=fd)
+    @staticmethod
+    def __parse_address(address: str):
+        """
+        Parse an address of a socket table, e.g. '0100007F:1F90' to b'\\x7f\\x00\\x00\\x01' and 8080.
+        :return: tuple of the packed host, in network byte order, and the port.
+        """
+        host, port = address.split(':')
+        # Hosts are printed as 32 bit words in host byte order
+        raw = b''.join(int(host[i:i + 8], 16).to_bytes(4, sys.byteorder) for i in range(0, len(host), 8))
+        return raw, int(port, 16)
 
-        except EnvironmentError as e:
-            print(e)
+    @staticmethod
+    def __format_address(raw: bytes, port: int):
+        ip = ipaddress.ip_address(raw)
+        return f'{ip}:{port}' if ip.version == 4 else f'[{ip}]:{port}'
 
     def __str__(self):
         return 'network'
@@ -0,0 +1,223 @@
+from array import array
+from typing import Optional
+import errno
+import psutil
+import time
+import os
+
+BUFFER_SIZE = 4096  # Bytes, more than any of the per process files read
+TABLE_BUFFER_SIZE = 1 << 16  # Bytes, of the tables of the network namespace, read until a short read
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# Fields in the order of psutil's Linux namedtuples, so both sources are interchangeable
+IO_FIELDS = ('read_count', 'write_count', 'read_bytes', 'write_bytes', 'read_chars', 'write_chars')
+MEMORY_FIELDS = ('rss', 'vms', 'shared', 'text', 'lib', 'data', 'dirty')
+
+# Slots of the parsed values
+STATE, UTIME, STIME, CUTIME, CSTIME, NUM_THREADS, PROCESSOR = range(7)
+IO_SLOTS = range(7, 7 + len(IO_FIELDS))
+MEMORY_SLOTS = range(IO_SLOTS.stop, IO_SLOTS.stop + len(MEMORY_FIELDS))
+SLOTS = MEMORY_SLOTS.stop
+
+# Keys of /proc/<pid>/io, in the order of IO_FIELDS
+IO_KEYS = (b'syscr', b'syscw', b'read_bytes', b'write_bytes', b'rchar', b'wchar')
+
+
+class ProcReader:
+    """
+    Low-overhead reader of the /proc files of a process (Linux only).
+    The stat, io and statm files are opened once and re-read with pread,
+    and their values are parsed into preallocated numeric slots, which
+    saves the open, parse and namedtuple overhead of a psutil call per value.
+    The smaps_rollup and net/dev files are opened on first use, and re-read
+    with pread as well.
+    An open file also keeps referring to the same process, so a reused pid
+    is never mistaken for it.
+    Callers fall back to psutil if the reader is not available.
+    """
+
+    def __init__(self, pid: int):
+        """
+        :param pid: pid of the process.
+        :raise psutil.NoSuchProcess: if the process does not exist.
+        :raise psutil.AccessDenied: if its stat file cannot be read.
+        """
+        self.pid = pid
+        self.slots = array('d', [0.0]) * SLOTS
+        self.__stat_fd: Optional[int] = None
+        self.__io_fd: Optional[int] = None
+        self.__statm_fd: Optional[int] = None
+        self.__smaps_fd: Optional[int] = None
+        self.__net_dev_fd: Optional[int] = None
+        try:
+            self.__stat_fd = self.__open('stat')
+            self.__io_fd = self.__try_open('io')
+            self.__statm_fd = self.__try_open('statm')
+        except Exception:
+            # E.g. the process exited in between, the files already opened are not left open
+            self.close()
+            raise
+        self.__opened = set()  # Names of the files opened on first use, or found not available
+        self.__last_cpu = None  # Tuple of CPU time and wall time of the last cpu_percent call
+
+    @property
+    def has_io(self):
+        return self.__io_fd is not None
+
+    @property
+    def has_memory(self):
+        return self.__statm_fd is not None
+
+    def read_stat(self):
+        """
+        Re-read /proc/<pid>/stat into the slots.
+        """
+        data = self.__pread(self.__stat_fd)
+        # The command name may contain spaces and parentheses, fields follow its last ')'
+        fields = data[data.rindex(b')') + 2:].split()
+        slots = self.slots
+        slots[STATE] = fields[0][0]
+        slots[UTIME] = int(fields[11]) / CLOCK_TICKS
+        slots[STIME] = int(fields[12]) / CLOCK_TICKS
+        slots[CUTIME] = int(fields[13]) / CLOCK_TICKS
+        slots[CSTIME] = int(fields[14]) / CLOCK_TICKS
+        slots[NUM_THREADS] = int(fields[17])
+        slots[PROCESSOR] = int(fields[36])
+
+    def read_io(self):
+        """
+        Re-read /proc/<pid>/io into the slots.
+        """
+        values = {}
+        for line in self.__pread(self.__io_fd).splitlines():
+            key, value = line.split(b':')
+            values[key] = value
+        for slot, key in zip(IO_SLOTS, IO_KEYS):
+            self.slots[slot] = int(values[key])
+
+    def read_statm(self):
+        """
+        Re-read /proc/<pid>/statm into the slots.
+        """
+        # size resident shared text lib data dt, in pages
+        size, resident, shared, text, lib, data, dirty = self.__pread(self.__statm_fd).split()[:7]
+        for slot, pages in zip(MEMORY_SLOTS, (resident, size, shared, text, lib, data, dirty)):
+            self.slots[slot] = int(pages) * PAGE_SIZE
+
+    def read_pss(self):
+        """
+        Re-read the PSS of the process from /proc/<pid>/smaps_rollup (Linux 4.14 and later).
+        :return: PSS in bytes, or NaN if not available, e.g. once the process is a zombie.
+        """
+        if 'smaps_rollup' not in self.__opened:
+            self.__opened.add('smaps_rollup')
+            self.__smaps_fd = self.__try_open('smaps_rollup', missing_ok=True)
+        if self.__smaps_fd is None:
+            return float('nan')
+        try:
+            data = self.__pread(self.__smaps_fd)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return float('nan')  # Its memory is released before it is reaped
+        start = data.find(b'\nPss:')
+        if start < 0:
+            return float('nan')
+        return int(data[start + 5:data.index(b'kB', start)]) * 1024
+
+    def read_net_dev(self) -> bytes:
+        """
+        Re-read /proc/<pid>/net/dev, the interface counters of the network namespace of the process.
+        The file refers to the namespace, and can still be read once the process is gone.
+        :return: contents of the file.
+        """
+        if 'net/dev' not in self.__opened:
+            self.__opened.add('net/dev')
+            self.__net_dev_fd = self.__open('net/dev')
+        chunks, offset = [], 0
+        while True:
+            data = self.__pread(self.__net_dev_fd, TABLE_BUFFER_SIZE, offset)
+            chunks.append(data)
+            offset += len(data)
+            if len(data) < TABLE_BUFFER_SIZE:
+                return b''.join(chunks)
+
+    def is_zombie(self):
+        self.read_stat()
+        return self.slots[STATE] == ord('Z')
+
+    def io_counters(self):
+        """
+        :return: tuple of IO counters, in the order of IO_FIELDS.
+        """
+        self.read_io()
+        return tuple(self.slots[slot] for slot in IO_SLOTS)
+
+    def memory_info(self):
+        """
+        :return: tuple of memory info in bytes, in the order of MEMORY_FIELDS.
+        """
+        self.read_statm()
+        return tuple(self.slots[slot] for slot in MEMORY_SLOTS)
+
+    def cpu_percent(self):
+        """
+        Like psutil.Process.cpu_percent(), the first call returns 0.0 and
+        the next ones the CPU utilization since the previous call.
+        Call after read_stat().
+        :return: CPU utilization as a percentage, possibly over 100 with multiple threads.
+        """
+        now = time.monotonic()
+        cpu = self.slots[UTIME] + self.slots[STIME]
+        last = self.__last_cpu
+        self.__last_cpu = (cpu, now)
+        if last is None or now <= last[1]:
+            return 0.0
+        return round((cpu - last[0]) / (now - last[1]) * 100, 1)
+
+    def cpu_times(self):
+        """
+        Call after read_stat().
+        :return: tuple of user, system, children user and children system times in seconds.
+        """
+        return self.slots[UTIME], self.slots[STIME], self.slots[CUTIME], self.slots[CSTIME]
+
+    def num_threads(self):
+        """
+        Call after read_stat().
+        """
+        return int(self.slots[NUM_THREADS])
+
+    def close(self):
+        for fd in (self.__stat_fd, self.__io_fd, self.__statm_fd, self.__smaps_fd, self.__net_dev_fd):
+            if fd is not None:
+                os.close(fd)
+        self.__stat_fd = self.__io_fd = self.__statm_fd = self.__smaps_fd = self.__net_dev_fd = None
+
+    def __open(self, name: str):
+        try:
+            return os.open(f'/proc/{self.pid}/{name}', os.O_RDONLY)
+        except FileNotFoundError:
+            raise psutil.NoSuchProcess(self.pid)
+        except PermissionError:
+            raise psutil.AccessDenied(self.pid)
+
+    def __try_open(self, name: str, missing_ok=False):
+        try:
+            return self.__open(name)
+        except psutil.AccessDenied:
+            return None
+        except psutil.NoSuchProcess:
+            if missing_ok:
+                return None  # Not supported by the kernel
+            raise
+
+    def __pread(self, fd: int, size=BUFFER_SIZE, offset=0) -> bytes:
+        try:
+            return os.pread(fd, size, offset)
+        except ProcessLookupError:
+            # The process the file was opened for is gone
+            raise psutil.NoSuchProcess(self.pid)
+        except OSError as e:
+            if e.errno == errno.EACCES:
+                raise psutil.AccessDenied(self.pid)
+            raise
@@ -1,4 +1,7 @@
 from metrics import metric
+from metrics.sample_store import DEFAULT_CAPACITY
+from metrics.process_tree import ProcessTree
+from typing import Dict
 import logging
 import psutil
 
@@ -6,59 +9,104 @@ import psutil
 class ProcThCpu(metric.Metric):
     """
     Monitor children processes, threads and
-    CPU usage of a given process.
+    CPU usage of a given process tree.
+    CPU percent and thread counts are summed over the tree,
+    and a breakdown per process of the tree is kept.
     """
 
-    def __init__(self, process: psutil.Process, command: str, iteration: int, debug_logger: logging.Logger):
-        super().__init__(process, command, iteration, str(self), debug_logger)
+    description = 'processes, threads and CPU stats'
+    adaptive_thresholds = {'cpu_percent': 10.0}  # Percentage points
+
+    def __init__(self,
+                 process: psutil.Process,
+                 command: str,
+                 iteration: int,
+                 debug_logger: logging.Logger,
+                 capacity: int = DEFAULT_CAPACITY,
+                 window: int = 0,
+                 tree: ProcessTree = None,
+                 log_format: str = metric.TEXT):
+        super().__init__(process, command, iteration, str(self), debug_logger, capacity, window, tree, log_format)
         self.children: list = []
         self.threads: tuple = ()
-        self.cpu_times: tuple = ()
-        self.cpu_percent_over_time: list = []
+        self.cpu_times: dict = {}
+        self.cpu_percent_over_time = self._new_store(('cpu_percent', 'processes', 'threads'))
+        self.breakdown: Dict[int, dict] = {}  # Pid to latest stats of each process of the tree
         self.cpu_num = self.process.cpu_num() if self.process.is_running() else None
 
-    def measure(self):
+    def sample(self, timestamp: float = None):
         """
-        Perform the measurements as long as the process is running and is not a zombie.
+        Take a single measurement of children processes, threads and CPU usage of the process tree.
+        :param timestamp: time of the measurement, now if not given.
         """
-        self.debug_logger.debug(f'Measuring processes, threads and CPU stats of command {self.command}'
-                                f' at iteration {self.iteration}')
+        # Challenge: access denied here if not using root
+        measurements = self._collect(self.__measure)
+        self.children = self.tree.descendants()
+        self.cpu_times = measurements[0][1][2]
 
-        while self.process.is_running():
-            # Challenge: access denied here if not using root
-            self.children = self.process.children()
+        # Listing the threads is costly, only done when their number changes
+        if measurements[0][1][1] != len(self.threads):
             self.threads = self.process.threads()
-            self.cpu_times = self.process.cpu_times()
-            self.cpu_percent_over_time.append(self.process.cpu_percent())
 
-            if self.process.status() == psutil.STATUS_ZOMBIE:
-                break
+        for process, (cpu_percent, num_threads, cpu_times) in measurements:
+            stats = self.breakdown.get(process.pid)
+            if stats is None:
+                stats = self.breakdown[process.pid] = {'name': self.__name(process), 'peak_cpu_percent': 0.0}
+            stats['peak_cpu_percent'] = max(stats['peak_cpu_percent'], cpu_percent)
+            stats['threads'] = num_threads
+            stats['cpu_times'] = cpu_times
 
-    def dump_to_file(self):
-        """
-        Dump current measurements to a file.
-        """
-        self.debug_logger.debug(f'Dumping to file processes, threads and CPU stats of command {self.command}'
-                                f' at iteration {self.iteration}')
+        self.cpu_percent_over_time.append((sum(cpu_percent for _, (cpu_percent, _, _) in measurements),
+                                           len(measurements),
+                                           sum(num_threads for _, (_, num_threads, _) in measurements)), timestamp)
 
-        try:
-            with open(self._get_log_path('log'), 'w') as fd:
-                print('Children processes summary:', file=fd)
-                print(self.children, file=fd)
+    def __measure(self, process: psutil.Process):
+        reader = self.tree.reader(process)
+        if reader is None:
+            return process.cpu_percent(), process.num_threads(), process.cpu_times()._asdict()
+
+        reader.read_stat()
+        return (reader.cpu_percent(),
+                reader.num_threads(),
+                dict(zip(('user', 'system', 'children_user', 'children_system'), reader.cpu_times())))
+
+    def _write_text(self, fd):
+        print('Children processes summary:', file=fd)
+        print(self.children, file=fd)
 
-                print('\nThreads summary:', file=fd)
-                print(self.threads, file=fd)
+        print('\nThreads summary:', file=fd)
+        print(self.threads, file=fd)
 
-                print('\nCPU times spent in modes:', file=fd)
-                print(self.cpu_times, file=fd)
+        print('\nCPU times spent in modes:', file=fd)
+        print(self.cpu_times, file=fd)
 
-                print(f'\nCPU percent over time:', file=fd)
-                print(self.cpu_percent_over_time, file=fd)
+        print('\nCPU percent, processes and threads of the tree over time:', file=fd)
+        self._print_store(self.cpu_percent_over_time, fd)
 
-                print(f'\nCPU number: {self.cpu_num}', file=fd)
+        print(f'\nCPU number: {self.cpu_num}', file=fd)
 
-        except EnvironmentError as e:
-            print(e)
+        print('\nPer process breakdown:', file=fd)
+        for pid, stats in self.breakdown.items():
+            print(f'{pid}: {stats}', file=fd)
+
+        self._print_sampling_stats(fd)
+
+    def _stores(self):
+        return {'cpu_percent_over_time': self.cpu_percent_over_time}
+
+    def _metadata(self):
+        return {'children': [child.pid for child in self.children],
+                'threads': [thread._asdict() for thread in self.threads],
+                'cpu_times': self.cpu_times,
+                'cpu_num': self.cpu_num,
+                'breakdown': self.breakdown}
+
+    @staticmethod
+    def __name(process: psutil.Process):
+        try:
+            return process.name()
+        except psutil.Error:
+            return None
 
     def __str__(self):
         return 'proc_th_cpu'
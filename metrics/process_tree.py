@@ -0,0 +1,181 @@
+from metrics.proc_reader import ProcReader
+from metrics.sock_diag import SockDiag
+from typing import Dict, List, Optional
+import logging
+import psutil
+import sys
+import os
+
+LOADAVG_PATH = '/proc/loadavg'
+
+
+class ProcessTree:
+    """
+    Index of a process and its descendants.
+    The index is updated incrementally rather than rebuilt on every sample:
+    children are only looked for when a process was forked on the system
+    since the last refresh (the last allocated pid in /proc/loadavg changed),
+    by reading the children lists of the known processes, and exited
+    processes are dropped as they are found gone. Process objects are kept
+    across refreshes, so their state (e.g. for cpu_percent) is preserved.
+    Descendants re-parented after their parent exited stay in the index.
+    On Linux, a /proc reader is also kept per process of the index, for
+    the metrics to sample through instead of psutil. The generation of the
+    index is incremented whenever processes are added or dropped, for the
+    metrics to only redo per tree work when it changed. A sock_diag
+    reader is kept as well, for the sockets of the tree to be looked up.
+    """
+
+    def __init__(self, root: psutil.Process, debug_logger: logging.Logger):
+        """
+        :param root: root process of the tree.
+        :param debug_logger: for print debugging.
+        """
+        self.root = root
+        self.debug_logger = debug_logger
+        self.generation = 0
+        self.__processes: Dict[int, psutil.Process] = {root.pid: root}
+        self.__readers: Dict[int, Optional[ProcReader]] = {}
+        self.__last_pid: Optional[bytes] = None
+        self.__loadavg_fd: Optional[int] = None
+        self.__sock_diag: Optional[SockDiag] = None
+        self.__sock_diag_opened = False
+        self.__children_files = os.path.exists(f'/proc/{os.getpid()}/task/{os.getpid()}/children')
+
+    def refresh(self):
+        """
+        Update the index if processes were forked since the last refresh.
+        :return: list of the processes added to the index.
+        """
+        last_pid = self.__read_last_pid()
+        if last_pid is not None and last_pid == self.__last_pid:
+            return []
+        self.__last_pid = last_pid
+
+        added = []
+        if self.__children_files:
+            pending = list(self.__processes)
+            while pending:
+                for child_pid in self.__read_children(pending.pop()):
+                    if child_pid not in self.__processes:
+                        pending.append(child_pid)
+                        added.append(self.__add(child_pid))
+        else:
+            try:
+                for child in self.root.children(recursive=True):
+                    if child.pid not in self.__processes:
+                        self.__processes[child.pid] = child
+                        added.append(child)
+            except psutil.NoSuchProcess:
+                pass
+
+        added = [process for process in added if process is not None]
+        if added:
+            self.generation += 1
+            self.debug_logger.debug(f'Processes {[process.pid for process in added]} added to the tree'
+                                    f' of {self.root.pid}')
+        return added
+
+    def discard(self, process: psutil.Process):
+        """
+        Drop an exited descendant from the index.
+        :param process: exited process.
+        """
+        if process is not self.root and self.__processes.pop(process.pid, None) is not None:
+            self.generation += 1
+            self.__close_reader(process.pid)
+
+    def reader(self, process: psutil.Process) -> Optional[ProcReader]:
+        """
+        Get the /proc reader of a process of the tree, opening it on first use.
+        :param process: process of the tree.
+        :return: ProcReader object, or None if not available, in which case psutil is to be used.
+        """
+        try:
+            return self.__readers[process.pid]
+        except KeyError:
+            pass
+
+        reader = None
+        if sys.platform.startswith('linux'):
+            try:
+                reader = ProcReader(process.pid)
+            except psutil.AccessDenied:
+                pass
+        self.__readers[process.pid] = reader
+        return reader
+
+    def sock_diag(self) -> Optional[SockDiag]:
+        """
+        Get the sock_diag reader of the tree, opening it on first use.
+        :return: SockDiag object, or None if not available.
+        """
+        if not self.__sock_diag_opened:
+            self.__sock_diag_opened = True
+            if sys.platform.startswith('linux'):
+                try:
+                    self.__sock_diag = SockDiag()
+                except OSError as e:
+                    self.debug_logger.debug(f'sock_diag is not available: {e}')
+        return self.__sock_diag
+
+    def close(self):
+        """
+        Close the /proc readers of the tree, /proc/loadavg and the sock_diag reader.
+        """
+        for pid in list(self.__readers):
+            self.__close_reader(pid)
+        if self.__sock_diag is not None:
+            self.__sock_diag.close()
+            self.__sock_diag = None
+        if self.__loadavg_fd is not None:
+            os.close(self.__loadavg_fd)
+            self.__loadavg_fd = None
+
+    def processes(self) -> List[psutil.Process]:
+        """
+        :return: the processes of the tree, root first.
+        """
+        return list(self.__processes.values())
+
+    def descendants(self) -> List[psutil.Process]:
+        """
+        :return: the processes of the tree, except the root.
+        """
+        return [process for process in self.__processes.values() if process is not self.root]
+
+    def __len__(self):
+        return len(self.__processes)
+
+    def __close_reader(self, pid: int):
+        reader = self.__readers.pop(pid, None)
+        if reader is not None:
+            reader.close()
+
+    def __add(self, pid: int):
+        try:
+            process = psutil.Process(pid)
+        except psutil.NoSuchProcess:
+            return None
+        self.__processes[pid] = process
+        return process
+
+    def __read_last_pid(self):
+        try:
+            if self.__loadavg_fd is None:
+                self.__loadavg_fd = os.open(LOADAVG_PATH, os.O_RDONLY)
+            return os.pread(self.__loadavg_fd, 128, 0).split()[-1]
+        except (EnvironmentError, IndexError):
+            return None
+
+    @staticmethod
+    def __read_children(pid: int):
+        children = []
+        try:
+            # Children are listed per thread of the parent
+            for tid in os.listdir(f'/proc/{pid}/task'):
+                with open(f'/proc/{pid}/task/{tid}/children') as fd:
+                    children.extend(int(child) for child in fd.read().split())
+        except EnvironmentError:
+            pass  # Exited in the meantime
+        return children
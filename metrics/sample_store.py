@@ -0,0 +1,140 @@
+from array import array
+from typing import Dict, Iterator, List, Optional, Sequence
+import time
+
+DEFAULT_CAPACITY = 100000  # Rows
+TIMESTAMP_FIELD = 'timestamp'
+SAMPLES_FIELD = 'samples'
+
+
+class SampleStore:
+    """
+    Bounded, array-backed store of numeric samples.
+    Each field is kept in its own column of doubles, next to a
+    timestamp column. Once the capacity is reached, the oldest rows
+    are overwritten (ring-buffer eviction).
+    Optionally, every window of raw samples is downsampled into a
+    single row holding the min, max and mean of each field, so that
+    memory stays constant no matter how long the command runs.
+    """
+
+    def __init__(self, fields: Sequence[str], capacity: int = DEFAULT_CAPACITY, window: int = 0):
+        """
+        :param fields: names of the numeric fields of a sample.
+        :param capacity: maximal number of rows kept.
+        :param window: number of raw samples aggregated into a row, or 0 to keep raw samples.
+        """
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self.window = window
+        self.count = 0  # Raw samples appended
+        self.evicted = 0  # Rows overwritten
+        self.__columns = {name: array('d') for name in self.__column_names()}
+        self.__head = 0  # Index of the oldest row, once the buffer is full
+        self.__last: Optional[List[float]] = None
+        self.__last_timestamp = 0.0
+        self.__pending: Optional[Dict[str, float]] = None
+
+    def append(self, values: Sequence[float], timestamp: float = None):
+        """
+        Add a sample.
+        :param values: values of the fields, in order.
+        :param timestamp: time of the sample, now if not given.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        values = [float(value) for value in values]
+        self.count += 1
+        self.__last = values
+        self.__last_timestamp = timestamp
+
+        if not self.window:
+            row = dict(zip(self.fields, values))
+            row[TIMESTAMP_FIELD] = timestamp
+            self.__store(row)
+            return
+
+        if self.__pending is None:
+            self.__pending = {TIMESTAMP_FIELD: timestamp, SAMPLES_FIELD: 0.0}
+            for field, value in zip(self.fields, values):
+                self.__pending[f'{field}_min'] = value
+                self.__pending[f'{field}_max'] = value
+                self.__pending[f'{field}_mean'] = 0.0
+
+        pending = self.__pending
+        pending[SAMPLES_FIELD] += 1
+        for field, value in zip(self.fields, values):
+            pending[f'{field}_min'] = min(pending[f'{field}_min'], value)
+            pending[f'{field}_max'] = max(pending[f'{field}_max'], value)
+            pending[f'{field}_mean'] += (value - pending[f'{field}_mean']) / pending[SAMPLES_FIELD]
+
+        if pending[SAMPLES_FIELD] == self.window:
+            self.__store(pending)
+            self.__pending = None
+
+    def last(self) -> Optional[Dict[str, float]]:
+        """
+        :return: the latest raw sample as a dict, or None if empty.
+        """
+        if self.__last is None:
+            return None
+        row = dict(zip(self.fields, self.__last))
+        row[TIMESTAMP_FIELD] = self.__last_timestamp
+        return row
+
+    def rows(self) -> Iterator[Dict[str, float]]:
+        """
+        Iterate over the stored rows, oldest first, including a partially aggregated window.
+        :return: iterator of dicts of column name to value.
+        """
+        names = self.__column_names()
+        size = len(self.__columns[TIMESTAMP_FIELD])
+        for offset in range(size):
+            index = (self.__head + offset) % size
+            yield {name: self.__columns[name][index] for name in names}
+
+        if self.__pending is not None:
+            yield dict(self.__pending)
+
+    def values(self, field: str) -> List[float]:
+        """
+        Get the values of a field over time, oldest first.
+        When downsampling, these are the means of the windows.
+        :param field: name of the field.
+        :return: list of values.
+        """
+        name = f'{field}_mean' if self.window else field
+        return [row[name] for row in self.rows()]
+
+    def columns(self) -> Dict[str, array]:
+        """
+        :return: dict of column name to array, oldest row first, including a partially aggregated window.
+        """
+        columns = {}
+        for name, column in self.__columns.items():
+            columns[name] = column[self.__head:] + column[:self.__head]
+            if self.__pending is not None:
+                columns[name].append(self.__pending[name])
+        return columns
+
+    def __len__(self):
+        return len(self.__columns[TIMESTAMP_FIELD]) + (self.__pending is not None)
+
+    def __column_names(self):
+        if not self.window:
+            return (TIMESTAMP_FIELD,) + self.fields
+        names = [TIMESTAMP_FIELD, SAMPLES_FIELD]
+        for field in self.fields:
+            names.extend((f'{field}_min', f'{field}_max', f'{field}_mean'))
+        return tuple(names)
+
+    def __store(self, row: Dict[str, float]):
+        if len(self.__columns[TIMESTAMP_FIELD]) < self.capacity:
+            for name, column in self.__columns.items():
+                column.append(row[name])
+            return
+
+        # Buffer is full, overwrite the oldest row
+        for name, column in self.__columns.items():
+            column[self.__head] = row[name]
+        self.__head = (self.__head + 1) % self.capacity
+        self.evicted += 1
@@ -0,0 +1,252 @@
+from metrics.metric import Metric
+from metrics.process_tree import ProcessTree
+from typing import List
+import threading
+import logging
+import psutil
+import math
+import time
+
+DEFAULT_SAMPLE_INTERVAL = 0.01  # Seconds
+DEFAULT_CALM_TICKS = 10  # Ticks without anomaly after which adaptive sampling drops back to the slow rate
+
+
+class SamplingStats:
+    """
+    Statistics of a sampling session: achieved rate and
+    jitter of the ticks relative to their schedule, and with
+    adaptive sampling, how often and how long the rate was boosted.
+    """
+
+    def __init__(self, interval: float, slow_interval: float = None):
+        """
+        :param interval: target interval between ticks, in seconds.
+        :param slow_interval: with adaptive sampling, target interval between ticks while stable, in seconds.
+        """
+        self.interval = interval
+        self.slow_interval = slow_interval
+        self.boosts = 0
+        self.fast_ticks = 0
+        self.ticks = 0
+        self.missed = 0
+        self.started = None
+        self.stopped = None
+        self.jitter_mean = 0.0
+        self.jitter_max = 0.0
+        self.__jitter_m2 = 0.0
+
+    def add_tick(self, lateness: float, fast: bool = True):
+        """
+        Account for a tick.
+        :param lateness: delay of the tick relative to its schedule, in seconds.
+        :param fast: whether the tick was at the fast rate, with adaptive sampling.
+        """
+        # Welford's online algorithm, so no per-tick history is kept
+        self.ticks += 1
+        self.fast_ticks += fast
+        delta = lateness - self.jitter_mean
+        self.jitter_mean += delta / self.ticks
+        self.__jitter_m2 += delta * (lateness - self.jitter_mean)
+        self.jitter_max = max(self.jitter_max, lateness)
+
+    @property
+    def jitter_stddev(self):
+        return math.sqrt(self.__jitter_m2 / self.ticks) if self.ticks > 0 else 0.0
+
+    @property
+    def rate(self):
+        """
+        :return: achieved sample rate in Hz.
+        """
+        if self.started is None or self.stopped is None or self.stopped <= self.started:
+            return 0.0
+        return self.ticks / (self.stopped - self.started)
+
+    def as_dict(self):
+        """
+        :return: dict of the statistics, times in seconds.
+        """
+        return {'interval': self.interval,
+                'slow_interval': self.slow_interval,
+                'boosts': self.boosts,
+                'fast_ticks': self.fast_ticks,
+                'ticks': self.ticks,
+                'missed': self.missed,
+                'duration': (self.stopped or 0) - (self.started or 0),
+                'rate': self.rate,
+                'jitter_mean': self.jitter_mean,
+                'jitter_stddev': self.jitter_stddev,
+                'jitter_max': self.jitter_max}
+
+    def __str__(self):
+        if self.slow_interval is None:
+            target = f'target {1 / self.interval:.1f}Hz'
+        else:
+            target = (f'target {1 / self.slow_interval:.1f}Hz, boosted to {1 / self.interval:.1f}Hz'
+                      f' {self.boosts} times for {self.fast_ticks} samples')
+        return (f'{self.ticks} samples in {(self.stopped or 0) - (self.started or 0):.3f}s;'
+                f' Rate: {self.rate:.1f}Hz ({target});'
+                f' Missed ticks: {self.missed};'
+                f' Jitter: mean {self.jitter_mean * 1000:.3f}ms,'
+                f' stddev {self.jitter_stddev * 1000:.3f}ms,'
+                f' max {self.jitter_max * 1000:.3f}ms')
+
+
+class Sampler:
+    """
+    Drive a group of metrics from a single scheduler tick.
+    A background thread samples every metric once per tick for as long
+    as the process is running and is not a zombie, so all the metrics
+    cover the same time span of the command execution.
+    Ticks are scheduled at fixed offsets from the start, so that
+    the schedule does not drift, and the thread sleeps in between.
+    In adaptive mode, ticks are slow while the metrics are stable, and
+    fast from a tick where a metric reports an anomaly or a process joins
+    the tree, until a number of calm ticks in a row (hysteresis), so
+    bursts are captured in detail at a fraction of the steady cost.
+    A metric failing for another reason than the process being gone is
+    no longer sampled, the error being kept for its log.
+    """
+
+    def __init__(self,
+                 process: psutil.Process,
+                 metrics: List[Metric],
+                 debug_logger: logging.Logger,
+                 interval: float = DEFAULT_SAMPLE_INTERVAL,
+                 tree: ProcessTree = None,
+                 slow_interval: float = None,
+                 calm_ticks: int = DEFAULT_CALM_TICKS):
+        """
+        :param process: process measured by the metrics.
+        :param metrics: metrics to sample on each tick.
+        :param debug_logger: for print debugging.
+        :param interval: interval between ticks, in seconds, while boosted in adaptive mode.
+        :param tree: process tree shared by the metrics, refreshed once per tick.
+        :param slow_interval: if given, adaptive mode interval between ticks while stable, in seconds.
+        :param calm_ticks: number of ticks in a row without anomaly to drop back to the slow interval.
+        """
+        self.process = process
+        self.metrics = metrics
+        self.tree = tree
+        self.debug_logger = debug_logger
+        self.interval = interval
+        self.slow_interval = slow_interval
+        self.calm_ticks = calm_ticks
+        self.stats = SamplingStats(interval, slow_interval)
+        self.boosted = True  # Startup is sampled at the fast rate
+        self.__calm = 0  # Ticks in a row without anomaly
+        self.__stop_event = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name=f'sampler-{process.pid}', daemon=True)
+
+    @property
+    def ticks(self):
+        return self.stats.ticks
+
+    def start(self):
+        """
+        Start sampling in the background.
+        """
+        self.debug_logger.debug(f'Sampling {", ".join(str(metric) for metric in self.metrics)}'
+                                f' of process {self.process.pid} every {self.interval}s'
+                                f'{"" if self.slow_interval is None else f", {self.slow_interval}s while stable"}')
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stop sampling and wait for the current tick to complete.
+        The sampling statistics are then attached to the metrics.
+        """
+        self.__stop_event.set()
+        if self.__thread.is_alive():
+            self.__thread.join()
+
+        for metric in self.metrics:
+            metric.sampling_stats = self.stats
+
+        self.debug_logger.debug(f'Sampling of process {self.process.pid} stopped: {self.stats}')
+
+    def tick(self):
+        """
+        Take a single sample of every metric, all stamped with the same time.
+        :return: False if the process is gone, True otherwise.
+        """
+        timestamp = time.time()
+        added = self.tree.refresh() if self.tree is not None else []
+
+        anomaly = bool(added)
+        for metric in self.metrics:
+            if metric.sampling_error is not None:
+                continue
+            try:
+                metric.sample(timestamp)
+            except (psutil.NoSuchProcess, ProcessLookupError):
+                return False
+            except psutil.AccessDenied as e:
+                # Challenge: access denied here if not using root
+                self.debug_logger.debug(f'Could not sample {metric}: {e}')
+                continue
+            except Exception as e:
+                # Not the process being gone: the metric is no longer sampled, and its log tells why
+                self.debug_logger.debug(f'Sampling {metric} failed, stopping it: {e!r}', exc_info=True)
+                metric.sampling_error = f'{type(e).__name__}: {e}'
+                continue
+            if self.slow_interval is not None:
+                anomaly = metric.anomaly() or anomaly
+
+        if self.slow_interval is not None:
+            self.__adapt(anomaly)
+        return True
+
+    def __adapt(self, anomaly: bool):
+        """
+        Switch between the fast and slow intervals, on an anomaly and after enough calm ticks.
+        """
+        if anomaly:
+            self.__calm = 0
+            if not self.boosted:
+                self.boosted = True
+                self.stats.boosts += 1
+            return
+
+        self.__calm += 1
+        if self.boosted and self.__calm >= self.calm_ticks:
+            self.boosted = False
+
+    def __is_alive(self):
+        """
+        :return: True if the process is running and is not a zombie.
+        """
+        try:
+            reader = self.tree.reader(self.process) if self.tree is not None else None
+            if reader is not None:
+                return not reader.is_zombie()
+            return self.process.is_running() and self.process.status() != psutil.STATUS_ZOMBIE
+        except psutil.NoSuchProcess:
+            return False
+
+    def __run(self):
+        self.stats.started = next_tick = time.monotonic()
+
+        try:
+            while not self.__stop_event.is_set() and self.__is_alive():
+                lateness = time.monotonic() - next_tick
+                boosted = self.boosted
+                if not self.tick():
+                    break
+                self.stats.add_tick(lateness, boosted)
+
+                # Schedule relative to the start rather than to the previous tick, skipping overrun ticks
+                if self.boosted and not boosted:
+                    next_tick = time.monotonic()  # Boosted by an anomaly, the fast schedule starts now
+                interval = self.interval if self.boosted or self.slow_interval is None else self.slow_interval
+                next_tick += interval
+                now = time.monotonic()
+                if next_tick < now:
+                    missed = math.ceil((now - next_tick) / interval)
+                    self.stats.missed += missed
+                    next_tick += missed * interval
+
+                if self.__stop_event.wait(next_tick - now):
+                    break
+        finally:
+            self.stats.stopped = time.monotonic()
@@ -0,0 +1,118 @@
+from typing import Dict, Iterable, Tuple
+import socket
+import struct
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLMSG_ERROR = 0x2
+INET_DIAG_INFO = 2
+INET_DIAG_NOCOOKIE = 0xffffffff
+ALL_STATES = 0xffffffff
+
+NLMSG_HEADER = struct.Struct('=IHHII')  # Length, type, flags, sequence number, port id
+REQUEST = struct.Struct('=BBBxI')  # Family, protocol, extensions, states of inet_diag_req_v2
+SOCKET_ID = struct.Struct('>HH16s16s')  # Source and destination ports and addresses, in network byte order
+SOCKET_ID_TAIL = struct.Struct('=III')  # Interface and cookie
+RTA_HEADER = struct.Struct('=HH')  # Length, type
+DIAG_MESSAGE_SIZE = 72  # inet_diag_msg, ending with the inode
+INODE = struct.Struct('=I')
+INODE_OFFSET = 68
+
+# Offsets of tcpi_bytes_acked and tcpi_bytes_received (Linux 4.1), then tcpi_segs_out and tcpi_segs_in (4.2)
+TCP_INFO_BYTES = struct.Struct('=QQ')
+TCP_INFO_BYTES_OFFSET = 120
+TCP_INFO_SEGMENTS = struct.Struct('=II')
+TCP_INFO_SEGMENTS_OFFSET = 136
+
+BATCH = 64  # Sockets looked up per request, so the replies fit in the receive buffer
+RECEIVE_BUFFER_SIZE = 1 << 16
+
+
+class SockDiag:
+    """
+    Reader of the counters of TCP sockets through the sock_diag netlink
+    interface (Linux only), in the network namespace of the runner.
+    Sockets are looked up one by one by their addresses, in batches of
+    requests sent at once, rather than by dumping every socket of the
+    namespace, so the cost follows the number of sockets asked for, not
+    the host connection count.
+    """
+
+    def __init__(self):
+        """
+        :raise OSError: if sock_diag is not available.
+        """
+        self.__socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG)
+        self.__sequence = 0
+
+    @staticmethod
+    def socket_id(family: int, source: Tuple[bytes, int], destination: Tuple[bytes, int]) -> bytes:
+        """
+        :param family: AF_INET or AF_INET6.
+        :param source: tuple of the packed local address and port.
+        :param destination: tuple of the packed remote address and port.
+        :return: inet_diag_sockid of the socket, to look it up with.
+        """
+        return SOCKET_ID.pack(source[1], destination[1], source[0], destination[0]) + \
+            SOCKET_ID_TAIL.pack(0, INET_DIAG_NOCOOKIE, INET_DIAG_NOCOOKIE)
+
+    def tcp_counters(self, sockets: Iterable[Tuple[int, int, bytes]]) -> Dict[int, Tuple[int, int, int, int]]:
+        """
+        Look TCP sockets up.
+        :param sockets: tuples of inode, family and id (see socket_id) of the sockets.
+        :return: dict of inode to tuple of bytes received, segments in, bytes acknowledged and segments out,
+                 of the sockets found (closed ones are not), 0 for counters the kernel does not report.
+        """
+        counters = {}
+        sockets = list(sockets)
+        for start in range(0, len(sockets), BATCH):
+            self.__query(sockets[start:start + BATCH], counters)
+        return counters
+
+    def close(self):
+        self.__socket.close()
+
+    def __query(self, sockets, counters):
+        inodes = {}  # Sequence number to inode of the requests to be replied to
+        requests = []
+        for inode, family, socket_id in sockets:
+            self.__sequence = (self.__sequence + 1) & 0xffffffff
+            inodes[self.__sequence] = inode
+            body = REQUEST.pack(family, socket.IPPROTO_TCP, 1 << (INET_DIAG_INFO - 1), ALL_STATES) + socket_id
+            requests.append(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(body), SOCK_DIAG_BY_FAMILY, NLM_F_REQUEST,
+                                              self.__sequence, 0) + body)
+        self.__socket.send(b''.join(requests))
+
+        # Every request is replied to, with the socket or with an error if it is gone
+        while inodes:
+            data = self.__socket.recv(RECEIVE_BUFFER_SIZE)
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(data):
+                length, kind, _, sequence, _ = NLMSG_HEADER.unpack_from(data, offset)
+                if length < NLMSG_HEADER.size:
+                    break
+                inode = inodes.pop(sequence, None)
+                if inode is not None and kind == SOCK_DIAG_BY_FAMILY:
+                    message = data[offset + NLMSG_HEADER.size:offset + length]
+                    if INODE.unpack_from(message, INODE_OFFSET)[0] == inode:
+                        counters[inode] = self.__parse_counters(message)
+                offset += (length + 3) & ~3
+
+    @staticmethod
+    def __parse_counters(message: bytes):
+        offset = DIAG_MESSAGE_SIZE
+        while offset + RTA_HEADER.size <= len(message):
+            length, kind = RTA_HEADER.unpack_from(message, offset)
+            if length < RTA_HEADER.size:
+                break
+            if kind == INET_DIAG_INFO:
+                info = message[offset + RTA_HEADER.size:offset + length]
+                acked = received = segments_out = segments_in = 0
+                if len(info) >= TCP_INFO_BYTES_OFFSET + TCP_INFO_BYTES.size:
+                    acked, received = TCP_INFO_BYTES.unpack_from(info, TCP_INFO_BYTES_OFFSET)
+                if len(info) >= TCP_INFO_SEGMENTS_OFFSET + TCP_INFO_SEGMENTS.size:
+                    segments_out, segments_in = TCP_INFO_SEGMENTS.unpack_from(info, TCP_INFO_SEGMENTS_OFFSET)
+                return received, segments_in, acked, segments_out
+            offset += (length + 3) & ~3
+        return 0, 0, 0, 0
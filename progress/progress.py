@@ -0,0 +1,133 @@
+from summary.iteration_result import IterationResult
+from collections import deque
+from typing import Optional, TextIO
+import threading
+import logging
+import time
+import sys
+
+DEFAULT_REFRESH_INTERVAL = 0.5  # Seconds
+ROLLING_WINDOW = 100  # Latest iterations the rolling figures are computed over
+CLEAR_LINE = '\r\x1b[K'
+
+
+class Progress:
+    """
+    Live status line of a session: iterations completed and failed,
+    throughput, ETA, and rolling latency and peak RSS of the latest iterations.
+    Results are only appended to bounded windows as iterations complete,
+    and a background thread renders the line at a fixed rate, so neither
+    the runner loop nor the iterations ever wait for the terminal.
+    On a terminal the line is redrawn in place, otherwise a line is
+    printed per refresh.
+    """
+
+    def __init__(self,
+                 count: int,
+                 debug_logger: logging.Logger,
+                 interval: float = DEFAULT_REFRESH_INTERVAL,
+                 stream: TextIO = None):
+        """
+        :param count: number of iterations of the session.
+        :param debug_logger: for print debugging.
+        :param interval: interval between refreshes, in seconds.
+        :param stream: stream to render to, stderr if not given.
+        """
+        self.count = count
+        self.debug_logger = debug_logger
+        self.interval = interval
+        self.stream = stream if stream is not None else sys.stderr
+        self.completed = 0
+        self.failed = 0
+        self.__started: Optional[float] = None
+        self.__completion_times = deque(maxlen=ROLLING_WINDOW)
+        self.__latencies = deque(maxlen=ROLLING_WINDOW)
+        self.__peak_rss = deque(maxlen=ROLLING_WINDOW)
+        self.__in_place = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.__stop_event = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='progress', daemon=True)
+
+    def start(self):
+        """
+        Start rendering in the background.
+        """
+        self.debug_logger.debug(f'Rendering progress every {self.interval}s')
+        self.__started = time.monotonic()
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stop rendering, leaving the final status line.
+        Safe to call more than once, e.g. from a signal handler.
+        """
+        if self.__stop_event.is_set():
+            return
+        self.__stop_event.set()
+        if self.__thread.is_alive() and self.__thread is not threading.current_thread():
+            self.__thread.join()
+        self.__render(final=True)
+
+    def add_result(self, result: IterationResult):
+        """
+        Account for a completed iteration.
+        :param result: result of the iteration.
+        """
+        self.__completion_times.append(time.monotonic())
+        self.__latencies.append(result.wall_time)
+        if result.max_rss is not None:
+            self.__peak_rss.append(result.max_rss)
+        if result.failed:
+            self.failed += 1
+        self.completed += 1
+
+    def status(self):
+        """
+        :return: the status line.
+        """
+        completed = self.completed
+        line = f'{completed}/{self.count} iterations, {self.failed} failed'
+
+        rate = self.__rate()
+        if rate > 0:
+            line += f'; {rate:.1f} it/s; ETA {self.__format_duration((self.count - completed) / rate)}'
+
+        # Copied at once, as iterations keep completing while rendering
+        latencies, peak_rss = list(self.__latencies), list(self.__peak_rss)
+        if latencies:
+            line += (f'; Last {len(latencies)}: latency mean {sum(latencies) / len(latencies) * 1000:.1f}ms,'
+                     f' max {max(latencies) * 1000:.1f}ms')
+        if peak_rss:
+            line += f'; peak RSS {max(peak_rss) / 2 ** 20:.1f}MiB'
+        return line
+
+    def __rate(self):
+        """
+        :return: iterations per second, since the start or over the rolling window once it is full.
+        """
+        now = time.monotonic()
+        times = list(self.__completion_times)
+        if len(times) == ROLLING_WINDOW and now > times[0]:
+            return (len(times) - 1) / (now - times[0])
+        if self.__started is not None and now > self.__started:
+            return self.completed / (now - self.__started)
+        return 0.0
+
+    def __run(self):
+        while not self.__stop_event.wait(self.interval):
+            self.__render()
+
+    def __render(self, final: bool = False):
+        try:
+            if self.__in_place:
+                self.stream.write(CLEAR_LINE + self.status() + ('\n' if final else ''))
+            else:
+                self.stream.write(self.status() + '\n')
+            self.stream.flush()
+        except (EnvironmentError, ValueError):
+            pass  # Stream closed, progress is best effort
+
+    @staticmethod
+    def __format_duration(seconds: float):
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f'{hours}:{minutes:02}:{seconds:02}' if hours else f'{minutes}:{seconds:02}'
@@ -1,19 +1,41 @@
 import os
 import sys
+import math
+import time
 import psutil
 import logging
 import signal
+import resource
+import threading
+from typing import Dict, List, Set
 from helper import args_parser
 from summary.summary import Summary
-from subprocess import PIPE
-from loggable.loggable import Loggable, LOGS_DIR, TIMESTAMP
+from summary.iteration_result import IterationResult, EXIT_NOT_EXECUTABLE, EXIT_NOT_FOUND
+from executor.executor import Executor
+from progress.progress import Progress
+from exporter.exporter import Exporter
+from loggable.loggable import TIMESTAMP
+from loggable.log_writer import LogWriter
+from blob_store.blob_store import BlobStore
 from metrics.disk_io import DiskIO
 from metrics.memory import Memory
 from metrics.proc_th_cpu import ProcThCpu
 from metrics.network import Network
+from metrics.sampler import Sampler, DEFAULT_SAMPLE_INTERVAL
+from metrics.process_tree import ProcessTree
+from metrics.sample_store import DEFAULT_CAPACITY
+from metrics.metric import TEXT
 from stream.stream import Stream
+from stream.capture import StreamCapture
+from tracer.strace import Strace, FULL
+from tracer.tcpdump import Tcpdump
+from timeout.timeout import Timeout, kill_tree
+from analysis.failure_diff import FailureDiff, Fingerprint
+from cgroup.cgroup import CgroupTree, CgroupUsage
 
-EXIT_SUCCESS = 0
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024  # Of ru_maxrss, in bytes
+# Whether ru_maxrss of a child covers the memory of the runner it shared until it executed the command
+RSS_INHERITED = sys.platform.startswith('linux')
 
 
 class Runner:
@@ -22,112 +44,362 @@ class Runner:
                  debugger: logging.Logger,
                  sys_trace=False,
                  call_trace=False,
+                 call_trace_mode=FULL,
                  log_trace=False,
-                 net_trace=False):
+                 net_trace=False,
+                 sample_interval=DEFAULT_SAMPLE_INTERVAL,
+                 sample_capacity=DEFAULT_CAPACITY,
+                 downsample=0,
+                 log_format=TEXT,
+                 exporter: Exporter = None,
+                 timeout=None,
+                 log_writer: LogWriter = None,
+                 slow_sample_interval=None,
+                 retain_seconds=None,
+                 failure_diff: FailureDiff = None,
+                 cgroups: CgroupTree = None):
         """
         :param command: command to run.
         :param debugger: loggable object for debugging.
         :param sys_trace: if True, system measurements will be performed and dumped to files if command fails.
         :param call_trace: if True, system calls will be monitored and dumped to file if command fails.
+        :param call_trace_mode: 'full' to log every system call, 'summary' to log per system call statistics.
         :param log_trace: if True, stdout and stderr of the command will be dumped to files if command fails.
         :param net_trace: if True, pcap file with the network traffic during the execution will be created.
-        :return: return code of the command.
+        :param sample_interval: interval between system measurements, in seconds.
+        :param sample_capacity: maximal number of system measurements kept per metric.
+        :param downsample: if positive, number of system measurements aggregated into min/max/mean rows.
+        :param log_format: format of the system measurements logs, 'text' or 'columnar'.
+        :param exporter: if given, exporter of the latest system measurements.
+        :param timeout: if given, time in seconds after which the process group of the command is killed.
+        :param log_writer: if given, log files are written by it in the background, otherwise in the iteration.
+        :param slow_sample_interval: if given, system measurements are taken at this interval while stable,
+                                     and at sample_interval on anomalies only.
+        :param retain_seconds: if given, only the system measurements of the last retain_seconds are kept.
+        :param failure_diff: if given, failure diff analysis the fingerprint of every iteration is added to.
+        :param cgroups: if given, subtree of the cgroups every iteration is run and accounted in.
         """
         self.command = command
+        # Parsed and copied once, as they are the same in every iteration
+        self.argv = command.split()
+        self.environment = dict(os.environ)
         self.sys_trace = sys_trace
         self.call_trace = call_trace
+        self.call_trace_mode = call_trace_mode
         self.log_trace = log_trace
         self.net_trace = net_trace
+        self.sample_interval = sample_interval
+        if retain_seconds is not None:
+            # Rows covering the retained time at the fastest sampling rate, of a window of samples each if downsampled
+            sample_capacity = min(sample_capacity, math.ceil(retain_seconds / (sample_interval * max(downsample, 1))))
+        self.sample_capacity = sample_capacity
+        self.downsample = downsample
+        self.log_format = log_format
+        self.exporter = exporter
+        self.timeout = timeout
+        self.log_writer = log_writer
+        self.slow_sample_interval = slow_sample_interval
+        self.failure_diff = failure_diff
+        self.cgroups = cgroups
         self.debugger = debugger
+        self.__running: Dict[int, int] = {}  # Iteration to pid of its command, while it can be killed
+        self.__cancelled: Set[int] = set()  # Iterations whose command was killed by cancel()
+        self.__given_up = False
+        self.__lock = threading.Lock()
 
     def run(self, iteration: int):
         """
         Run a given command.
+        A command that cannot be run (e.g. not found) makes a failed iteration, of
+        return code 127 if not found and 126 otherwise, as a shell would return.
         :param iteration: iteration number, if running the command multiple time. This is for debugging and logging.
+        :return: IterationResult object, with the return code and resource usage of the command,
+                 or None if the iteration was cancelled.
         """
-        split_command = self.command.split()
-
-        self.debugger.debug(f'Forking a child process to run the command \"{self.command}\"')
-        process = psutil.Popen(split_command, stdout=PIPE, stderr=PIPE, encoding='ascii')
-
-        # Initialize system metrics objects
-        metrics = [DiskIO(process, self.command, iteration, self.debugger),
-                   Memory(process, self.command, iteration, self.debugger),
-                   ProcThCpu(process, self.command, iteration, self.debugger),
-                   Network(process, self.command, iteration, self.debugger)]
-
-        # Continually perform system measurements
-        for metric in metrics:
-            metric.measure()
-
-        # Create strace file using strace process
-        # Challenge: some calls might get missed out because of race
-        self.debugger.debug('Creating strace file')
-        strace_command = f'strace -f -p {process.pid}'
-        self.debugger.debug(f'Running command {strace_command}')
-        strace = psutil.Popen(strace_command.split(), stdout=PIPE, encoding='ascii')
-
-        # Create pcap file using tcpdump process
-        # Challenge: some traffic might get missed out because of race
-        self.debugger.debug('Creating pcap file')
-        pcap_path = Loggable(self.command, iteration, 'net_trace', self.debugger)._get_log_path('pcap')
-        split_command = f'tcpdump -i any -w {pcap_path}'
-        self.debugger.debug(f'Running command {split_command}')
-        tcpdump = psutil.Popen(split_command.split())
-
-        # Wait for command to finish executing and pick up stdout and stderr
-        self.debugger.debug('Waiting for child process to terminate in order to retrieve the stream outputs')
-        stdout, stderr = process.communicate()
-
-        # Print outputs of the command
-        print(stdout, file=sys.stdout)
-        print(stderr, file=sys.stderr)
-
-        # Get return code
-        return_code = getattr(process, 'returncode')
-        self.debugger.debug(f'Command \"{self.command}\" of iteration {iteration} returned with code: {return_code}')
-
-        # Pass Ctrl+C to strace and tcpdump processes and get output
-        self.debugger.debug('Passing Ctrl+C to strace and tcpdump')
-        strace.send_signal(signal.SIGINT)
-        tcpdump.send_signal(signal.SIGINT)
-
-        # Get strace output
-        strace_out = strace.communicate()
-
-        # If command fails, create log files
-        if return_code != EXIT_SUCCESS:
-
-            if self.sys_trace:
-                for metric in metrics:
-                    metric.dump_to_file()
-
-            if self.call_trace:
-                strace_stream = Stream(strace_out, 'strace', self.command, iteration, self.debugger)
-                strace_stream.dump_to_file()
-
-            if self.log_trace:
-                streams = [Stream(stdout, 'stdout', self.command, iteration, self.debugger),
-                           Stream(stderr, 'stderr', self.command, iteration, self.debugger)]
-                for stream in streams:
-                    stream.dump_to_file()
-
-            if not self.net_trace:  # Workaround to above challenge
-                self.debugger.debug('No net-trace, removing the pcap file')
-                try:
-                    os.remove(pcap_path)
-                except FileNotFoundError:
-                    pass
-
-            # Try to remove the directory if pcap file was the only file and it was removed
+        argv = self.argv
+        # Metrics are only collected when their logs or the exporter need them
+        measured = self.sys_trace or self.exporter is not None
+
+        # Spawn the tracers only when their logs are asked for
+        strace = Strace(self.command, iteration, self.debugger, mode=self.call_trace_mode) \
+            if self.call_trace else None
+        tcpdump = Tcpdump(self.command, iteration, self.debugger) if self.net_trace else None
+
+        captures = []
+        cgroup = None
+        sampler = None
+        tree = None
+        timeout = None
+        released = False  # Whether releasing is left to the log writer
+        try:
+            if tcpdump is not None:
+                # Start capturing before the command, so none of its traffic is missed
+                self.debugger.debug('Creating pcap file')
+                tcpdump.start()
+
+            if strace is not None:
+                # Run the command under strace from the start, so none of its system calls are missed
+                self.debugger.debug('Creating strace file')
+                argv = strace.wrap(argv)
+
+            if self.cgroups is not None:
+                # The command enters its cgroup before it is executed, before strace too, so it is not in the trace
+                cgroup = self.cgroups.create(iteration)
+                argv = cgroup.wrap(argv)
+
+            self.debugger.debug(f'Spawning a child process to run the command \"{self.command}\"')
+            started = time.monotonic()
             try:
-                os.rmdir(LOGS_DIR)
-            except FileNotFoundError as exc:
-                print(exc)
-            except OSError:
+                pid, pipes = self.__spawn(argv)
+            except OSError as e:
+                print(f'Could not run command \"{self.command}\": {e}', file=sys.stderr)
+                result = IterationResult(return_code=EXIT_NOT_FOUND if isinstance(e, FileNotFoundError)
+                                         else EXIT_NOT_EXECUTABLE,
+                                         wall_time=time.monotonic() - started,
+                                         cpu_time=None,
+                                         max_rss=None)
+                if self.failure_diff is not None:
+                    self.failure_diff.add(Fingerprint(result))
+                return result
+            self.__track(iteration, pid)
+            process = psutil.Process(pid)
+            if self.timeout is not None:
+                timeout = Timeout(process.pid, self.timeout, self.debugger)
+                timeout.start()
+
+            # Stream the captured outputs of the command to the terminal as they arrive, keeping them for logs
+            if pipes is not None:
+                captures = [StreamCapture(pipes[0], sys.stdout, 'stdout', self.debugger, capture=True),
+                            StreamCapture(pipes[1], sys.stderr, 'stderr', self.debugger, capture=True)]
+                for capture in captures:
+                    capture.start()
+
+            if strace is not None:
+                # Find strace once attached, which the command waits for, its outputs being drained meanwhile
+                strace.attach(process.pid)
+                if cgroup is not None and strace.tracer is not None:
+                    # strace is forked in the cgroup of the command, moved out so its work is not accounted to it
+                    self.cgroups.supervisor.add(strace.tracer.pid)
+
+            metrics = []
+            if measured:
+                # Initialize system metrics objects, sharing the index of the process tree of the command
+                tree = ProcessTree(process, self.debugger)
+                metrics = [metric_class(process, self.command, iteration, self.debugger,
+                                        capacity=self.sample_capacity, window=self.downsample, tree=tree,
+                                        log_format=self.log_format)
+                           for metric_class in (DiskIO, Memory, ProcThCpu, Network)]
+                if self.exporter is not None:
+                    self.exporter.track(metrics)
+
+                # Continually perform system measurements, all metrics sampled on the same tick
+                sampler = Sampler(process, metrics, self.debugger, self.sample_interval, tree=tree,
+                                  slow_interval=self.slow_sample_interval)
+                sampler.start()
+
+            # Wait for command to finish executing and for its stream outputs to be drained
+            self.debugger.debug('Waiting for child process to terminate')
+            return_code, rusage, io_counters = self.__reap(process, iteration)
+            wall_time = time.monotonic() - started
+            usage = cgroup.usage() if cgroup is not None else CgroupUsage()
+            for capture in captures:
+                capture.join()
+            if timeout is not None:
+                timeout.cancel()
+            if sampler is not None:
+                sampler.stop()
+                tree.close()
+
+            if strace is not None:
+                strace.wait()
+            if tcpdump is not None:
+                tcpdump.stop()
+
+            with self.__lock:
+                cancelled = iteration in self.__cancelled
+            if cancelled:
+                self.debugger.debug(f'Iteration {iteration} of command \"{self.command}\" cancelled')
+                return None
+
+            timed_out = timeout is not None and timeout.expired
+            self.debugger.debug(f'Command \"{self.command}\" of iteration {iteration}'
+                                f'{" timed out and" if timed_out else ""} returned with code: {return_code}')
+            # Totals of the cgroup also cover the descendants the command did not wait for
+            if usage.read_bytes is None and io_counters is not None:
+                usage = usage._replace(read_bytes=io_counters.read_bytes, write_bytes=io_counters.write_bytes)
+            result = IterationResult(return_code=return_code,
+                                     wall_time=wall_time,
+                                     cpu_time=usage.cpu_time if usage.cpu_time is not None
+                                     else rusage.ru_utime + rusage.ru_stime,
+                                     max_rss=self.__max_rss(rusage),
+                                     read_bytes=usage.read_bytes,
+                                     write_bytes=usage.write_bytes,
+                                     timed_out=timed_out,
+                                     memory_peak=usage.memory_peak,
+                                     pids_peak=usage.pids_peak)
+
+            if self.failure_diff is not None:
+                self.failure_diff.add(self.__fingerprint(result, strace, captures))
+
+            # If command fails or times out, create log files, in the background if there is a log writer
+            if result.failed:
+                loggables = []
+                if self.sys_trace:
+                    loggables.extend(metrics)
+                if strace is not None:
+                    loggables.append(strace)
+                if self.log_trace:
+                    loggables.extend(Stream(capture.buffer, capture.stream_name, self.command, iteration, self.debugger)
+                                     for capture in captures)
+                if tcpdump is not None:
+                    loggables.append(tcpdump)
+
+                if self.log_writer is not None:
+                    self.log_writer.submit(loggables, release=lambda: self.__release(strace, tcpdump, captures))
+                    released = True
+                else:
+                    for loggable in loggables:
+                        loggable.dump_to_file()
+
+        finally:
+            with self.__lock:
+                self.__running.pop(iteration, None)
+            if timeout is not None:
+                timeout.cancel()
+            if tcpdump is not None:
+                tcpdump.stop()
+            if cgroup is not None:
+                self.cgroups.release(cgroup)
+            # Release whatever was not dumped, also if the command could not be run
+            if not released:
+                self.__release(strace, tcpdump, captures)
+
+        return result
+
+    def cancel(self):
+        """
+        Give up the session: kill the commands of the iterations running, and those
+        of the iterations starting from now on as soon as spawned. Their iterations
+        return None, without logs. Commands are killed along with their process group
+        if they lead their own (with a timeout), or with their descendants otherwise.
+        """
+        with self.__lock:
+            self.__given_up = True
+            for iteration, pid in self.__running.items():
+                self.__kill(iteration, pid)
+
+    def __track(self, iteration: int, pid: int):
+        """
+        Keep the pid of the command of an iteration until reaped, for cancel() to kill it.
+        """
+        with self.__lock:
+            self.__running[iteration] = pid
+            if self.__given_up:
+                self.__kill(iteration, pid)
+
+    def __kill(self, iteration: int, pid: int):
+        """
+        Kill the command of an iteration. Call with the lock held.
+        """
+        self.__cancelled.add(iteration)
+        self.debugger.debug(f'Killing the command of iteration {iteration}')
+        if self.timeout is not None:
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except ProcessLookupError:
                 pass
+            return
 
-        return return_code
+        kill_tree(pid)
+
+    def __spawn(self, argv: List[str]):
+        """
+        Start the command with posix_spawn rather than fork and exec, so the
+        runner is not copied for every iteration. Its outputs are piped if
+        they are captured, otherwise it writes straight to those of the runner.
+        With a timeout, the command leads its own process group, to be killed along with its descendants.
+        :param argv: command as a list of arguments.
+        :return: tuple of the pid of the command, and of the read ends of its stdout and stderr pipes or None.
+        """
+        options = {'setpgroup': 0} if self.timeout is not None else {}
+        if not self.log_trace:
+            return os.posix_spawnp(argv[0], argv, self.environment, **options), None
+
+        stdout, stderr = os.pipe(), os.pipe()  # Not inherited, only the duplicates are
+        try:
+            pid = os.posix_spawnp(argv[0], argv, self.environment,
+                                  file_actions=[(os.POSIX_SPAWN_DUP2, stdout[1], 1),
+                                                (os.POSIX_SPAWN_DUP2, stderr[1], 2)],
+                                  **options)
+        except BaseException:
+            os.close(stdout[0])
+            os.close(stderr[0])
+            raise
+        finally:
+            os.close(stdout[1])
+            os.close(stderr[1])
+        return pid, (open(stdout[0], 'rb', buffering=0), open(stderr[0], 'rb', buffering=0))
+
+    def __fingerprint(self, result: IterationResult, strace: Strace, captures: List[StreamCapture]):
+        """
+        Build the fingerprint of an iteration, for the failure diff.
+        """
+        syscalls = None
+        if strace is not None:
+            try:
+                syscalls = strace.histogram()
+            except EnvironmentError as e:
+                self.debugger.debug(f'Could not count system calls: {e}')
+        hashes = [capture.digest.hexdigest() for capture in captures] if captures else [None, None]
+        return Fingerprint(result, syscalls, *hashes)
+
+    @staticmethod
+    def __max_rss(rusage):
+        """
+        On Linux, the peak RSS of a child starts from that of the runner, as the
+        child shares its memory until it executes the command. It is then only
+        known to be that of the command if above the peak of the runner so far.
+        :param rusage: resource usage of the command.
+        :return: peak RSS of the command in bytes, or None if not known.
+        """
+        if RSS_INHERITED and rusage.ru_maxrss <= resource.getrusage(resource.RUSAGE_SELF).ru_maxrss:
+            return None
+        return rusage.ru_maxrss * RSS_UNIT
+
+    @staticmethod
+    def __release(strace: Strace, tcpdump: Tcpdump, captures: List[StreamCapture]):
+        """
+        Remove the scratch files of the tracers and the buffers of the captures, once dumped or if not needed.
+        """
+        for tracer in (strace, tcpdump):
+            if tracer is not None:
+                tracer.discard()
+        for capture in captures:
+            capture.close()
+
+    def __reap(self, process: psutil.Process, iteration: int):
+        """
+        Wait for the command to exit and reap it, collecting its resource usage.
+        Its IO counters are read in between, while it is a zombie, since they
+        then include those of the descendants it reaped. It is no longer killed
+        by cancel() from then on, as its pid may be reused once reaped.
+        :param process: process of the command.
+        :param iteration: iteration of the command.
+        :return: tuple of return code, resource usage and IO counters, the latter None if not available.
+        """
+        io_counters = None
+        if hasattr(os, 'waitid'):
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+            try:
+                io_counters = process.io_counters()
+            except (psutil.Error, AttributeError):
+                pass  # Not permitted, or not supported on the platform
+
+        with self.__lock:
+            self.__running.pop(iteration, None)
+        _, status, rusage = os.wait4(process.pid, 0)
+        return_code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        return return_code, rusage, io_counters
 
 
 def __exit_gracefully(signum, frame):
@@ -141,16 +413,37 @@ def __exit_gracefully(signum, frame):
 
     # Restore the original signal handler in case Ctrl+C or 'kill' are passed again before exiting
     signal.signal(signal.SIGINT, original_sigint)
-    signal.signal(signal.SIGINT, original_sigterm)
+    signal.signal(signal.SIGTERM, original_sigterm)
 
     try:
         debug_logger.debug('SIGINT caught.')
+        # The running iterations use the log writer and the cgroups, so they are done with before those are closed
+        if executor is not None:
+            executor.cancel()
+        __close_session()
         summary.summarize_and_exit()
 
     except KeyboardInterrupt:
         sys.exit(1)
 
 
+def __close_session():
+    """
+    Stop the live status and the exporter, wait for the logs to be written,
+    write the failure diff, and remove the cgroups of the session.
+    """
+    if progress is not None:
+        progress.stop()
+    if exporter is not None:
+        exporter.stop()
+    if log_writer is not None:
+        log_writer.close()
+    if failure_diff is not None:
+        failure_diff.dump_to_file()
+    if cgroups is not None:
+        cgroups.close()
+
+
 if __name__ == "__main__":
     # Init debug loggable
     logging.basicConfig()
@@ -158,6 +451,12 @@ if __name__ == "__main__":
 
     # Init the summary object
     summary = Summary(debug_logger)
+    progress = None
+    exporter = None
+    log_writer = None
+    failure_diff = None
+    cgroups = None
+    executor = None
 
     # Redirect signals in order to print summary after Ctrl+C or 'kill'
     original_sigint = signal.getsignal(signal.SIGINT)
@@ -172,37 +471,79 @@ if __name__ == "__main__":
         # Turn debugging on
         debug_logger.setLevel(logging.DEBUG)
 
+    summary.json_path = args.summary_json
+
     debug_logger.debug(f'Timestamp: {TIMESTAMP}')
     debug_logger.debug(f'Command: {args.command}; Count: {args.count}; Failed count: {args.failed_count};'
-                       f' Sys-trace: {args.sys_trace}; Call-trace: {args.call_trace}; Log-trace: {args.log_trace}')
-
-    # Keep track of the failed count
-    current_failed_count = 0
+                       f' Jobs: {args.jobs}; Sys-trace: {args.sys_trace}; Call-trace: {args.call_trace};'
+                       f' Call-trace mode: {args.call_trace_mode};'
+                       f' Log-trace: {args.log_trace}; Net-trace: {args.net_trace};'
+                       f' Sample interval: {args.sample_interval}; Sample capacity: {args.sample_capacity};'
+                       f' Downsample: {args.downsample}; Log format: {args.log_format};'
+                       f' Summary JSON: {args.summary_json}; Progress: {args.progress};'
+                       f' Metrics listen: {args.metrics_listen}; Metrics textfile: {args.metrics_textfile};'
+                       f' Timeout: {args.timeout}; Compress: {args.compress};'
+                       f' Adaptive sampling: {args.adaptive_sampling}; Retain seconds: {args.retain_seconds};'
+                       f' Dedup: {args.dedup}; Cgroup: {args.cgroup}; Max memory: {args.max_memory};'
+                       f' CPUs: {args.cpus}; Failure diff: {args.failure_diff}')
+
+    if args.metrics_listen is not None or args.metrics_textfile is not None:
+        exporter = Exporter(summary, debug_logger, address=args.metrics_listen, textfile=args.metrics_textfile)
+
+    if args.cgroup or args.max_memory is not None or args.cpus is not None:
+        try:
+            cgroups = CgroupTree(debug_logger, max_memory=args.max_memory, cpus=args.cpus)
+        except EnvironmentError as e:
+            if args.max_memory is not None or args.cpus is not None:
+                # Running without the limits asked for would not be what was asked for
+                print(f'Could not set up cgroups to enforce the limits: {e}')
+                sys.exit(1)
+            print(f'cgroup v2 accounting is not available, falling back to psutil: {e}')
+
+    store = BlobStore(debug_logger, compression=args.compress) if args.dedup else None
+    log_writer = LogWriter(debug_logger, compression=args.compress, store=store)
+    if args.failure_diff:
+        failure_diff = FailureDiff(args.command, debug_logger)
+        failure_diff.compression = args.compress
 
     # Create the runner
     r = Runner(args.command,
                debugger=debug_logger,
                sys_trace=args.sys_trace,
                call_trace=args.call_trace,
+               call_trace_mode=args.call_trace_mode,
                log_trace=args.log_trace,
-               net_trace=args.net_trace)
+               net_trace=args.net_trace,
+               sample_interval=args.sample_interval,
+               sample_capacity=args.sample_capacity,
+               downsample=args.downsample,
+               log_format=args.log_format,
+               exporter=exporter,
+               timeout=args.timeout,
+               log_writer=log_writer,
+               slow_sample_interval=args.adaptive_sampling,
+               retain_seconds=args.retain_seconds,
+               failure_diff=failure_diff,
+               cgroups=cgroups)
 
     # Run session
     try:
-        for i in range(args.count):
-            debug_logger.debug(f'Attempt {i + 1} out of {args.count} to run given command')
-
-            current_return_code = r.run(i)
-
-            summary.add_return_code(current_return_code)
-
-            if current_return_code != EXIT_SUCCESS:
-                current_failed_count += 1
-
-            if current_failed_count == args.failed_count:
-                break
-
+        log_writer.start()
+        if exporter is not None:
+            exporter.start()
+        if args.progress:
+            progress = Progress(args.count, debug_logger)
+            progress.start()
+
+        executor = Executor(r, summary, args.count, debug_logger, failed_count=args.failed_count, jobs=args.jobs,
+                            progress=progress, exporter=exporter)
+        executor.run()
+
+        __close_session()
         summary.summarize_and_exit()
 
-    except BaseException as e:
+    except Exception as e:
+        # SystemExit of the summary is let through, so the most frequent return code is the exit code
         print(e)
+        __close_session()
+        sys.exit(1)
@@ -0,0 +1,85 @@
+from stream.spill_buffer import SpillBuffer
+from typing import IO, Optional
+import threading
+import hashlib
+import logging
+import os
+
+CHUNK_SIZE = 1 << 16  # Bytes
+DIGEST_SIZE = 8  # Bytes
+EMPTY_DIGEST = hashlib.blake2b(digest_size=DIGEST_SIZE).hexdigest()
+
+
+class StreamCapture:
+    """
+    Capture an output pipe of the command while it runs.
+    A background thread forwards the bytes to the terminal as they
+    arrive, and tees them into a spill buffer if capturing is on.
+    Draining the pipe continually also keeps the command from blocking
+    on a full pipe.
+    A short hash of the captured output is kept as well, to tell apart
+    iterations by their output without keeping it.
+    """
+
+    def __init__(self, pipe: IO, terminal: IO, stream_name: str, debug_logger: logging.Logger, capture=False):
+        """
+        :param pipe: pipe to read the command output from.
+        :param terminal: text stream to forward the output to.
+        :param stream_name: name of the stream, for debugging.
+        :param debug_logger: for print debugging.
+        :param capture: if True, output is also kept in a spill buffer.
+        """
+        self.pipe = pipe
+        self.terminal = terminal
+        self.stream_name = stream_name
+        self.debug_logger = debug_logger
+        self.buffer: Optional[SpillBuffer] = SpillBuffer() if capture else None
+        self.digest = hashlib.blake2b(digest_size=DIGEST_SIZE) if capture else None
+        self.__thread = threading.Thread(target=self.__run, name=f'capture-{stream_name}', daemon=True)
+
+    def start(self):
+        """
+        Start capturing in the background.
+        """
+        self.__thread.start()
+
+    def join(self):
+        """
+        Wait for the pipe to be closed by the command and drained.
+        """
+        self.__thread.join()
+        if self.buffer is not None:
+            self.debug_logger.debug(f'Captured {self.buffer.size} bytes of {self.stream_name}'
+                                    f'{" (spilled to disk)" if self.buffer.spilled else ""}')
+
+    def close(self):
+        """
+        Release the captured output.
+        """
+        if self.buffer is not None:
+            self.buffer.close()
+
+    def __run(self):
+        fd = self.pipe.fileno()
+        # Bytes are forwarded undecoded, so any encoding passes through
+        terminal = getattr(self.terminal, 'buffer', None)
+
+        try:
+            while True:
+                data = os.read(fd, CHUNK_SIZE)
+                if not data:
+                    break
+
+                if terminal is not None:
+                    self.terminal.flush()
+                    terminal.write(data)
+                    terminal.flush()
+                else:
+                    self.terminal.write(data.decode(errors='replace'))
+                    self.terminal.flush()
+
+                if self.buffer is not None:
+                    self.buffer.write(data)
+                    self.digest.update(data)
+        finally:
+            self.pipe.close()
@@ -0,0 +1,79 @@
+from loggable.loggable import acquire_scratch_file, release_scratch_file
+
+DEFAULT_SPILL_THRESHOLD = 1 << 20  # Bytes
+
+
+class SpillBuffer:
+    """
+    Bytes buffer kept in memory up to a threshold, past which
+    its contents are spilled to a temporary file.
+    The temporary file lives next to the logs, so that it can be
+    promoted to a log file by renaming it rather than rewriting it.
+    """
+
+    def __init__(self, threshold: int = DEFAULT_SPILL_THRESHOLD):
+        """
+        :param threshold: maximal number of bytes kept in memory.
+        """
+        self.threshold = threshold
+        self.size = 0
+        self.path = None  # Path of the temporary file once spilled
+        self.__memory = bytearray()
+        self.__file = None
+
+    @property
+    def spilled(self):
+        return self.path is not None
+
+    def write(self, data: bytes):
+        """
+        Append bytes to the buffer, spilling to a temporary file past the threshold.
+        :param data: bytes to append.
+        """
+        self.size += len(data)
+        if self.__file is None and len(self.__memory) + len(data) <= self.threshold:
+            self.__memory += data
+            return
+
+        if self.__file is None:
+            self.__spill()
+        self.__file.write(data)
+
+    def getvalue(self) -> bytes:
+        """
+        :return: the whole contents of the buffer.
+        """
+        if self.__file is None:
+            return bytes(self.__memory)
+        self.__file.flush()
+        with open(self.path, 'rb') as fd:
+            return fd.read()
+
+    def detach(self) -> str:
+        """
+        Hand the temporary file of a spilled buffer over to the caller, e.g. to promote it to a log file.
+        The buffer is empty afterwards.
+        :return: path of the temporary file.
+        """
+        self.__file.close()
+        self.__file = None
+        path, self.path = self.path, None
+        self.size = 0
+        return path
+
+    def close(self):
+        """
+        Discard the contents of the buffer, releasing the temporary file if any.
+        """
+        self.__memory = bytearray()
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+            release_scratch_file(self.path)
+            self.path = None
+
+    def __spill(self):
+        self.path = acquire_scratch_file('.spill')
+        self.__file = open(self.path, 'wb')
+        self.__file.write(self.__memory)
+        self.__memory = bytearray()
@@ -1,5 +1,6 @@
 from loggable.loggable import Loggable
-from typing import IO
+from stream.spill_buffer import SpillBuffer
+from typing import IO, Union
 import logging
 
 
@@ -10,11 +11,18 @@ class Stream(Loggable):
     """
 
     def __init__(self,
-                 stream: IO,
+                 stream: Union[IO, SpillBuffer],
                  stream_name: str,
                  command: str,
                  iteration: int,
                  debug_logger: logging.Logger):
+        """
+        :param stream: stream contents, either as text or as a spill buffer of captured bytes.
+        :param stream_name: name of the stream.
+        :param command: command ran.
+        :param iteration: iteration number if command is ran multiple times.
+        :param debug_logger: for print debugging.
+        """
         self.stream = stream
         self.stream_name = stream_name
         super().__init__(command, iteration, str(self), debug_logger)
@@ -22,13 +30,22 @@ class Stream(Loggable):
     def dump_to_file(self):
         """
         Dump stream contents to a file.
+        Captured bytes spilled to disk are promoted to the log file.
         """
         self.debug_logger.debug(f'Dumping to file {self.stream_name} of command {self.command}'
                                 f' at iteration {self.iteration}')
 
         try:
             extension = 'trace' if str(self) == 'strace' else 'log'
-            with open(self._get_log_path(extension), 'w') as fd:
+            if isinstance(self.stream, SpillBuffer):
+                if self.stream.spilled:
+                    self._promote(self.stream.detach(), extension)
+                    return
+                with self._open_log(extension, binary=True) as fd:
+                    fd.write(self.stream.getvalue())
+                return
+
+            with self._open_log(extension) as fd:
                 print(self.stream, file=fd)
 
         except EnvironmentError as e:
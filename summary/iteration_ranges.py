@@ -0,0 +1,57 @@
+from typing import List, Tuple
+import bisect
+
+
+class IterationRanges:
+    """
+    Set of iteration numbers, run-length encoded as sorted, disjoint
+    ranges of consecutive numbers, e.g. 0-499, 502.
+    Numbers may be added in any order, as iterations run in parallel
+    complete out of order, and adjacent ranges are merged as they are added.
+    """
+
+    def __init__(self):
+        self.__starts: List[int] = []
+        self.__ends: List[int] = []  # Inclusive
+        self.count = 0
+
+    def add(self, iteration: int):
+        """
+        Add an iteration number to the set.
+        :param iteration: iteration number.
+        """
+        index = bisect.bisect_right(self.__starts, iteration)  # Ranges before index start at or before it
+        if index > 0 and iteration <= self.__ends[index - 1]:
+            return  # Already in
+
+        self.count += 1
+        extends_previous = index > 0 and self.__ends[index - 1] == iteration - 1
+        extends_next = index < len(self.__starts) and self.__starts[index] == iteration + 1
+
+        if extends_previous and extends_next:
+            self.__ends[index - 1] = self.__ends[index]
+            del self.__starts[index]
+            del self.__ends[index]
+        elif extends_previous:
+            self.__ends[index - 1] = iteration
+        elif extends_next:
+            self.__starts[index] = iteration
+        else:
+            self.__starts.insert(index, iteration)
+            self.__ends.insert(index, iteration)
+
+    @property
+    def first(self):
+        return self.__starts[0] if self.__starts else None
+
+    def ranges(self) -> List[Tuple[int, int]]:
+        """
+        :return: list of tuples of the first and last iteration numbers of each range.
+        """
+        return list(zip(self.__starts, self.__ends))
+
+    def __len__(self):
+        return self.count
+
+    def __str__(self):
+        return ', '.join(str(start) if start == end else f'{start}-{end}' for start, end in self.ranges())
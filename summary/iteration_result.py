@@ -0,0 +1,26 @@
+from typing import NamedTuple, Optional
+
+EXIT_SUCCESS = 0
+# Return codes of an iteration whose command could not be run, as of a shell
+EXIT_NOT_EXECUTABLE = 126
+EXIT_NOT_FOUND = 127
+
+
+class IterationResult(NamedTuple):
+    """
+    Outcome and resource usage of an iteration.
+    Usage covers the command and the descendants it waited for.
+    """
+    return_code: int
+    wall_time: float  # Seconds
+    cpu_time: Optional[float]  # Seconds, user and system, None if not available
+    max_rss: Optional[int]  # Bytes, peak resident set size of the largest process, None if not available
+    read_bytes: Optional[int] = None  # Bytes read from storage, None if not available
+    write_bytes: Optional[int] = None  # Bytes written to storage, None if not available
+    timed_out: bool = False  # Whether the command was killed for running past the timeout
+    memory_peak: Optional[int] = None  # Bytes, peak memory of the cgroup of the iteration, None if not available
+    pids_peak: Optional[int] = None  # Peak number of processes in the cgroup of the iteration, None if not available
+
+    @property
+    def failed(self):
+        return self.timed_out or self.return_code != EXIT_SUCCESS
@@ -0,0 +1,138 @@
+from typing import Dict, Sequence
+import bisect
+import math
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+class P2Quantile:
+    """
+    Streaming estimator of a quantile, using the P² algorithm
+    (Jain and Chlamtac, 1985): five markers track the minimum, the
+    quantile, the maximum and two midpoints, and their heights are
+    adjusted on each observation with a piecewise-parabolic prediction.
+    Memory and time per observation are constant, however many
+    observations there are. Up to five observations, the quantile is exact.
+    """
+
+    def __init__(self, p: float):
+        """
+        :param p: quantile to estimate, between 0 and 1.
+        """
+        self.p = p
+        self.count = 0
+        self.__heights = []
+        self.__positions = [1, 2, 3, 4, 5]
+        self.__desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.__increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, value: float):
+        """
+        Account for an observation.
+        :param value: observed value.
+        """
+        self.count += 1
+        heights = self.__heights
+        if self.count <= 5:
+            bisect.insort(heights, value)
+            return
+
+        positions = self.__positions
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = bisect.bisect_right(heights, value) - 1
+
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.__desired[i] += self.__increments[i]
+
+        # Move the middle markers towards their desired positions, by one position at most
+        for i in range(1, 4):
+            offset = self.__desired[i] - positions[i]
+            if (offset >= 1 and positions[i + 1] - positions[i] > 1) or \
+                    (offset <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1 if offset > 0 else -1
+                height = self.__parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self.__linear(i, step)
+                heights[i] = height
+                positions[i] += step
+
+    def value(self):
+        """
+        :return: estimate of the quantile, or NaN if nothing was observed.
+        """
+        if self.count == 0:
+            return float('nan')
+        if self.count <= 5:
+            return self.__heights[max(0, math.ceil(self.p * self.count) - 1)]
+        return self.__heights[2]
+
+    def __parabolic(self, i: int, step: int):
+        q, n = self.__heights, self.__positions
+        return q[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def __linear(self, i: int, step: int):
+        q, n = self.__heights, self.__positions
+        return q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+
+
+class RunningStats:
+    """
+    Streaming statistics of a series of values: count, mean and standard
+    deviation (Welford's online algorithm), min, max and quantile estimates.
+    Nothing is kept per value.
+    """
+
+    def __init__(self, quantiles: Sequence[float] = DEFAULT_QUANTILES):
+        """
+        :param quantiles: quantiles to estimate, between 0 and 1.
+        """
+        self.count = 0
+        self.mean = 0.0
+        self.min = float('nan')
+        self.max = float('nan')
+        self.quantiles = [P2Quantile(p) for p in quantiles]
+        self.__m2 = 0.0
+
+    def add(self, value: float):
+        """
+        Account for a value.
+        :param value: value of the series.
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.__m2 += delta * (value - self.mean)
+        self.min = value if self.count == 1 else min(self.min, value)
+        self.max = value if self.count == 1 else max(self.max, value)
+        for quantile in self.quantiles:
+            quantile.add(value)
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.__m2 / self.count) if self.count > 0 else 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        """
+        :return: dict of the statistics, quantiles named as e.g. 'p90'.
+        """
+        stats = {'count': self.count, 'mean': self.mean, 'stddev': self.stddev, 'min': self.min}
+        lower = self.min
+        for quantile in sorted(self.quantiles, key=lambda q: q.p):
+            # Estimates of close quantiles may cross over few observations, keep them ordered
+            lower = min(max(quantile.value(), lower), self.max)
+            stats[f'p{quantile.p * 100:g}'] = lower
+        stats['max'] = self.max
+        return stats
+
+    def __str__(self):
+        return '; '.join(f'{name} {value:.6g}' for name, value in self.as_dict().items() if name != 'count')
@@ -1,48 +1,107 @@
+from summary.iteration_result import IterationResult
+from summary.iteration_ranges import IterationRanges
+from summary.statistics import RunningStats
+from typing import Dict, Union
 import logging
+import json
 import sys
 
+TIMEOUT = 'timeout'  # Outcome of the iterations killed for running past the timeout
+EXIT_TIMEOUT = 124  # Exit code if timeouts are the most frequent outcome, as of timeout(1)
+
+# Resource usage fields of the iteration results, and their descriptions
+RESOURCE_FIELDS = {'wall_time': 'Wall time (s)',
+                   'cpu_time': 'CPU time (s)',
+                   'max_rss': 'Peak RSS (bytes)',
+                   'read_bytes': 'Read (bytes)',
+                   'write_bytes': 'Written (bytes)',
+                   'memory_peak': 'Cgroup memory peak (bytes)',
+                   'pids_peak': 'Cgroup processes peak'}
+
 
 class Summary:
     """
     Class holding functionality of summary of the
     runner session.
-    Return codes of each command are aggregated.
-    A summary of frequencies and iterations
-    can be printed and most frequent return code returned.
+    Return codes of each command are aggregated as they are added,
+    into counters and run-length encoded ranges of iterations, so a
+    summary of frequencies and iterations can be printed at any time
+    (e.g. from a signal handler), any number of times, in no time,
+    and most frequent return code returned.
+    Resource usage of the iterations is aggregated into streaming
+    statistics (mean, stddev, quantiles), so memory stays constant
+    however many iterations are run.
     """
 
-    def __init__(self, debug_logger: logging.Logger):
-        self.return_codes = []
-        self.return_codes_frequencies = {}
-        self.return_codes_iterations = {int: []}  # Dict of lists of iterations
+    def __init__(self, debug_logger: logging.Logger, json_path: str = None):
+        """
+        :param debug_logger: for print debugging.
+        :param json_path: if given, path of a file to write the summary to as JSON as well.
+        """
+        self.count = 0  # Return codes added
+        self.return_codes_frequencies: Dict[Union[int, str], int] = {}
+        self.return_codes_iterations: Dict[Union[int, str], IterationRanges] = {}
+        self.resource_usage = {field: RunningStats() for field in RESOURCE_FIELDS}
+        self.json_path = json_path
         self.debug_logger = debug_logger
 
-    def add_return_code(self, return_code: int):
+    def add_return_code(self, return_code: Union[int, str], iteration: int = None):
         """
         Include a return code to the summary.
-        :param return_code: return code to be added
+        :param return_code: return code to be added, or 'timeout'
+        :param iteration: iteration the return code belongs to, the next one in order if not given
+        """
+        if iteration is None:
+            iteration = self.count
+        self.count += 1
+
+        iterations = self.return_codes_iterations.get(return_code)
+        if iterations is None:
+            iterations = self.return_codes_iterations[return_code] = IterationRanges()
+        iterations.add(iteration)
+        self.return_codes_frequencies[return_code] = self.return_codes_frequencies.get(return_code, 0) + 1
+
+    def add_result(self, result: IterationResult, iteration: int = None):
+        """
+        Include the return code and resource usage of an iteration to the summary.
+        :param result: result of the iteration.
+        :param iteration: iteration the result belongs to, the next one in order if not given.
         """
-        self.return_codes.append(return_code)
+        self.add_return_code(TIMEOUT if result.timed_out else result.return_code, iteration)
+        for field, stats in self.resource_usage.items():
+            value = getattr(result, field)
+            if value is not None:
+                stats.add(value)
 
     def print_summary(self):
         """
         Summarize current state of return codes and print the summary.
         """
-        self.__make_analysis()
         self.debug_logger.debug('Printing summary of return codes')
         print('Summary:')
-        for key in self.return_codes_frequencies:
+        for key in self.__return_codes():
             print(f'Return code: {key};'
                   f' Frequency: {self.return_codes_frequencies[key]};'
                   f' Iterations: {self.return_codes_iterations[key]}')
 
+        if any(stats.count for stats in self.resource_usage.values()):
+            print('Resource usage per iteration:')
+            for field, stats in self.resource_usage.items():
+                if stats.count:
+                    print(f'{RESOURCE_FIELDS[field]}: {stats}')
+
+        if self.json_path is not None:
+            self.__dump_json()
+
     def get_most_frequent(self):
         """
         Get the most frequent return code.
-        :return: most frequent return code, or 1 if no return code was added.
+        :return: most frequent return code, 124 if it is timeouts, or 1 if no return code was added.
         """
-        return max(self.return_codes_frequencies, key=self.return_codes_frequencies.get) \
-            if self.return_codes_frequencies else 1
+        if not self.return_codes_frequencies:
+            return 1
+        most_frequent = max(self.return_codes_frequencies, key=self.return_codes_frequencies.get)
+        return EXIT_TIMEOUT if most_frequent == TIMEOUT else most_frequent
 
     def summarize_and_exit(self):
         """
@@ -51,22 +110,27 @@ class Summary:
         self.print_summary()
         sys.exit(self.get_most_frequent())
 
-    def __make_analysis(self):
-        self.debug_logger.debug('Analyzing frequency of return codes')
-
-        for index in range(len(self.return_codes)):
-            current_return_code = self.return_codes[index]
-            self.__aggregate_frequency(current_return_code)
-            self.__add_iteration(current_return_code, index)
-
-    def __aggregate_frequency(self, return_code):
-        if return_code in self.return_codes_frequencies:
-            self.return_codes_frequencies[return_code] += 1
-        else:
-            self.return_codes_frequencies[return_code] = 1
-
-    def __add_iteration(self, return_code, index):
-        if return_code in self.return_codes_iterations:
-            self.return_codes_iterations[return_code].append(index)
-        else:
-            self.return_codes_iterations[return_code] = [index]
+    def as_dict(self):
+        """
+        :return: the summary as a JSON serializable dict.
+        """
+        return {'return_codes': [{'return_code': key,
+                                  'frequency': self.return_codes_frequencies[key],
+                                  'iterations': self.return_codes_iterations[key].ranges()}
+                                 for key in self.__return_codes()],
+                'resource_usage': {field: stats.as_dict() for field, stats in self.resource_usage.items()
+                                   if stats.count}}
+
+    def __dump_json(self):
+        self.debug_logger.debug(f'Writing summary to {self.json_path}')
+        try:
+            with open(self.json_path, 'w') as fd:
+                json.dump(self.as_dict(), fd, indent=2)
+        except EnvironmentError as e:
+            print(e)
+
+    def __return_codes(self):
+        """
+        :return: the return codes, ordered by the first iteration they were returned at.
+        """
+        return sorted(self.return_codes_frequencies, key=lambda key: self.return_codes_iterations[key].first)
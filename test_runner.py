@@ -1,11 +1,32 @@
 import os
 import re
+import json
+import gzip
+import time
+import socket
+import signal
+import urllib.request
 import pytest
 import psutil
-import shutil
+import asyncio
+import logging
+import io
 from subprocess import PIPE
+from columnar.columnar import ColumnarLog
+from async_runner.async_runner import run_many
+from summary.summary import Summary
+from blob_store.blob_store import restore
+from cgroup.cgroup import own_cgroup
+from metrics.sock_diag import SockDiag
+from metrics.proc_reader import ProcReader
+from metrics.sampler import Sampler
+from metrics.memory import Memory
+from metrics.disk_io import DiskIO
+from metrics.sample_store import SampleStore
+from metrics.process_tree import ProcessTree
+from stream.spill_buffer import SpillBuffer
 
-LOGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runner.py')
 
 
 @pytest.mark.parametrize(
@@ -14,8 +35,9 @@ LOGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
         (f'dirname {__file__}', '1', os.path.abspath(os.path.curdir)),
         ('echo OK', '5', 'OK'),
     ])
-def test_should_run_cmd_n_times_successfully_and_collect_its_output(command: str, count: str, expectation: str):
-    p = psutil.Popen(['python', 'runner.py', command, '-c', count], stdout=PIPE, stderr=PIPE, encoding='ascii')
+def test_should_run_cmd_n_times_successfully_and_collect_its_output(command: str, count: str, expectation: str,
+                                                                    tmp_path):
+    p = psutil.Popen(['python', RUNNER, command, '-c', count], cwd=tmp_path, stdout=PIPE, stderr=PIPE, encoding='ascii')
     stdout, stderr = p.communicate()
     out = str(stdout)
     err = str(stderr)
@@ -23,18 +45,154 @@ def test_should_run_cmd_n_times_successfully_and_collect_its_output(command: str
 
 
 @pytest.mark.parametrize(
-    "command, count, fails",
+    "command, count, fails, return_code",
     [
-        ('false', '5', '3'),
-        ('ls zzz', '5', '3'),
+        ('false', '5', '3', 1),
+        ('ls zzz', '5', '3', 2),
     ])
-def test_should_fail_n_times_out_of_m_and_exit(command: str, count: str, fails: str):
-    p = psutil.Popen(['python', 'runner.py', command, '-c', count, '-fc', fails], stdout=PIPE, stderr=PIPE,
+def test_should_fail_n_times_out_of_m_and_exit(command: str, count: str, fails: str, return_code: int, tmp_path):
+    p = psutil.Popen(['python', RUNNER, command, '-c', count, '-fc', fails], cwd=tmp_path, stdout=PIPE, stderr=PIPE,
                      encoding='ascii')
     stdout, stderr = p.communicate()
     out = str(stdout)
     summary = re.search(rf'Return code: (.*); Frequency: (.*);', out).groups()
     assert summary[1] == fails
+    assert p.returncode == return_code
+
+
+@pytest.mark.parametrize(
+    "command, count, jobs, expectation",
+    [
+        ('echo OK', '8', '4', '0-7'),
+        ('false', '8', '3', '0-7'),
+    ])
+def test_should_run_iterations_in_parallel_and_keep_their_indices(command: str, count: str, jobs: str,
+                                                                  expectation: str, tmp_path):
+    p = psutil.Popen(['python', RUNNER, command, '-c', count, '-j', jobs], cwd=tmp_path, stdout=PIPE, stderr=PIPE,
+                     encoding='ascii')
+    stdout, stderr = p.communicate()
+    iterations = re.search(r'Iterations: (.*)$', str(stdout), re.MULTILINE).group(1)
+    assert iterations == expectation
+
+
+def test_should_stop_starting_parallel_iterations_once_failed_count_is_reached(tmp_path):
+    p = psutil.Popen(['python', RUNNER, 'false', '-c', '100', '-fc', '3', '-j', '2'], cwd=tmp_path, stdout=PIPE,
+                     stderr=PIPE, encoding='ascii')
+    stdout, stderr = p.communicate()
+    frequency = int(re.search(r'Frequency: (\d+);', str(stdout)).group(1))
+    assert 3 <= frequency <= 4
+
+
+def test_should_cancel_running_iterations_once_failed_count_is_reached(tmp_path):
+    script = tmp_path / 'first_fails.sh'
+    script.write_text(f'#!/bin/sh\nif mkdir {tmp_path}/lock 2>/dev/null; then exit 1; fi\nsleep 30\n')
+    script.chmod(0o755)
+    started = time.monotonic()
+    p = psutil.Popen(['python', RUNNER, str(script), '-c', '10', '-fc', '1', '-j', '3', '-lt'], cwd=tmp_path,
+                     stdout=PIPE, stderr=PIPE, encoding='ascii')
+    stdout, stderr = p.communicate()
+    assert time.monotonic() - started < 10
+    assert re.search(r'Return code: 1; Frequency: 1;', stdout)
+    assert 'Return code: -9' not in stdout
+
+
+def test_should_count_commands_that_cannot_run_as_failed(tmp_path):
+    p = psutil.Popen(['python', RUNNER, 'no_such_command_zzz', '-c', '2'], cwd=tmp_path, stdout=PIPE, stderr=PIPE,
+                     encoding='ascii')
+    stdout, stderr = p.communicate()
+    assert p.returncode == 127
+    assert 'Return code: 127; Frequency: 2; Iterations: 0-1' in stdout
+    assert 'no_such_command_zzz' in stderr
+
+
+def test_should_kill_iterations_past_the_timeout(tmp_path):
+    started = time.monotonic()
+    p = psutil.Popen(['python', RUNNER, 'sleep 30', '-c', '2', '-t', '0.2'], cwd=tmp_path, stdout=PIPE, stderr=PIPE,
+                     encoding='ascii')
+    stdout, stderr = p.communicate()
+    assert time.monotonic() - started < 10
+    assert re.search(r'Return code: timeout; Frequency: 2; Iterations: 0-1', str(stdout))
+    assert p.returncode == 124
+
+
+def test_should_cancel_running_iterations_before_closing_the_session_on_sigint(tmp_path):
+    p = psutil.Popen(['python', RUNNER, 'sleep 30', '-c', '4', '-j', '2', '-t', '60', '-d'], cwd=tmp_path,
+                     stdout=PIPE, stderr=PIPE, encoding='ascii')
+    deadline = time.monotonic() + 10
+    while len([child for child in p.children() if child.name() == 'sleep']) < 2:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    sleeps = p.children()
+    p.send_signal(signal.SIGINT)
+    stdout, stderr = p.communicate(timeout=10)
+
+    # Both iterations are done with before the log writer is closed
+    cancelled = [match.end() for match in re.finditer(r'Iteration \d of command "sleep 30" cancelled', stderr)]
+    assert len(cancelled) == 2 and max(cancelled) < stderr.index('iterations logs to be written')
+    assert not any(sleep.is_running() for sleep in sleeps)
+
+
+def test_should_report_progress_on_stderr(tmp_path):
+    p = psutil.Popen(['python', RUNNER, 'false', '-c', '4', '-p'], cwd=tmp_path, stdout=PIPE, stderr=PIPE,
+                     encoding='ascii')
+    stdout, stderr = p.communicate()
+    assert str(stderr).strip().splitlines()[-1].startswith('4/4 iterations, 4 failed')
+
+
+def test_should_serve_prometheus_metrics_while_running(tmp_path):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    p = psutil.Popen(['python', RUNNER, 'sleep 0.2', '-c', '10', '-ml', str(port)], cwd=tmp_path, stdout=PIPE,
+                     stderr=PIPE)
+    try:
+        body = ''
+        deadline = time.monotonic() + 10
+        while 'runner_memory_bytes' not in body or 'runner_iterations_total{' not in body:
+            assert time.monotonic() < deadline and p.poll() is None
+            time.sleep(0.1)
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=1) as response:
+                    body = response.read().decode()
+            except OSError:
+                continue
+        assert re.search(r'^runner_iteration_duration_seconds_count [1-9]', body, re.MULTILINE)
+    finally:
+        p.terminate()
+        p.communicate()
+
+
+def test_should_summarize_resource_usage_of_iterations(tmp_path):
+    json_path = str(tmp_path / 'summary.json')
+    p = psutil.Popen(['python', RUNNER, 'echo OK', '-c', '5', '-sj', json_path], cwd=tmp_path, stdout=PIPE, stderr=PIPE,
+                     encoding='ascii')
+    stdout, stderr = p.communicate()
+    assert 'Wall time (s): mean' in str(stdout)
+
+    with open(json_path) as fd:
+        summary = json.load(fd)
+    assert summary['return_codes'] == [{'return_code': 0, 'frequency': 5, 'iterations': [[0, 4]]}]
+    wall_time = summary['resource_usage']['wall_time']
+    assert wall_time['count'] == 5 and 0 < wall_time['min'] <= wall_time['p50'] <= wall_time['p99'] <= wall_time['max']
+
+
+def test_should_summarize_any_number_of_times_without_counting_twice(capsys):
+    summary = Summary(logging.getLogger('test'))
+    for iteration in reversed(range(500)):  # Out of order, as with parallel iterations
+        summary.add_return_code(0, iteration)
+    summary.add_return_code(1, 502)
+    summary.add_return_code(0, 501)
+
+    for _ in range(2):
+        summary.print_summary()
+    assert capsys.readouterr().out.split('Summary:\n')[1:] == [
+        'Return code: 0; Frequency: 501; Iterations: 0-499, 501\n'
+        'Return code: 1; Frequency: 1; Iterations: 502\n'] * 2
+    assert summary.as_dict()['return_codes'] == [
+        {'return_code': 0, 'frequency': 501, 'iterations': [(0, 499), (501, 501)]},
+        {'return_code': 1, 'frequency': 1, 'iterations': [(502, 502)]}]
+    assert summary.get_most_frequent() == 0
 
 
 @pytest.mark.parametrize(
@@ -42,13 +200,415 @@ def test_should_fail_n_times_out_of_m_and_exit(command: str, count: str, fails:
     [
         ('false', 7),
     ])
-def test_should_dump_log_files(command: str, expectation: int):
-    shutil.rmtree(LOGS_DIR)
-    p = psutil.Popen(['python', 'runner.py', command, '-lt', '-ct', '-st'])
+def test_should_dump_log_files(command: str, expectation: int, tmp_path):
+    p = psutil.Popen(['python', RUNNER, command, '-lt', '-ct', '-st'], cwd=tmp_path)
     p.wait()
 
     num_of_files = 0
-    for path, subdir, files in os.walk(LOGS_DIR):
+    for path, subdir, files in os.walk(tmp_path / 'logs'):
         print(files)
         num_of_files += len(files)
     assert num_of_files == expectation
+
+
+def test_should_dump_columnar_log_files(tmp_path):
+    p = psutil.Popen(['python', RUNNER, 'false', '-st', '-lf', 'columnar'], cwd=tmp_path)
+    p.wait()
+
+    paths = [os.path.join(path, name) for path, subdir, files in os.walk(tmp_path / 'logs') for name in files]
+    assert sorted(os.path.basename(path) for path in paths) == ['false_0_disk_io.col', 'false_0_memory.col',
+                                                                'false_0_network.col', 'false_0_proc_th_cpu.col']
+    for path in paths:
+        with ColumnarLog(path) as log:
+            assert log.metadata['iteration'] == 0
+            for table in log.tables:
+                assert all(len(log.column(table, name)) == log.rows(table) for name in log.columns(table))
+
+
+def test_should_compress_log_files(tmp_path):
+    p = psutil.Popen(['python', RUNNER, 'ls zzz', '-lt', '-z', 'gzip'], cwd=tmp_path, stdout=PIPE, stderr=PIPE)
+    p.communicate()
+
+    paths = [os.path.join(path, name) for path, subdir, files in os.walk(tmp_path / 'logs') for name in files]
+    assert sorted(os.path.basename(path) for path in paths) == ['ls_0_stderr.log.gz', 'ls_0_stdout.log.gz']
+    with gzip.open([path for path in paths if path.endswith('stderr.log.gz')][0]) as fd:
+        assert b'zzz' in fd.read()
+
+
+def test_should_sample_adaptively(tmp_path):
+    script = tmp_path / 'grow.py'
+    script.write_text('import sys, time\ntime.sleep(0.6)\ndata = b"x" * (50 << 20)\ntime.sleep(0.8)\nsys.exit(1)\n')
+    p = psutil.Popen(['python', RUNNER, f'python {script}', '-st', '-as', '0.2', '-lf', 'columnar'], cwd=tmp_path,
+                     stdout=PIPE, stderr=PIPE)
+    p.communicate()
+
+    logs_dir = os.path.join(tmp_path, 'logs', os.listdir(tmp_path / 'logs')[0])
+    with ColumnarLog(os.path.join(logs_dir, 'python_0_memory.col')) as log:
+        assert log.metadata['sampling']['slow_interval'] == 0.2 and log.metadata['sampling']['boosts'] >= 1
+        timestamps, rss = list(log.column('info', 'timestamp')), list(log.column('info', 'rss'))
+    gaps = [later - earlier for earlier, later in zip(timestamps, timestamps[1:])]
+    jump = next(index for index in range(1, len(rss)) if rss[index] - rss[index - 1] > 40 << 20)
+    # Slow before the jump, fast right after it, and slow again once stable
+    assert gaps[jump - 2] > 0.1
+    assert all(gap < 0.1 for gap in gaps[jump:jump + 5])
+    assert gaps[-2] > 0.1
+
+
+def test_should_boost_the_sampling_rate_on_anomalies_until_stable_again():
+    process = psutil.Popen(['python', '-c', 'import sys\ndata = []\nfor line in sys.stdin:\n'
+                            '    data.append(b"x" * (10 << 20))\n    print(flush=True)\n'],
+                           stdin=PIPE, stdout=PIPE)
+
+    def grow():
+        process.stdin.write(b'\n')
+        process.stdin.flush()
+        process.stdout.readline()
+
+    grow()  # Started up, idle from then on
+    memory = Memory(process, 'python', 0, logging.getLogger(__name__))
+    sampler = Sampler(process, [memory], logging.getLogger(__name__), interval=0.01, tree=memory.tree,
+                      slow_interval=0.2, calm_ticks=3)
+    try:
+        # Startup is sampled fast, until stable
+        for _ in range(3):
+            assert sampler.boosted
+            sampler.tick()
+        assert not sampler.boosted
+
+        grow()
+        sampler.tick()
+        assert sampler.boosted and sampler.stats.boosts == 1
+
+        for _ in range(3):
+            assert sampler.boosted
+            sampler.tick()
+        assert not sampler.boosted and sampler.stats.boosts == 1
+    finally:
+        memory.tree.close()
+        process.kill()
+        process.wait()
+
+
+def test_should_run_many_iterations_concurrently_from_the_library(tmp_path):
+    outcomes = asyncio.run(run_many('ls zzz', 6, concurrency=3, failed_count=4, capture_output=True))
+
+    assert [outcome.iteration for outcome in outcomes] == [0, 1, 2, 3, 4, 5][:len(outcomes)]
+    assert 4 <= len(outcomes) <= 6
+    assert all(outcome.result.return_code == 2 and b'zzz' in outcome.stderr for outcome in outcomes)
+
+    outcomes = asyncio.run(run_many('sleep 5', 2, concurrency=2, timeout=0.2))
+    assert [outcome.result.timed_out for outcome in outcomes] == [True, True]
+    assert all(outcome.result.wall_time < 5 for outcome in outcomes)
+
+
+def test_should_count_commands_that_cannot_run_as_failed_from_the_library():
+    outcomes = asyncio.run(run_many('no_such_command_zzz', 3, concurrency=2, capture_output=True))
+
+    assert [outcome.result.return_code for outcome in outcomes] == [127, 127, 127]
+    assert all(b'no_such_command_zzz' in outcome.stderr for outcome in outcomes)
+
+
+def test_should_cancel_running_iterations_from_the_library_once_failed_count_is_reached(tmp_path):
+    script = tmp_path / 'first_fails.sh'
+    script.write_text(f'#!/bin/sh\nif mkdir {tmp_path}/lock 2>/dev/null; then exit 1; fi\nsleep 30\n')
+    script.chmod(0o755)
+    started = time.monotonic()
+    outcomes = asyncio.run(run_many(str(script), 10, concurrency=3, failed_count=1, capture_output=True))
+
+    assert time.monotonic() - started < 10
+    assert [outcome.result.return_code for outcome in outcomes] == [1]
+    assert not [process for process in psutil.process_iter(['cmdline']) if process.info['cmdline'] == ['sleep', '30']]
+
+
+def test_should_report_failure_diff(tmp_path):
+    script = tmp_path / 'flaky.sh'
+    script.write_text(f'#!/bin/sh\nif [ -e {tmp_path}/failed ]; then echo passed; exit 0; fi\n'
+                      f'touch {tmp_path}/failed\necho refused >&2\nexit 1\n')
+    script.chmod(0o755)
+    p = psutil.Popen(['python', RUNNER, str(script), '-c', '3', '-lt', '-fd'], cwd=tmp_path, stdout=PIPE, stderr=PIPE)
+    p.communicate()
+
+    with open(os.path.join(tmp_path, 'logs', os.listdir(tmp_path / 'logs')[0], 'flaky.sh_all_failure_diff.log')) as fd:
+        report = fd.read()
+    assert '1 failed and 2 successful iterations' in report
+    assert re.search(r'stderr hash \w+: in 100.0% of failures, 0.0% of successes', report)
+
+
+def test_should_store_repeated_log_files_once(tmp_path):
+    p = psutil.Popen(['python', RUNNER, 'ls zzz', '-c', '3', '-lt', '-dd'], cwd=tmp_path, stdout=PIPE, stderr=PIPE)
+    p.communicate()
+
+    logs_dir = os.path.join(tmp_path, 'logs', os.listdir(tmp_path / 'logs')[0])
+    assert sorted(name for name in os.listdir(logs_dir) if name != 'blobs') == \
+        ['ls_0_manifest.json', 'ls_1_manifest.json', 'ls_2_manifest.json']
+    assert sum(len(files) for _, _, files in os.walk(os.path.join(logs_dir, 'blobs'))) == 2  # Empty stdout, stderr
+
+    paths = restore(os.path.join(logs_dir, 'ls_2_manifest.json'), str(tmp_path))
+    assert sorted(os.path.basename(path) for path in paths) == ['ls_2_stderr.log', 'ls_2_stdout.log']
+    with open(tmp_path / 'ls_2_stderr.log', 'rb') as fd:
+        assert b'zzz' in fd.read()
+
+
+def test_should_account_iterations_in_cgroups_or_fall_back(tmp_path):
+    json_path = str(tmp_path / 'summary.json')
+    p = psutil.Popen(['python', RUNNER, 'echo OK', '-c', '3', '-cg', '-sj', json_path], cwd=tmp_path, stdout=PIPE,
+                     stderr=PIPE, encoding='ascii')
+    p.communicate()
+    assert p.returncode == 0
+
+    with open(json_path) as fd:
+        summary = json.load(fd)
+    assert summary['return_codes'] == [{'return_code': 0, 'frequency': 3, 'iterations': [[0, 2]]}]
+    assert summary['resource_usage']['cpu_time']['count'] == 3
+
+
+def test_should_leave_nothing_under_the_cgroup_of_the_runner(tmp_path):
+    try:
+        parent = own_cgroup()
+    except EnvironmentError:
+        pytest.skip('cgroup v2 is not mounted')
+    if not os.access(os.path.join(parent, 'cgroup.procs'), os.W_OK):
+        pytest.skip('cgroup v2 is not delegated')
+    children = set(name for name in os.listdir(parent) if os.path.isdir(os.path.join(parent, name)))
+
+    p = psutil.Popen(['python', RUNNER, 'false', '-c', '3', '-j', '2', '-cg'], cwd=tmp_path, stdout=PIPE,
+                     stderr=PIPE)
+    p.communicate()
+    assert set(name for name in os.listdir(parent) if os.path.isdir(os.path.join(parent, name))) == children
+
+
+def test_should_account_network_traffic_of_the_tcp_sockets_of_the_command(tmp_path):
+    try:
+        SockDiag().close()
+    except OSError:
+        pytest.skip('sock_diag is not available')
+    script = tmp_path / 'send.py'
+    script.write_text('import socket, sys, time\n'
+                      'server = socket.create_server(("127.0.0.1", 0))\n'
+                      'client = socket.create_connection(server.getsockname())\n'
+                      'peer, _ = server.accept()\n'
+                      'client.sendall(b"x" * 1000000)\n'
+                      'received = 0\n'
+                      'while received < 1000000:\n'
+                      '    received += len(peer.recv(1 << 16))\n'
+                      'time.sleep(1.5)\n'
+                      'sys.exit(1)\n')
+    p = psutil.Popen(['python', RUNNER, f'python {script}', '-st'], cwd=tmp_path, stdout=PIPE, stderr=PIPE)
+    p.communicate()
+
+    logs_dir = os.path.join(tmp_path, 'logs', os.listdir(tmp_path / 'logs')[0])
+    with open(os.path.join(logs_dir, 'python_0_network.log')) as fd:
+        log = fd.read()
+    assert 'traffic is that of the TCP sockets of its process tree' in log
+    totals = re.search(r"^Total network IO counters: {'rx_bytes': (\d+), 'rx_packets': \d+, 'tx_bytes': (\d+)",
+                       log, re.MULTILINE)
+    # Both ends of the connection are sockets of the command
+    assert int(totals.group(1)) >= 1000000 and int(totals.group(2)) >= 1000000
+
+
+def test_should_not_leak_files_of_a_proc_reader_that_cannot_open(monkeypatch):
+    try_open = ProcReader._ProcReader__try_open
+
+    def fail_on_statm(self, name, missing_ok=False):
+        if name == 'statm':
+            raise psutil.NoSuchProcess(self.pid)
+        return try_open(self, name, missing_ok)
+
+    monkeypatch.setattr(ProcReader, '_ProcReader__try_open', fail_on_statm)
+    files = len(os.listdir('/proc/self/fd'))
+    with pytest.raises(psutil.NoSuchProcess):
+        ProcReader(os.getpid())
+    assert len(os.listdir('/proc/self/fd')) == files
+
+
+def test_should_record_unexpected_sampling_errors_in_the_metric_log():
+    class BrokenDiskIO(DiskIO):
+        def sample(self, timestamp: float = None):
+            raise ValueError('unparsable counters')
+
+    process = psutil.Popen(['sleep', '1'])
+    try:
+        logger = logging.getLogger(__name__)
+        broken, memory = BrokenDiskIO(process, 'sleep', 0, logger), Memory(process, 'sleep', 0, logger)
+        sampler = Sampler(process, [broken, memory], logger, tree=memory.tree)
+        assert sampler.tick() and sampler.tick()
+    finally:
+        process.kill()
+        process.wait()
+        memory.tree.close()
+
+    assert broken.sampling_error == 'ValueError: unparsable counters'
+    assert len(list(memory.info.rows())) == 2
+    log = io.StringIO()
+    broken._write_text(log)
+    assert 'Sampling stopped early on an error: ValueError: unparsable counters' in log.getvalue()
+
+
+def test_should_evict_the_oldest_samples_past_the_sample_capacity(tmp_path):
+    script = tmp_path / 'slow_fail.sh'
+    script.write_text('#!/bin/sh\nsleep 0.5\nexit 1\n')
+    script.chmod(0o755)
+    p = psutil.Popen(['python', RUNNER, str(script), '-st', '-lf', 'columnar', '-sc', '5'], cwd=tmp_path,
+                     stdout=PIPE, stderr=PIPE)
+    p.communicate()
+
+    logs_dir = os.path.join(tmp_path, 'logs', os.listdir(tmp_path / 'logs')[0])
+    with ColumnarLog(os.path.join(logs_dir, 'slow_fail.sh_0_memory.col')) as log:
+        assert log.rows('info') == 5
+        assert log.metadata['evicted']['info'] > 0
+        assert log.metadata['evicted']['info'] + 5 == log.metadata['sampling']['ticks']
+        timestamps = list(log.column('info', 'timestamp'))
+        assert timestamps == sorted(timestamps)
+
+
+def test_should_keep_only_the_samples_of_the_retained_seconds(tmp_path):
+    script = tmp_path / 'slow_fail.sh'
+    script.write_text('#!/bin/sh\nsleep 0.5\nexit 1\n')
+    script.chmod(0o755)
+    p = psutil.Popen(['python', RUNNER, str(script), '-st', '-lf', 'columnar', '-si', '0.01', '-rs', '0.1'],
+                     cwd=tmp_path, stdout=PIPE, stderr=PIPE)
+    p.communicate()
+
+    logs_dir = os.path.join(tmp_path, 'logs', os.listdir(tmp_path / 'logs')[0])
+    with ColumnarLog(os.path.join(logs_dir, 'slow_fail.sh_0_memory.col')) as log:
+        assert log.rows('info') == 10
+        assert log.metadata['evicted']['info'] + 10 == log.metadata['sampling']['ticks']
+
+
+def test_should_reuse_scratch_files_and_leave_nothing_of_successful_iterations(tmp_path):
+    first = SpillBuffer(threshold=4)
+    first.write(b'spilled')
+    path = first.path
+    first.close()
+    assert os.path.getsize(path) == 0  # Truncated rather than removed
+
+    second = SpillBuffer(threshold=4)
+    second.write(b'spilled again')
+    assert second.path == path and second.getvalue() == b'spilled again'
+    second.close()
+
+    # Outputs past the spill threshold go to scratch files, which successful iterations do not promote
+    p = psutil.Popen(['python', RUNNER, 'head -c 3000000 /dev/zero', '-c', '3', '-lt', '-st'], cwd=tmp_path,
+                     stdout=PIPE, stderr=PIPE)
+    p.communicate()
+    assert p.returncode == 0
+    assert [files for _, _, files in os.walk(tmp_path / 'logs')] in ([], [[]])
+
+
+def test_should_downsample_samples_into_min_max_mean_windows(tmp_path):
+    store = SampleStore(('rss',), window=3)
+    for value in (4, 1, 7, 10, 2):
+        store.append([value], timestamp=0)
+    assert [{key: row[key] for key in ('samples', 'rss_min', 'rss_max', 'rss_mean')} for row in store.rows()] == \
+        [{'samples': 3, 'rss_min': 1, 'rss_max': 7, 'rss_mean': 4}, {'samples': 2, 'rss_min': 2, 'rss_max': 10,
+                                                                      'rss_mean': 6}]
+
+    script = tmp_path / 'slow_fail.sh'
+    script.write_text('#!/bin/sh\nsleep 0.3\nexit 1\n')
+    script.chmod(0o755)
+    p = psutil.Popen(['python', RUNNER, str(script), '-st', '-lf', 'columnar', '-ds', '4'], cwd=tmp_path,
+                     stdout=PIPE, stderr=PIPE)
+    p.communicate()
+
+    logs_dir = os.path.join(tmp_path, 'logs', os.listdir(tmp_path / 'logs')[0])
+    with ColumnarLog(os.path.join(logs_dir, 'slow_fail.sh_0_memory.col')) as log:
+        assert {'samples', 'rss_min', 'rss_max', 'rss_mean'} <= set(log.columns('info'))
+        assert 'rss' not in log.columns('info')
+        rows = log.table('info')
+        samples = list(rows['samples'])
+        assert len(samples) > 1 and set(samples[:-1]) == {4} and 1 <= samples[-1] <= 4
+        assert sum(samples) == log.metadata['sampling']['ticks']
+        assert all(low <= mean <= high for low, mean, high in zip(rows['rss_min'], rows['rss_mean'], rows['rss_max']))
+
+
+def test_should_read_the_same_values_through_persistent_proc_files_as_through_fresh_ones():
+    # Idle between allocations, so its files do not change between both reads
+    process = psutil.Popen(['python', '-c', 'import sys\ndata = []\nfor line in sys.stdin:\n'
+                            '    data.append(bytearray(10 ** 7))\n    print(flush=True)\n'],
+                           stdin=PIPE, stdout=PIPE)
+    reader = ProcReader(process.pid)
+    try:
+        for _ in range(3):
+            process.stdin.write(b'\n')
+            process.stdin.flush()
+            process.stdout.readline()
+
+            with open(f'/proc/{process.pid}/statm') as fd:
+                pages = [int(value) for value in fd.read().split()]
+            rss, vms = reader.memory_info()[:2]
+            assert (rss, vms) == (pages[1] * os.sysconf('SC_PAGE_SIZE'), pages[0] * os.sysconf('SC_PAGE_SIZE'))
+
+            with open(f'/proc/{process.pid}/stat') as fd:
+                fields = fd.read().rsplit(')', 1)[1].split()
+            reader.read_stat()
+            ticks = os.sysconf('SC_CLK_TCK')
+            assert reader.cpu_times()[:2] == (int(fields[11]) / ticks, int(fields[12]) / ticks)
+            assert reader.num_threads() == int(fields[17])
+
+            with open(f'/proc/{process.pid}/io') as fd:
+                io_values = dict(line.split(': ') for line in fd.read().splitlines())
+            assert reader.io_counters()[2:4] == (int(io_values['read_bytes']), int(io_values['write_bytes']))
+
+            if os.path.exists(f'/proc/{process.pid}/smaps_rollup'):
+                with open(f'/proc/{process.pid}/smaps_rollup') as fd:
+                    pss = [int(line.split()[1]) * 1024 for line in fd if line.startswith('Pss:')][0]
+                assert reader.read_pss() == pss
+
+            with open(f'/proc/{process.pid}/net/dev', 'rb') as fd:
+                interfaces = [line.split(b':')[0] for line in fd.read().splitlines()[2:]]
+            assert [line.split(b':')[0] for line in reader.read_net_dev().splitlines()[2:]] == interfaces
+    finally:
+        reader.close()
+        process.kill()
+        process.wait()
+
+
+def test_should_pick_up_descendants_forked_after_the_first_scan_of_the_process_tree():
+    process = psutil.Popen(['sh', '-c', 'read line; sleep 30 & read line'], stdin=PIPE)
+    tree = ProcessTree(process, logging.getLogger(__name__))
+    try:
+        tree.refresh()
+        assert tree.descendants() == [] and tree.refresh() == []
+        generation = tree.generation
+
+        process.stdin.write(b'\n')
+        process.stdin.flush()
+        deadline = time.monotonic() + 10
+        while not process.children():
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        sleep = process.children()[0]
+
+        assert [child.pid for child in tree.refresh()] == [sleep.pid]
+        assert [child.pid for child in tree.descendants()] == [sleep.pid]
+        assert tree.generation > generation
+        assert tree.refresh() == []
+    finally:
+        tree.close()
+        for child in process.children():
+            child.kill()
+        process.kill()
+        process.wait()
+
+
+def test_should_sample_on_a_fixed_schedule_at_the_sample_interval():
+    process = psutil.Popen(['sleep', '5'])
+    memory = Memory(process, 'sleep', 0, logging.getLogger(__name__))
+    sampler = Sampler(process, [memory], logging.getLogger(__name__), interval=0.05, tree=memory.tree)
+    try:
+        sampler.start()
+        time.sleep(1)
+        sampler.stop()
+    finally:
+        memory.tree.close()
+        process.kill()
+        process.wait()
+
+    # One sample per interval rather than as many as possible, each on its slot of the schedule
+    assert 16 <= sampler.stats.ticks <= 22 and sampler.stats.ticks + sampler.stats.missed <= 22
+    assert 16 <= sampler.stats.rate <= 22
+    # Slots are offsets from the start, so lateness does not accumulate
+    timestamps = [row['timestamp'] for row in memory.info.rows()]
+    offsets = [(timestamp - timestamps[0]) / 0.05 for timestamp in timestamps]
+    assert all(abs(offset - round(offset)) * 0.05 < 0.015 for offset in offsets)
+    assert memory.sampling_stats is sampler.stats and 'Jitter: mean' in str(sampler.stats)
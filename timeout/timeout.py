@@ -0,0 +1,93 @@
+import threading
+import logging
+import psutil
+import signal
+import os
+
+KILL_GRACE = 5  # Seconds between SIGTERM and SIGKILL
+
+
+class Timeout:
+    """
+    Kill the process group of a command once it ran for too long.
+    On expiry, SIGTERM is sent to the whole group, then SIGKILL if it is
+    not done within a grace period, so descendants that ignore SIGTERM or
+    keep the output pipes open do not hang the iteration either.
+    The command must lead its own process group.
+    """
+
+    def __init__(self, pgid: int, seconds: float, debug_logger: logging.Logger, grace: float = KILL_GRACE):
+        """
+        :param pgid: process group of the command, i.e. its pid.
+        :param seconds: time the command is allowed to run.
+        :param debug_logger: for print debugging.
+        :param grace: time between SIGTERM and SIGKILL, in seconds.
+        """
+        self.pgid = pgid
+        self.seconds = seconds
+        self.grace = grace
+        self.debug_logger = debug_logger
+        self.expired = False
+        self.__done = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name=f'timeout-{pgid}', daemon=True)
+
+    def start(self):
+        """
+        Start counting down.
+        """
+        self.__thread.start()
+
+    def cancel(self):
+        """
+        Stop counting down, or escalating if expired, once the command is done.
+        """
+        self.__done.set()
+        if self.__thread.is_alive():
+            self.__thread.join()
+
+    def __run(self):
+        if self.__done.wait(self.seconds):
+            return
+
+        self.expired = True
+        self.debug_logger.debug(f'Process group {self.pgid} timed out after {self.seconds}s, terminating it')
+        self.__signal(signal.SIGTERM)
+
+        if self.__done.wait(self.grace):
+            return
+
+        self.debug_logger.debug(f'Process group {self.pgid} still running after {self.grace}s, killing it')
+        self.__signal(signal.SIGKILL)
+
+    def __signal(self, signum: int):
+        try:
+            os.killpg(self.pgid, signum)
+        except ProcessLookupError:
+            pass  # Group already gone
+        except PermissionError as e:
+            self.debug_logger.debug(f'Could not signal process group {self.pgid}: {e}')
+
+
+def kill_tree(pid: int):
+    """
+    Kill a process along with its descendants, for commands not leading their own process group.
+    Descendants are found before it is killed, as they are re-parented then, each stopped before its
+    children are listed, so none can fork a process left out meanwhile.
+    :param pid: pid of the process.
+    """
+    processes = {}
+    pending = [pid]
+    while pending:
+        try:
+            process = psutil.Process(pending.pop())
+            process.suspend()
+            children = process.children()
+        except psutil.NoSuchProcess:
+            continue
+        processes[process.pid] = process
+        pending.extend(child.pid for child in children if child.pid not in processes)
+    for process in processes.values():
+        try:
+            process.kill()
+        except psutil.NoSuchProcess:
+            pass
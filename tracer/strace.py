@@ -0,0 +1,191 @@
+from loggable.loggable import Loggable, acquire_scratch_file, release_scratch_file, remove_file
+from typing import Dict, List, NamedTuple
+import logging
+import psutil
+import time
+import re
+
+FULL = 'full'
+SUMMARY = 'summary'
+MODES = (FULL, SUMMARY)
+ATTACH_TIMEOUT = 5  # Seconds
+ATTACH_POLL_INTERVAL = 0.001  # Seconds
+STOP_TIMEOUT = 5  # Seconds
+
+# Row of the 'strace -c' table: % time, seconds, usecs/call, calls, errors (may be empty), syscall
+SUMMARY_ROW = re.compile(r'^\s*[\d.]+\s+([\d.]+)\s+\d+\s+(\d+)\s+(\d*)\s*(\w+)\s*$')
+# Line of a full trace starting a system call, possibly prefixed by the pid (-f); resumed calls are not counted again
+CALL_LINE = re.compile(r'^(?:\d+\s+)?(\w+)\(')
+
+
+class SyscallStats(NamedTuple):
+    calls: int
+    errors: int
+    seconds: float
+
+
+class Strace(Loggable):
+    """
+    Trace the system calls of a command by running it under strace.
+    strace is started as a detached grandchild (-D), so the traced
+    command keeps the pid of the forked child and no call is missed
+    waiting for strace to attach. Being detached, strace is not reaped
+    along with the command: it is found once attached and waited for
+    before its trace is read or its scratch file released. The trace is
+    written to a scratch file, promoted to the log file if the command fails.
+    In summary mode, strace only counts the calls, errors and time of
+    each system call (-c), which is far cheaper than formatting every
+    call, and a compact table of these is logged instead of the trace.
+    """
+
+    def __init__(self, command: str, iteration: int, debug_logger: logging.Logger, mode: str = FULL):
+        """
+        :param command: command ran.
+        :param iteration: iteration number if command is ran multiple times.
+        :param debug_logger: for print debugging.
+        :param mode: 'full' to log every system call, 'summary' to log per system call statistics.
+        """
+        super().__init__(command, iteration, str(self), debug_logger)
+        self.mode = mode
+        self.tracer = None
+        self.__stopped = False  # Whether strace was waited for, and no longer writes the trace
+        self.trace_path = acquire_scratch_file('.trace')  # Truncated by strace on start
+
+    def wrap(self, split_command: List[str]) -> List[str]:
+        """
+        Wrap the command to be run under strace.
+        :param split_command: command as a list of arguments.
+        :return: wrapped command as a list of arguments.
+        """
+        options = ['-f', '-D', '-c'] if self.mode == SUMMARY else ['-f', '-D']
+        wrapped = ['strace'] + options + ['-o', self.trace_path, '--'] + split_command
+        self.debug_logger.debug(f'Running command {" ".join(wrapped)}')
+        return wrapped
+
+    def attach(self, pid: int):
+        """
+        Find the detached strace process tracing the command, to wait for it later.
+        The spawned process only executes the command once strace attached to it,
+        so its tracer is polled for until then, or until it exits or the deadline passes.
+        :param pid: pid of the traced command.
+        """
+        deadline = time.monotonic() + ATTACH_TIMEOUT
+        try:
+            while True:
+                tracer_pid, state = self.__read_status(pid)
+                if tracer_pid:
+                    self.tracer = psutil.Process(tracer_pid)
+                    return
+                if state in ('Z', 'X') or time.monotonic() > deadline:
+                    break
+                time.sleep(ATTACH_POLL_INTERVAL)
+        except (EnvironmentError, psutil.Error) as e:
+            self.debug_logger.debug(f'Could not find strace process of {pid}: {e}')
+            return
+        self.debug_logger.debug(f'strace did not attach to {pid} within {ATTACH_TIMEOUT}s')
+
+    def wait(self):
+        """
+        Wait for strace to finish writing the trace, once the command exited.
+        """
+        if self.tracer is None:
+            return
+
+        try:
+            self.tracer.wait(STOP_TIMEOUT)
+        except psutil.TimeoutExpired:
+            self.debug_logger.debug(f'strace did not exit within {STOP_TIMEOUT}s, killing it')
+            try:
+                self.tracer.kill()
+                self.tracer.wait(STOP_TIMEOUT)
+            except psutil.Error:
+                pass
+        except psutil.NoSuchProcess:
+            pass
+        self.tracer = None
+        self.__stopped = True
+
+    def summary(self) -> Dict[str, SyscallStats]:
+        """
+        Parse the statistics of a summary mode trace.
+        :return: dict of system call name to its statistics.
+        """
+        stats = {}
+        with open(self.trace_path) as fd:
+            for line in fd:
+                match = SUMMARY_ROW.match(line)
+                if match and match.group(4) != 'total':
+                    seconds, calls, errors, name = match.groups()
+                    stats[name] = SyscallStats(int(calls), int(errors or 0), float(seconds))
+        return stats
+
+    def histogram(self) -> Dict[str, int]:
+        """
+        Count the calls of each system call, from the statistics in summary mode or the trace in full mode.
+        :return: dict of system call name to its number of calls.
+        """
+        if self.mode == SUMMARY:
+            return {name: stats.calls for name, stats in self.summary().items()}
+
+        calls = {}
+        with open(self.trace_path, errors='replace') as fd:
+            for line in fd:
+                match = CALL_LINE.match(line)
+                if match:
+                    name = match.group(1)
+                    calls[name] = calls.get(name, 0) + 1
+        return calls
+
+    def dump_to_file(self):
+        """
+        Dump the trace, or the table of system call statistics in summary mode, to a file.
+        """
+        self.debug_logger.debug(f'Dumping to file strace of command {self.command} at iteration {self.iteration}')
+
+        try:
+            if self.mode == FULL:
+                self._promote(self.trace_path, 'trace')
+                return
+
+            stats = self.summary()
+            with self._open_log('trace') as fd:
+                print(f'{"syscall":<24}{"calls":>10}{"errors":>10}{"total ms":>12}{"avg us":>10}', file=fd)
+                for name, stat in sorted(stats.items(), key=lambda item: item[1].seconds, reverse=True):
+                    print(f'{name:<24}{stat.calls:>10}{stat.errors:>10}{stat.seconds * 1000:>12.3f}'
+                          f'{stat.seconds * 1e6 / stat.calls if stat.calls else 0:>10.1f}', file=fd)
+                print(f'\nTotal: {sum(stat.calls for stat in stats.values())} calls,'
+                      f' {sum(stat.errors for stat in stats.values())} errors,'
+                      f' {len(stats)} distinct system calls', file=fd)
+
+        except EnvironmentError as e:
+            print(e)
+
+    def discard(self):
+        """
+        Release the scratch file of the trace, if it was not dumped.
+        It is only given back to be reused once strace exited, and removed
+        if strace could not be waited for, as it may still write to it.
+        """
+        self.wait()
+        if self.__stopped:
+            release_scratch_file(self.trace_path)
+        else:
+            remove_file(self.trace_path)
+
+    @staticmethod
+    def __read_status(pid: int):
+        """
+        :return: tuple of the tracer pid, 0 if not traced, and the state of a process.
+        """
+        tracer_pid, state = 0, None
+        with open(f'/proc/{pid}/status') as fd:
+            for line in fd:
+                if line.startswith('State:'):
+                    state = line.split()[1]
+                elif line.startswith('TracerPid:'):
+                    tracer_pid = int(line.split()[1])
+                    break
+        return tracer_pid, state
+
+    def __str__(self):
+        return 'strace'
@@ -0,0 +1,85 @@
+from loggable.loggable import Loggable, acquire_scratch_file, release_scratch_file
+from subprocess import PIPE, DEVNULL
+import subprocess
+import logging
+import select
+import signal
+import psutil
+
+READY_TIMEOUT = 5  # Seconds
+STOP_TIMEOUT = 5  # Seconds
+
+
+class Tcpdump(Loggable):
+    """
+    Capture the network traffic during the command execution with tcpdump.
+    tcpdump is started before the command and waited for until it listens,
+    so that no traffic of the command is missed. The capture is written
+    to a scratch file, promoted to the pcap file if the command fails.
+    """
+
+    def __init__(self, command: str, iteration: int, debug_logger: logging.Logger):
+        """
+        :param command: command ran.
+        :param iteration: iteration number if command is ran multiple times.
+        :param debug_logger: for print debugging.
+        """
+        super().__init__(command, iteration, str(self), debug_logger)
+        self.pcap_path = acquire_scratch_file('.pcap')  # Truncated by tcpdump on start
+        self.process = None
+
+    def start(self):
+        """
+        Start capturing and wait for tcpdump to listen.
+        """
+        split_command = ['tcpdump', '-i', 'any', '-w', self.pcap_path]
+        self.debug_logger.debug(f'Running command {" ".join(split_command)}')
+        self.process = psutil.Popen(split_command, stdout=DEVNULL, stderr=PIPE)
+
+        # tcpdump reports on stderr once it listens
+        ready, _, _ = select.select([self.process.stderr], [], [], READY_TIMEOUT)
+        if ready:
+            line = self.process.stderr.readline()
+            self.debug_logger.debug(f'tcpdump: {line.decode(errors="replace").strip()}')
+        else:
+            self.debug_logger.debug(f'tcpdump did not report listening within {READY_TIMEOUT}s')
+
+    def stop(self):
+        """
+        Pass Ctrl+C to tcpdump and wait for it to flush the capture, if not done already.
+        """
+        if self.process is None:
+            return
+
+        self.debug_logger.debug('Passing Ctrl+C to tcpdump')
+        self.process.send_signal(signal.SIGINT)
+        try:
+            # The remaining stderr output is a few lines of statistics, small enough not to block tcpdump
+            self.process.wait(STOP_TIMEOUT)
+        except (psutil.TimeoutExpired, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        finally:
+            self.process.stderr.close()
+            self.process = None
+
+    def dump_to_file(self):
+        """
+        Dump the capture to a pcap file.
+        """
+        self.debug_logger.debug(f'Dumping to file network traffic of command {self.command}'
+                                f' at iteration {self.iteration}')
+
+        try:
+            self._promote(self.pcap_path, 'pcap')
+        except EnvironmentError as e:
+            print(e)
+
+    def discard(self):
+        """
+        Release the scratch file of the capture, if it was not dumped.
+        """
+        release_scratch_file(self.pcap_path)
+
+    def __str__(self):
+        return 'net_trace'